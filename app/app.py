@@ -5,9 +5,16 @@ from remi import start, App
 
 import config.styles as css
 from config.config import Config
+from core.history import ensure_events_index
 from core.history_widget import HistoryWidget
+from core.notifications import NOTIFICATIONS
+from core.preview import PREVIEW_STREAM
+from core.webhooks import WEBHOOKS
+from core.routes import dispatch
 from core.resources_widget import SystemResourcesWidget
+from core.retention import RETENTION_MANAGER
 from core.settings_widget import AppSettingsWidget
+from core.ui_updates import UI_UPDATES
 
 
 class CleverCameraApp(App):
@@ -17,13 +24,25 @@ class CleverCameraApp(App):
             *args, static_file_path={"static": resources_path}
         )
 
+    def _process_all(self, func, **kwargs):
+        # serve snapshots and other plain routes without going through remi
+        if not dispatch(self, func):
+            super()._process_all(func, **kwargs)
+
     def idle(self):
         self.resources.update()
+        # widget updates posted by the background threads
+        UI_UPDATES.flush()
 
     def main(self):
 
         # Keep application instance in the global shared variable
         Config.APP_INSTANCE = self
+        # keep snapshots folder within the disk budget
+        RETENTION_MANAGER.start()
+        # send notifications queued before restart
+        NOTIFICATIONS.start()
+        WEBHOOKS.start()
         # add bootstrap
         self.page.children["head"].add_child("additional_head_data", css.HTML_HEAD)
 
@@ -37,18 +56,33 @@ class CleverCameraApp(App):
         tabs.add_tab(self.settings, "Settings")
         tabs.add_tab(self.resources, "System")
         tabs.select_by_index(0)
+        tabs.on_tab_selection.do(self.on_tab_selected)
         return tabs
 
+    def on_tab_selected(self, emitter, key):
+        # render camera preview only when settings tab is visible
+        selected_widget = emitter.children.get(key)
+        self.settings.camera_widget.set_preview_visible(
+            selected_widget is self.settings
+        )
+
 
 if __name__ == "__main__":
-    start(
-        CleverCameraApp,
-        title="Clever-Camera",
-        address="0.0.0.0",
-        username=Config.APP_USERNAME,
-        password=Config.APP_PASSWORD,
-        debug=True,
-        port=Config.APP_PORT,
-        start_browser=False,
-        enable_file_cache=True,
-    )
+    # rebuild new or outdated index before monitoring saves events
+    ensure_events_index()
+    try:
+        start(
+            CleverCameraApp,
+            title="Clever-Camera",
+            address="0.0.0.0",
+            username=Config.APP_USERNAME,
+            password=Config.APP_PASSWORD,
+            debug=True,
+            port=Config.APP_PORT,
+            start_browser=False,
+            enable_file_cache=True,
+        )
+    finally:
+        # stream is shared by all sessions, it is finished only when the
+        # server stops, so the server threads can exit
+        PREVIEW_STREAM.close()
@@ -1,21 +1,33 @@
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional, TYPE_CHECKING
 
 import yaml
-from remi import App
 import os
 
+if TYPE_CHECKING:
+    from remi import App
+
 
 DAY_FORMAT = "%Y-%m-%d"
 HOUR_FORMAT = "%H:%M:%S"
 DATE_FORMAT = f"{DAY_FORMAT} {HOUR_FORMAT}"
+# events dates are saved with milliseconds, older events without them
+DATE_MS_FORMAT = f"{DATE_FORMAT}.%f"
 # the number of seconds between to events to be
 # considered as two different events
 EVENTS_SEQUENCE_SEPARATION = 5
 
 
+def get_optional_env(name: str, cast: Callable[[str], Any]) -> Optional[Any]:
+    """Returns environment variable converted with cast, None if not set"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return None
+    return cast(value)
+
+
 class Config:
-    APP_INSTANCE: App = None
+    APP_INSTANCE: "App" = None
     APP_USERNAME: Optional[str] = os.environ.get("APP_USERNAME")
     APP_PASSWORD: Optional[str] = os.environ.get("APP_PASSWORD")
     APP_PORT: int = 4000
@@ -23,13 +35,101 @@ class Config:
     MODELS_DIR = Path("models")
     STATIC_DATA_DIR = Path("app/static")
     SNAPSHOTS_DIR = DATA_DIR / Path("snapshots")
+    # content-addressed snapshot files
+    BLOBS_DIR = SNAPSHOTS_DIR / Path("blobs")
     CONFIG_PATH = Path("data/settings.yaml")
+    EVENTS_INDEX_PATH = DATA_DIR / Path("events.db")
     CAMERA_SNAPSHOT_PREVIEW_SIZE = (1440, 1080)
+    # maximum number of camera previews rendered per second during monitoring
+    PREVIEW_MAX_FPS = 1.0
+    # live preview resolutions: name -> (max size, JPEG quality), browser
+    # picks the tier from its viewport size
+    PREVIEW_TIERS = {
+        "small": ((480, 360), 60),
+        "medium": ((960, 720), 75),
+        "large": (CAMERA_SNAPSHOT_PREVIEW_SIZE, 85),
+    }
+    PREVIEW_DEFAULT_TIER = "medium"
+    # number of the most recent previews kept in the encoding cache
+    PREVIEW_CACHE_FRAMES = 2
     THUMBNAIL_SIZE = (224, 224)
     MINI_THUMBNAIL_SIZE = (128, 128)
     CAMERA_DEFAULT_IMAGE = STATIC_DATA_DIR / "images/placeholder.jpg"
     FONT_PATH = STATIC_DATA_DIR / "fonts/InputSans-Regular.ttf"
     LOGGER_HISTORY_SIZE = 5
+    # widget updates posted by background threads are applied by the UI
+    # thread at most every T seconds, up to N updates at once
+    UI_UPDATE_PERIOD = 0.2
+    UI_MAX_UPDATES = 20
+    # monitoring stages spans kept in memory, exported from the System tab
+    TRACING_ENABLED: bool = os.environ.get("TRACING_ENABLED", "0") == "1"
+    TRACING_MAX_SPANS = 20000
+    # browser cache time [s] of the snapshots served from the disk
+    SNAPSHOTS_CACHE_MAX_AGE = 7 * 24 * 3600
+    # seconds after which link to the selected snapshots archive expires
+    DOWNLOAD_LINK_MAX_AGE = 600
+    # number of history events loaded at once in the History tab
+    HISTORY_PAGE_SIZE = 50
+    # events log is synced to the disk every N records or T seconds
+    EVENTS_LOG_FSYNC_RECORDS = 10
+    EVENTS_LOG_FSYNC_INTERVAL = 5.0
+    # size of the blocks read from the end of the events log [bytes]
+    EVENTS_LOG_TAIL_CHUNK = 8 * 1024
+    # snapshots are saved by background threads, monitoring loop blocks
+    # only when the writer queue is full
+    SNAPSHOT_WRITER_THREADS = 1
+    SNAPSHOT_WRITER_QUEUE_SIZE = 32
+    # snapshots folder disk budget, old full resolution images are removed
+    # first, thumbnails and history records are kept longer. Retention is
+    # disabled unless one of the limits is set
+    RETENTION_MAX_BYTES: Optional[int] = get_optional_env(
+        "RETENTION_MAX_GB", lambda value: int(float(value) * 2 ** 30)
+    )
+    RETENTION_MAX_DAYS: Optional[int] = get_optional_env("RETENTION_MAX_DAYS", int)
+    RETENTION_THUMBNAILS_MAX_DAYS: Optional[int] = get_optional_env(
+        "RETENTION_THUMBNAILS_MAX_DAYS", int
+    )
+    # seconds between cleanups
+    RETENTION_PERIOD = 3600
+    # cleanup pauses for RETENTION_BATCH_PAUSE seconds every N removed files
+    RETENTION_BATCH_SIZE = 100
+    RETENTION_BATCH_PAUSE = 0.5
+    # email notifications are queued on the disk and retried with
+    # exponentially growing delay
+    NOTIFICATIONS_QUEUE_DIR = DATA_DIR / Path("notifications")
+    NOTIFICATIONS_MAX_ATTEMPTS = 10
+    NOTIFICATIONS_RETRY_DELAY = 30.0
+    NOTIFICATIONS_MAX_RETRY_DELAY = 3600.0
+    # attachments are downscaled and recompressed to fit the message budget
+    NOTIFICATIONS_ATTACHMENT_SIZE = (1280, 960)
+    NOTIFICATIONS_ATTACHMENTS_MAX_BYTES = 2 * 1024 * 1024
+    # webhook events are queued on the disk and posted in batches
+    WEBHOOK_QUEUE_DIR = DATA_DIR / Path("webhooks")
+    WEBHOOK_BATCH_SIZE = 20
+    # seconds to wait for more events before posting incomplete batch
+    WEBHOOK_BATCH_DELAY = 2.0
+    WEBHOOK_TIMEOUT = 10.0
+    WEBHOOK_MAX_ATTEMPTS = 10
+    WEBHOOK_RETRY_DELAY = 10.0
+    # notifications are limited by token buckets, one token per message:
+    # per channel (refilled with the frequency set in the UI) and per label
+    NOTIFICATIONS_BURST = 3
+    NOTIFICATIONS_LABEL_BURST = 2
+    NOTIFICATIONS_LABEL_PERIOD = 1800.0
+    # suppressed sequences are sent together in a periodic digest message,
+    # with montage thumbnail of up to N sequences
+    NOTIFICATIONS_DIGEST_PERIOD = 3600.0
+    NOTIFICATIONS_DIGEST_MAX_SEQUENCES = 12
+    NOTIFICATIONS_MONTAGE_IMAGES = 6
+    SMTP_HOST: str = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+    SMTP_PORT: int = int(os.environ.get("SMTP_PORT", 465))
+    SMTP_USE_SSL: bool = os.environ.get("SMTP_USE_SSL", "1") == "1"
+    SMTP_TIMEOUT = 30.0
+    # SMTP connection is kept open between messages and closed when idle
+    SMTP_IDLE_TIMEOUT = 120.0
+    # camera frames kept in memory and saved when events sequence starts
+    PRE_EVENT_BUFFER_SECONDS = 10
+    PRE_EVENT_BUFFER_MAX_BYTES = 20 * 1024 * 1024
 
     @staticmethod
     def list_models() -> List[str]:
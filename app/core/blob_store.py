@@ -0,0 +1,80 @@
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+from config.config import Config
+
+
+class BlobStore:
+    def __init__(self, root: Path):
+        """
+        Content-addressed storage of the snapshot files. Files are named by
+        the hash of their content and sharded into two levels of
+        directories, so identical frames are written to the disk only once.
+
+        Args:
+            root: blobs directory
+        """
+        self.root = Path(root)
+        self.lock = threading.Lock()
+        self.num_written = 0
+        self.num_duplicates = 0
+
+    def get_path(self, digest: str, suffix: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{suffix}"
+
+    def put(self, data: bytes, suffix: str = ".jpg") -> Path:
+        """
+        Save data unless blob with the same content already exists.
+
+        Returns:
+            path to the blob
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.get_path(digest, suffix)
+        if path.exists():
+            with self.lock:
+                self.num_duplicates += 1
+            return path
+
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with tmp_path.open("wb") as file:
+            file.write(data)
+        tmp_path.replace(path)
+        with self.lock:
+            self.num_written += 1
+        return path
+
+    def find_blob(self, path: Path) -> Optional[Path]:
+        """
+        Returns blob with the same content as the file, e.g. the blob linked
+        into the sequence folder, or None if there is no such blob.
+        """
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        blob_path = self.get_path(hashlib.sha1(data).hexdigest(), path.suffix)
+        if blob_path == path or not blob_path.exists():
+            return None
+        return blob_path
+
+    @staticmethod
+    def link(blob_path: Path, target: Path) -> None:
+        """
+        Make blob available under the target path without storing its
+        content again. Falls back to copy when hard links are not supported.
+        """
+        if target.exists():
+            return
+        try:
+            os.link(blob_path, target)
+        except OSError:
+            shutil.copyfile(blob_path, target)
+
+
+BLOB_STORE = BlobStore(Config.BLOBS_DIR)
@@ -1,13 +1,38 @@
 import threading
 import time
 from abc import abstractmethod, ABC
+from datetime import datetime
 from io import BytesIO
 from time import sleep
 from typing import Optional, Tuple
 import requests
 from PIL import Image
+from dataclasses import dataclass
 from requests.auth import HTTPBasicAuth, HTTPDigestAuth
-from core.widgets import PILImage
+from core.image_utils import PILImage
+from core.metrics import METRICS
+from core.tracing import TRACER
+
+CAMERA_FETCH_SECONDS = METRICS.histogram(
+    "camera_fetch_seconds", "Camera snapshot request and download time"
+)
+CAMERA_DECODE_SECONDS = METRICS.histogram(
+    "camera_decode_seconds", "Camera snapshot decoding time"
+)
+CAMERA_ERRORS = METRICS.counter("camera_errors_total", "Failed camera requests")
+
+
+@dataclass(frozen=True)
+class CameraFrame:
+    image: PILImage
+    # consecutive number of the frame captured by the client
+    frame_id: int
+    # monotonic clock time at which frame was received
+    timestamp: float
+    # wall clock time at which frame was received
+    date: datetime
+    # raw image bytes as received from the camera
+    jpeg_bytes: Optional[bytes] = None
 
 
 class BaseCameraClient(ABC):
@@ -16,6 +41,8 @@ class BaseCameraClient(ABC):
         self.password = password
         self.url = url
         self.image: Optional[PILImage] = None
+        self.frame: Optional[CameraFrame] = None
+        self.num_frames = 0
 
     @abstractmethod
     def is_valid(self) -> bool:
@@ -79,22 +106,33 @@ class JPEGCameraClient(BaseCameraClient):
             self.during_requesting_image = False
             return None, msg
 
+        # id of the frame if request succeeds
+        frame_id = self.num_frames + 1
         try:
-            response = self.session.get(self.url, timeout=self.timeout)
+            with TRACER.span("fetch", frame_id=frame_id):
+                response = self.session.get(self.url, timeout=self.timeout)
             if not response.ok:
                 msg = f"Bad response: {response}. Check url."
+                CAMERA_ERRORS.inc()
                 self.is_ok = False
                 self.msg = msg
                 self.during_requesting_image = False
                 return None, msg
             image_bytes = BytesIO()
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    image_bytes.write(chunk)
-            image = Image.open(image_bytes)
+            with TRACER.span("download", frame_id=frame_id):
+                for chunk in response.iter_content(chunk_size=1024):
+                    if chunk:
+                        image_bytes.write(chunk)
+            CAMERA_FETCH_SECONDS.observe(time.time() - start)
+            decode_span = TRACER.span("decode", frame_id=frame_id)
+            with CAMERA_DECODE_SECONDS.time(), decode_span:
+                image = Image.open(image_bytes)
+                image.load()
+            jpeg_bytes = image_bytes.getvalue()
         except Exception as error:
             msg = f"Cannot get image bytes: {error}"
 
+            CAMERA_ERRORS.inc()
             self.is_ok = False
             self.msg = msg
             self.during_requesting_image = False
@@ -106,6 +144,14 @@ class JPEGCameraClient(BaseCameraClient):
         self.msg = msg
         self.during_requesting_image = False
         self.image = image.copy()
+        self.num_frames += 1
+        self.frame = CameraFrame(
+            image=self.image,
+            frame_id=self.num_frames,
+            timestamp=time.monotonic(),
+            date=datetime.now(),
+            jpeg_bytes=jpeg_bytes if image.format == "JPEG" else None,
+        )
         return image, msg
 
     def get_async_snapshot(self) -> Tuple[Optional[Image.Image], str]:
@@ -113,15 +159,28 @@ class JPEGCameraClient(BaseCameraClient):
         Returns: current image camera frame and run background thread
             to download new one
         """
+        frame, msg = self.get_async_frame()
+        if frame is not None:
+            return frame.image, msg
+        return None, msg
+
+    def get_async_frame(self) -> Tuple[Optional[CameraFrame], str]:
+        """
+        Returns: latest camera frame together with its capture time and run
+            background thread to download new one. Note that returned frame
+            was requested during the previous call.
+        """
         while self.during_requesting_image:
             # wait for the last request to finish, simple single
             # element queue implementation
             sleep(0.01)
+        # keep reference before the background thread replaces it
+        frame, is_ok, msg = self.frame, self.is_ok, self.msg
         cameraThread = threading.Thread(target=self.get_snapshot)
         cameraThread.start()
-        if self.is_ok:
-            return self.image, self.msg
-        return None, self.msg
+        if is_ok:
+            return frame, msg
+        return None, msg
 
 
 def get_camera_client(
@@ -1,18 +1,35 @@
-import threading
 import time
-from datetime import datetime
-from time import sleep
-from typing import Optional, Dict, Any, Tuple, List, Iterator
+from typing import Optional, Dict, Any, Iterator
 
 import remi.gui as gui
 from PIL import Image
 
-from config.config import Config, EVENTS_SEQUENCE_SEPARATION
-from core.base_predictor import ClassificationOutput
-from core.camera_client import get_camera_client, BaseCameraClient
+from config.config import Config
+from core.history import EventsSequence
+from core.monitoring import (
+    MonitoringEngine,
+    MonitoringObserver,
+    MONITORING_RUNNING,
+    MONITORING_SLEEPING,
+)
+from core.preview import PreviewRenderer, PREVIEW_STREAM
+from core.routes import PREVIEW_STREAM_URL, get_preview_srcset
+from core.settings import (
+    CameraSettings,
+    NAME,
+    SCHEDULE,
+    MODEL_NAME,
+    URL,
+    USER,
+    PASSWORD,
+    CHECK_PERIOD,
+    CAMERA_TIMEOUT,
+    MAX_SEQUENCE_LENGTH,
+)
+from core.tracing import TRACER
+from core.ui_updates import UI_UPDATES
 from core.widgets import (
     PILImage,
-    PILImageWidget,
     LoggerWidget,
     SettingsWidget,
     ROIWidget,
@@ -21,30 +38,27 @@ from core.widgets import (
     SButton,
     MonitoringScheduleWidget,
 )
-from core.history_widget import append_snapshots_history
-from core.tflite_classifier_predictor import TFClassifierPredictor
-
-NAME = "camera_name"
-MODEL_NAME = "model_name"
-URL = "url"
-USER = "user"
-PASSWORD = "password"
-CHECK_PERIOD = "check_period"
-CAMERA_TIMEOUT = "timeout"
-MAX_SEQUENCE_LENGTH = "max_sequence_length"
+
 MONITORING_RUN_ICON = "fa-play-circle"
 MONITORING_RUNNING_ICON = "fa-play-circle fa-spin"
 MONITORING_SLEEP_ICON = "fa-bed fa-spin"
-MEAN_CHANGE_THRESHOLD = 0.01
+# displayed when preview is not visible, so the browser closes the stream
+PREVIEW_PLACEHOLDER_URL = "/static:images/placeholder.jpg"
+# preview width relative to the viewport, used to select the stream tier
+PREVIEW_SIZES = "60vw"
 
 
-class CameraWidget(SettingsWidget):
+class CameraWidget(SettingsWidget, MonitoringObserver):
     def __init__(self, *args, **kwargs):
         super(CameraWidget, self).__init__(*args, **kwargs)
-        self.camera_client: Optional[BaseCameraClient] = None
-        self.predictor: Optional[TFClassifierPredictor] = None
+        self.engine = MonitoringEngine()
+        self.engine.add_observer(self)
         self.placeholder_cam_image = Image.open(Config.CAMERA_DEFAULT_IMAGE)
-        self.is_running = False
+        self.preview_renderer = PreviewRenderer(
+            max_size=Config.CAMERA_SNAPSHOT_PREVIEW_SIZE,
+            max_fps=Config.PREVIEW_MAX_FPS,
+        )
+        self.is_preview_visible = False
         self.reload_cam_btn = SButton("Refresh Camera", "fa-camera-retro")
         self.check_predictor_btn = SButton("Test Classifier", "fa-robot")
         self.run_monitoring_btn = SButton(
@@ -77,7 +91,7 @@ class CameraWidget(SettingsWidget):
         self.scheduler_widget = MonitoringScheduleWidget()
 
         self.add_text_field(NAME, "Custom name of the camera", "Home")
-        self.settings.add_field("schedule", "Schedule", self.scheduler_widget)
+        self.settings.add_field(SCHEDULE, "Schedule", self.scheduler_widget)
         self.add_choice_field(MODEL_NAME, "Model Name", Config.list_models())
         self.add_text_field(URL, "Camera JPEG URL endpoint")
         self.add_text_field(USER, "Camera User name")
@@ -86,8 +100,8 @@ class CameraWidget(SettingsWidget):
         self.add_int_field(CAMERA_TIMEOUT, "Camera timeout [seconds]", default_value=5)
         self.add_int_field(MAX_SEQUENCE_LENGTH, "Events sequence maximum length [seconds]", default_value=10)
 
-        self.cam_preview_widget = PILImageWidget(Config.APP_INSTANCE)
-        self.cam_preview_widget.load(Config.CAMERA_DEFAULT_IMAGE, use_js=False)
+        # previews are pushed to the browser by the MJPEG stream route
+        self.cam_preview_widget = gui.Image(PREVIEW_PLACEHOLDER_URL)
         self.cam_preview_widget.css_width = "60%"
         self.cam_preview_widget.css_display = "block"
         self.cam_preview_widget.style["padding"] = "5px 5px"
@@ -108,6 +122,26 @@ class CameraWidget(SettingsWidget):
         self.check_predictor_btn.onclick.do(self.test_predictor)
         self.run_monitoring_btn.onclick.do(self.start_monitoring)
         self.stop_monitoring_btn.onclick.do(self.stop_monitoring)
+        self.scheduler_widget.on_schedule_changed.do(self.on_settings_changed)
+        for key in [
+            NAME,
+            MODEL_NAME,
+            URL,
+            USER,
+            PASSWORD,
+            CHECK_PERIOD,
+            CAMERA_TIMEOUT,
+            MAX_SEQUENCE_LENGTH,
+        ]:
+            self[key].onchange.do(self.on_settings_changed)
+
+    @property
+    def camera_client(self):
+        return self.engine.camera_client
+
+    @property
+    def is_running(self) -> bool:
+        return self.engine.is_running
 
     @property
     def latest_camera_snapshot(self) -> PILImage:
@@ -119,13 +153,62 @@ class CameraWidget(SettingsWidget):
             snapshot = self.placeholder_cam_image
         return snapshot
 
-    @gui.decorate_set_on_listener("(self, emitter)")
+    @gui.decorate_set_on_listener("(self, emitter, sequence)")
     @gui.decorate_event
-    def on_events_sequence_finished(self, *args):
-        return ()
+    def on_events_sequence_finished(self, sequence: EventsSequence):
+        return (sequence,)
+
+    def on_events_sequence_saved(self, sequence: EventsSequence) -> None:
+        # listeners read widgets and queue notifications in the UI thread
+        UI_UPDATES.post(
+            self,
+            ("events_sequence", sequence.sequence_id),
+            self.on_events_sequence_finished,
+            sequence,
+        )
+
+    def on_log(self, level: str, text: str) -> None:
+        getattr(self.logger, level)(text)
+
+    def on_state_changed(self, state: str) -> None:
+        if state == MONITORING_RUNNING:
+            icon = MONITORING_RUNNING_ICON
+        elif state == MONITORING_SLEEPING:
+            icon = MONITORING_SLEEP_ICON
+        else:
+            icon = MONITORING_RUN_ICON
+        # called from the monitoring thread
+        UI_UPDATES.post(
+            self.run_monitoring_btn, "icon", self.run_monitoring_btn.set_icon, icon
+        )
+
+    def on_frame(self, image: PILImage) -> None:
+        if not self.has_preview_viewers():
+            return
+        if not self.preview_renderer.should_render():
+            return
+        self.camera_settings_changed(image=image)
+
+    def set_preview_visible(self, visible: bool) -> None:
+        self.is_preview_visible = visible
+        if visible:
+            self.camera_settings_changed()
+            # browser picks the stream resolution from the image width,
+            # unique url makes it open a new stream connection
+            timestamp = time.time()
+            self.cam_preview_widget.attributes["srcset"] = get_preview_srcset(
+                timestamp
+            )
+            self.cam_preview_widget.attributes["sizes"] = PREVIEW_SIZES
+            self.cam_preview_widget.set_image(f"{PREVIEW_STREAM_URL}?t={timestamp}")
+        else:
+            self.cam_preview_widget.attributes.pop("srcset", None)
+            self.cam_preview_widget.attributes.pop("sizes", None)
+            self.cam_preview_widget.set_image(PREVIEW_PLACEHOLDER_URL)
 
-    def emit_events_sequence_finished(self):
-        return self.on_events_sequence_finished()
+    def has_preview_viewers(self) -> bool:
+        """Check if preview is displayed in any connected browser"""
+        return self.is_preview_visible and PREVIEW_STREAM.num_viewers > 0
 
     def add_new_roi(self, emitter=None, roi_widget: Optional[ROIWidget] = None):
         if roi_widget is None:
@@ -138,16 +221,16 @@ class CameraWidget(SettingsWidget):
             tab_index = int(tab_index) + 1
             roi_widget = ROIWidget(f"ROI #{tab_index}")
 
-        roi_widget.on_roi_changed.do(self.camera_settings_changed)
+        roi_widget.on_roi_changed.do(self.on_settings_changed)
         self.rois_tab_widget.append(roi_widget, roi_widget.name)
-        self.camera_settings_changed()
+        self.on_settings_changed()
 
     def delete_selected_roi(self, emitter=None):
         selected_key = self.rois_tab_widget.selected_widget_key
         if selected_key is None:
             return False
         self.rois_tab_widget.drop_tab(selected_key)
-        self.camera_settings_changed()
+        self.on_settings_changed()
 
     def iter_rois_widgets(self, only_enabled: bool = False) -> Iterator[ROIWidget]:
         for key in self.rois_tab_widget.tab_keys_ordered_list:
@@ -155,90 +238,48 @@ class CameraWidget(SettingsWidget):
             if widget.is_enabled() or not only_enabled:
                 yield widget
 
-    def start_monitoring(self, emitter=None):
-        if not self.can_run_predictions():
-            return False
+    def compile_settings(self) -> CameraSettings:
+        return CameraSettings.from_dict(self.get_settings())
 
-        if self.is_running:
-            self.logger.warning("Already running!")
-            return False
+    def update_engine_settings(self) -> None:
+        self.engine.set_settings(self.compile_settings())
 
-        self.is_running = True
-        monitoring_thread = threading.Thread(target=self._monitoring_process_fn)
-        monitoring_thread.start()
+    def on_settings_changed(self, emitter=None, *args):
+        """
+        Compile new settings snapshot for the monitoring engine, this is the
+        only place where camera and ROIs widgets values are read.
+        """
+        self.update_engine_settings()
+        self.camera_settings_changed()
+
+    def start_monitoring(self, emitter=None):
+        return self.engine.start()
 
     def stop_monitoring(self, emitter=None):
-        self.logger.info("Monitoring stopped!")
-        self.is_running = False
-
-    def reload_camera_client(self):
-        self.camera_client = get_camera_client(
-            user=self[USER].get_value(),
-            password=self[PASSWORD].get_value(),
-            url=self[URL].get_value(),
-            timeout=int(self[CAMERA_TIMEOUT].get_value()),
-        )
+        self.engine.stop()
 
     def reload_camera_connection(self, emitter=None):
         """
         Tries to get camera image and reconnect with the client if necessary
         """
-        self.reload_camera_client()
-        image, msg = self.camera_client.get_snapshot()
+        image, msg = self.engine.reload_camera_client()
         self.camera_settings_changed(emitter=None, image=image)
         if image is None:
             self.logger.error(msg)
         else:
             self.logger.info(msg)
 
-    def can_run_predictions(self) -> bool:
-        self.load_classifier()
-        if self.predictor is None:
-            return False
-
-        if self.camera_client is None:
-            self.logger.error("Camera client not loaded! Click 'Check Camera' button.")
-            return False
-        return True
-
-    def predict(
-        self, image: PILImage, rois: Optional[List[ROIWidget]] = None
-    ) -> Tuple[List[ROIWidget], List[ClassificationOutput], float]:
-
-        start = time.time()
-        crops = []
-        if rois is None:
-            rois = list(self.iter_rois_widgets(only_enabled=True))
-
-        for roi in rois:
-            crops.append(roi.crop(image))
-
-        if len(rois) == 0:
-            return [], [], 0.0
-
-        predictions = self.predictor.predict(images=crops)
-        dt = time.time() - start
-        return rois, predictions, dt
-
-    def format_predictions(
-        self,
-        rois: List[ROIWidget],
-        predictions: List[ClassificationOutput],
-        timedelta: float,
-    ) -> str:
-        predictions = [f"{r.name}: [{p}]" for r, p in zip(rois, predictions)]
-        return f"Predicted in {timedelta:.2f} seconds: {predictions}"
-
     def test_predictor(self, emitter=None):
-
-        if not self.can_run_predictions():
+        if not self.engine.can_run_predictions():
             image = self.placeholder_cam_image.copy()
         else:
             image = self.camera_client.get_latest_snapshot()
 
-        if image is not None:
-            rois_widgets, predictions, delta = self.predict(image=image)
-            self.logger.info(self.format_predictions(rois_widgets, predictions, delta))
+        if image is not None and self.engine.predictor is not None:
+            rois, predictions, delta = self.engine.predict(image=image)
+            self.logger.info(
+                self.engine.format_predictions(rois, predictions, delta)
+            )
 
     def camera_settings_changed(self, emitter=None, image=None, *args):
 
@@ -250,30 +291,10 @@ class CameraWidget(SettingsWidget):
             if image is None:
                 image = self.placeholder_cam_image.copy()
 
-        # resize image to max of the preview size width
-        image = image.copy()
-        if image.size[0] < Config.CAMERA_SNAPSHOT_PREVIEW_SIZE[0]:
-            sw, sh = image.size
-            tw, th = Config.CAMERA_SNAPSHOT_PREVIEW_SIZE
-            scale = tw / sw
-            image = image.resize((tw, int(sh * scale)))
-
-        # thumbnail doest only down sampling it will not increase image size
-        image.thumbnail(Config.CAMERA_SNAPSHOT_PREVIEW_SIZE)
-        for roi in self.iter_rois_widgets():
-            roi.draw_roi_on_image(image)
-        self.cam_preview_widget.set_pil_image(image)
-
-    def load_classifier(self):
-        model_path = Config.MODELS_DIR / self[MODEL_NAME].get_value()
-        self.predictor = None
-        if model_path.exists():
-            try:
-                self.predictor = TFClassifierPredictor.load(model_path)
-            except Exception as e:
-                self.logger.error(f"Cannot load classifier: {e}")
-        else:
-            self.logger.error(f"Cannot find model at path: {model_path}")
+        with TRACER.span("render_preview"):
+            preview = self.preview_renderer.render(image, self.engine.settings.rois)
+        # encoded once and sent to all connected viewers
+        PREVIEW_STREAM.publish(preview)
 
     def get_settings(self) -> Dict[str, Any]:
         general_settings = super().get_settings()
@@ -288,109 +309,5 @@ class CameraWidget(SettingsWidget):
         for roi_config in config["rois"]:
             roi = ROIWidget.from_settings(roi_config)
             self.add_new_roi(roi_widget=roi)
-        self.load_classifier()
-
-    def _monitoring_process_fn(self):
-        sleep_time = float(self[CHECK_PERIOD].get_value())
-        seq_max_length = float(self[MAX_SEQUENCE_LENGTH].get_value())
-        events_sequence = []
-        prev_image: Optional[PILImage] = None
-        while self.is_running:
-            if len(events_sequence) > 0:
-                dt = datetime.now() - events_sequence[-1]
-                seq_length = datetime.now() - events_sequence[0]
-                event_finished = dt.total_seconds() > EVENTS_SEQUENCE_SEPARATION
-                sequence_is_too_long = seq_length.total_seconds() > seq_max_length
-
-                if event_finished or sequence_is_too_long:
-                    self.logger.info(
-                        f"Sequence of size {len(events_sequence)} finished"
-                    )
-                    self.emit_events_sequence_finished()
-                    events_sequence = []
-
-            if not self.scheduler_widget.is_date_in_schedule():
-                self.run_monitoring_btn.set_icon(MONITORING_SLEEP_ICON)
-                sleep(sleep_time)
-                continue
-
-            self.run_monitoring_btn.set_icon(MONITORING_RUNNING_ICON)
-            start = time.time()
-            current_image, msg = self.camera_client.get_async_snapshot()
-
-            if current_image is None:
-                self.logger.warning(
-                    f"Image not found. Waiting for {sleep_time} seconds."
-                )
-                sleep(sleep_time)
-                continue
-
-            rois_to_check = []
-            rois_change_value = []
-            if prev_image is not None:
-                for roi in self.iter_rois_widgets(only_enabled=True):
-                    change = roi.compute_roi_image_change(prev_image, current_image)
-                    if change > MEAN_CHANGE_THRESHOLD:
-                        rois_to_check.append(roi)
-                        rois_change_value.append(change)
-            else:
-                rois_to_check = list(self.iter_rois_widgets(only_enabled=True))
-            prev_image = current_image.copy()
-            stop = time.time()
-            if len(rois_to_check) == 0:
-                delta = max(sleep_time - float(stop - start), 0)
-                self.logger.info(f"Image not changed. Waiting {delta:.2f} seconds.")
-                self.camera_settings_changed()
-                sleep(delta)
-                continue
-
-            info = [
-                f"{r.name} Δ={int(100*v)}%"
-                for r, v in zip(rois_to_check, rois_change_value)
-            ]
-            info = ", ".join(info)
-            self.logger.info(f"Image changed in ROIs ({info}), doing predictions.")
-
-            rois, predictions, delta = self.predict(
-                image=current_image, rois=rois_to_check
-            )
-
-            self.logger.info(self.format_predictions(rois, predictions, delta))
-            for roi, roi_pred, im_delta in zip(rois, predictions, rois_change_value):
-                self.check_and_update_history(
-                    image=current_image,
-                    roi=roi,
-                    predictions=roi_pred,
-                    image_change=im_delta,
-                )
-            self.camera_settings_changed(image=current_image)
-            if len(rois) > 0:
-                events_sequence.append(datetime.now())
-
-            delta = max(sleep_time - (time.time() - start), 0)
-            sleep(delta)
-        self.run_monitoring_btn.set_icon(MONITORING_RUN_ICON)
-
-    def check_and_update_history(
-        self,
-        image: PILImage,
-        roi: ROIWidget,
-        predictions: ClassificationOutput,
-        image_change: float,
-    ) -> bool:
-
-        if predictions.is_empty():
-            return False
-
-        labels = roi.filter_labels(predictions.labels)
-        if len(labels) == 0:
-            return False
-
-        return append_snapshots_history(
-            image=image,
-            labels=labels,
-            roi_name=roi.name,
-            labels_filter=roi.labels_filter,
-            camera_name=self[NAME].get_value(),
-            image_change=image_change,
-        )
+        self.update_engine_settings()
+        self.engine.load_classifier()
@@ -0,0 +1,145 @@
+import json
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from dataclasses import dataclass, field
+
+from core.event_index import normalize_label, record_date
+
+# per-day aggregate of the events counts, stored in the day folder
+SUMMARY_FILENAME = "summary.json"
+SUMMARY_VERSION = 2
+
+
+@dataclass
+class DaySummary:
+    """Number of events per (hour, ROI) and labels per (hour, label, ROI)"""
+
+    events: Counter = field(default_factory=Counter)
+    labels: Counter = field(default_factory=Counter)
+
+    def add_record(self, record: Dict[str, Any]) -> None:
+        hour = record_date(record).hour
+        roi_name = record["roi_name"]
+        self.events[hour, roi_name] += 1
+        for label in record["labels"]:
+            self.labels[hour, normalize_label(label), roi_name] += 1
+
+    def update(self, other: "DaySummary") -> None:
+        self.events.update(other.events)
+        self.labels.update(other.labels)
+
+    @property
+    def num_events(self) -> int:
+        return sum(self.events.values())
+
+    def count_hours(self) -> Dict[int, int]:
+        hours = Counter()
+        for (hour, _), count in self.events.items():
+            hours[hour] += count
+        return dict(hours)
+
+    def count_rois(self) -> List[Tuple[str, int]]:
+        rois = Counter()
+        for (_, roi_name), count in self.events.items():
+            rois[roi_name] += count
+        return rois.most_common()
+
+    def count_labels(self) -> List[Tuple[str, int]]:
+        labels = Counter()
+        for (_, label, _), count in self.labels.items():
+            labels[label] += count
+        return labels.most_common()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": SUMMARY_VERSION,
+            "events": [[*key, count] for key, count in self.events.items()],
+            "labels": [[*key, count] for key, count in self.labels.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DaySummary":
+        summary = cls()
+        for hour, roi_name, count in data["events"]:
+            summary.events[hour, roi_name] = count
+        for hour, label, roi_name, count in data["labels"]:
+            summary.labels[hour, label, roi_name] = count
+        return summary
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "DaySummary":
+        summary = cls()
+        for record in records:
+            summary.add_record(record)
+        return summary
+
+
+class DaySummaries:
+    def __init__(self):
+        """
+        Reads and incrementally updates per-day summary files. Summaries of
+        the updated days are cached, so writing an event does not read the
+        file again.
+        """
+        # held by history module while events log and summary are updated
+        self.lock = threading.RLock()
+        self.cache: Dict[Path, DaySummary] = {}
+
+    @staticmethod
+    def read(folder: Path) -> DaySummary:
+        path = folder / SUMMARY_FILENAME
+        with path.open("r") as file:
+            data = json.load(file)
+        if data.get("version") != SUMMARY_VERSION:
+            raise ValueError(f"Unsupported summary version: {path}")
+        return DaySummary.from_dict(data)
+
+    @staticmethod
+    def write(folder: Path, summary: DaySummary) -> None:
+        path = folder / SUMMARY_FILENAME
+        tmp_path = folder / f"{SUMMARY_FILENAME}.tmp"
+        with tmp_path.open("w") as file:
+            json.dump(summary.to_dict(), file)
+        tmp_path.replace(path)
+
+    def get(self, folder: Path) -> DaySummary:
+        """
+        Returns summary of the day, raises OSError or ValueError if summary
+        file is missing or invalid.
+        """
+        with self.lock:
+            if folder not in self.cache:
+                return self.read(folder)
+            summary = DaySummary()
+            summary.update(self.cache[folder])
+            return summary
+
+    def set(self, folder: Path, summary: DaySummary) -> None:
+        with self.lock:
+            self.write(folder, summary)
+            self.cache.pop(folder, None)
+
+    def add_records(self, folder: Path, records: List[Dict[str, Any]]) -> None:
+        """
+        Add events to the day summary. Summary of the day must exist, it is
+        created from the events log by history.load_day_summary.
+        """
+        with self.lock:
+            summary = self.cache.get(folder)
+            if summary is None:
+                summary = self.read(folder)
+                # keep only the currently updated day
+                self.cache = {folder: summary}
+            for record in records:
+                summary.add_record(record)
+            self.write(folder, summary)
+
+    def invalidate(self, folder: Path) -> None:
+        with self.lock:
+            self.cache.pop(folder, None)
+
+
+DAY_SUMMARIES = DaySummaries()
@@ -0,0 +1,310 @@
+"""
+Durable queue of outgoing notifications shared by the email and webhook
+channels. Items are saved as JSON files in the queue folder until they are
+delivered, so they survive restarts, and failed items are retried with
+exponential backoff by the background thread. The folder is read only once
+at start, pending items are then tracked in memory.
+"""
+import json
+import logging
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dataclasses import replace
+
+from config.config import Config
+from core.metrics import METRICS
+
+logger = logging.getLogger("clever-camera")
+
+# shared by the email and webhook notifications
+NOTIFICATIONS_COUNTER = METRICS.counter(
+    "notifications_total", "Notification delivery attempts", ["channel", "result"]
+)
+NOTIFICATIONS_SEND_SECONDS = METRICS.histogram(
+    "notification_send_seconds", "Notification delivery time", ["channel"]
+)
+NOTIFICATIONS_QUEUE = METRICS.gauge(
+    "notifications_queue", "Notifications waiting for delivery", ["channel"]
+)
+
+
+def get_message_id(created: float) -> str:
+    """Unique id, ids of the older messages are sorted first"""
+    return f"{int(created * 1000)}-{secrets.token_hex(4)}"
+
+
+def get_retry_delay(num_attempts: int, retry_delay: float) -> float:
+    """Delay doubled with every failed attempt, limited to the maximum"""
+    return min(
+        retry_delay * 2 ** (num_attempts - 1), Config.NOTIFICATIONS_MAX_RETRY_DELAY
+    )
+
+
+class DurableQueue(ABC):
+    # label of the notifications metrics, e.g. "email"
+    channel = ""
+    # class of the queued items, loaded with item_class.from_dict
+    item_class: Any = None
+
+    def __init__(
+        self,
+        queue_dir: Path,
+        max_attempts: int,
+        retry_delay: float,
+        batch_size: int = 1,
+        batch_delay: float = 0.0,
+        idle_timeout: Optional[float] = None,
+    ):
+        """
+        Base of the notification channels. Queued items are frozen
+        dataclasses with item_id, created, num_attempts and next_attempt
+        fields and to_dict/from_dict methods. Subclasses only deliver
+        batches of the items in send.
+
+        Args:
+            queue_dir: folder with pending items
+            max_attempts: item is dropped after this number of failures
+            retry_delay: delay after the first failure, doubled with every
+                next failure
+            batch_size: maximum number of items delivered at once
+            batch_delay: seconds to wait for more items before delivering
+                incomplete batch
+            idle_timeout: on_idle is called after this number of seconds
+                without items to deliver, None to wait indefinitely
+        """
+        self.queue_dir = Path(queue_dir)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.idle_timeout = idle_timeout
+        self.condition = threading.Condition()
+        # item id -> pending item, in the order of the item ids
+        self.pending: Dict[str, Any] = {}
+        self._is_loaded = False
+        self.settings: Optional[Any] = None
+        self._thread: Optional[threading.Thread] = None
+        self.num_requests = 0
+        self.num_sent = 0
+        self.num_failed = 0
+        self.num_dropped = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_send_time = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def num_pending(self) -> int:
+        return len(self.pending)
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.num_sent if self.num_sent > 0 else 0.0
+
+    @property
+    def mean_send_time(self) -> float:
+        num_sent_requests = self.num_requests - self.num_failed
+        if num_sent_requests <= 0:
+            return 0.0
+        return self.total_send_time / num_sent_requests
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.num_sent / self.num_requests if self.num_requests > 0 else 0.0
+
+    @abstractmethod
+    def send(self, batch: List[Any], settings: Any) -> None:
+        """Deliver the batch, raises an exception if it failed"""
+
+    def is_configured(self, settings: Optional[Any]) -> bool:
+        return settings is not None
+
+    def on_idle(self) -> None:
+        """Called from the background thread when the queue is idle"""
+
+    def start(self) -> None:
+        """Deliver queued items in the background thread"""
+        self.load_pending()
+        with self.condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def set_settings(self, settings: Any) -> None:
+        with self.condition:
+            self.settings = settings
+            self.condition.notify_all()
+
+    def put(self, item: Any) -> None:
+        """Save item in the queue, it is delivered by the background thread"""
+        self.start()
+        self.save(item)
+        with self.condition:
+            self.condition.notify_all()
+
+    def get_item_path(self, item_id: str) -> Path:
+        return self.queue_dir / f"{item_id}.json"
+
+    def save(self, item: Any) -> None:
+        """Write item to the queue folder and add or update it in the index"""
+        self.queue_dir.mkdir(exist_ok=True, parents=True)
+        path = self.get_item_path(item.item_id)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w") as file:
+            json.dump(item.to_dict(), file)
+        tmp_path.replace(path)
+        with self.condition:
+            self.pending[item.item_id] = item
+
+    def remove(self, item: Any) -> None:
+        try:
+            self.get_item_path(item.item_id).unlink()
+        except FileNotFoundError:
+            pass
+        with self.condition:
+            self.pending.pop(item.item_id, None)
+
+    def load_pending(self) -> None:
+        """Read items saved before restart into the index, only once"""
+        with self.condition:
+            if self._is_loaded:
+                return
+            self._is_loaded = True
+        items = []
+        for path in sorted(self.queue_dir.glob("*.json")):
+            try:
+                with path.open("r") as file:
+                    items.append(self.item_class.from_dict(json.load(file)))
+            except (OSError, ValueError, KeyError):
+                logger.warning(f"Removing invalid {self.channel} notification: {path}")
+                path.unlink()
+        with self.condition:
+            # keep the order of the ids, items put meanwhile are newer
+            put_items = self.pending
+            self.pending = {item.item_id: item for item in items}
+            self.pending.update(put_items)
+            self.condition.notify_all()
+
+    def list_pending(self) -> List[Any]:
+        """Returns queued items, from the oldest one"""
+        with self.condition:
+            return list(self.pending.values())
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                settings = self.settings
+                now = time.time()
+                pending = []
+                if self.is_configured(settings):
+                    pending = self.list_pending()
+                ready = [item for item in pending if item.next_attempt <= now]
+                if len(ready) == 0:
+                    timeout = self.idle_timeout
+                    if len(pending) > 0:
+                        next_attempt = min(item.next_attempt for item in pending)
+                        if timeout is None or next_attempt - now < timeout:
+                            timeout = next_attempt - now
+                    if not self.condition.wait(timeout):
+                        self.on_idle()
+                    continue
+                # wait a moment for the next items to fill the batch
+                batch_age = now - min(item.created for item in ready)
+                if len(ready) < self.batch_size and batch_age < self.batch_delay:
+                    self.condition.wait(self.batch_delay - batch_age)
+                    continue
+            self.process(ready[: self.batch_size], settings)
+
+    def process(self, batch: List[Any], settings: Any) -> None:
+        start = time.time()
+        try:
+            self.send(batch, settings)
+        except Exception as e:
+            logger.warning(
+                f"Cannot send {len(batch)} {self.channel} notifications: {e}"
+            )
+            self.on_failure(batch, str(e))
+            return
+
+        end = time.time()
+        NOTIFICATIONS_COUNTER.inc(len(batch), channel=self.channel, result="sent")
+        NOTIFICATIONS_SEND_SECONDS.observe(end - start, channel=self.channel)
+        # statistics are complete when flush sees the items removed
+        with self.condition:
+            self.num_requests += 1
+            self.total_send_time += end - start
+            for item in batch:
+                self.num_sent += 1
+                latency = end - item.created
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+        for item in batch:
+            self.remove(item)
+        with self.condition:
+            self.condition.notify_all()
+
+    def on_failure(self, batch: List[Any], error: str) -> None:
+        NOTIFICATIONS_COUNTER.inc(len(batch), channel=self.channel, result="failed")
+        dropped = []
+        for item in batch:
+            num_attempts = item.num_attempts + 1
+            if num_attempts >= self.max_attempts:
+                logger.error(
+                    f"Dropping {self.channel} notification {item.item_id}: {error}"
+                )
+                NOTIFICATIONS_COUNTER.inc(channel=self.channel, result="dropped")
+                dropped.append(item)
+                continue
+            delay = get_retry_delay(num_attempts, self.retry_delay)
+            self.save(
+                replace(
+                    item,
+                    num_attempts=num_attempts,
+                    next_attempt=time.time() + delay,
+                )
+            )
+        with self.condition:
+            self.num_requests += 1
+            self.num_failed += 1
+            self.num_dropped += len(dropped)
+            self.last_error = error
+        for item in dropped:
+            self.remove(item)
+        with self.condition:
+            self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all queued items are delivered or dropped.
+
+        Returns:
+            False if timeout expired
+        """
+        self.load_pending()
+        with self.condition:
+            return self.condition.wait_for(lambda: self.num_pending == 0, timeout)
+
+    def format_extra_stats(self) -> str:
+        """Channel specific statistics appended to format_stats"""
+        return ""
+
+    def format_stats(self) -> str:
+        stats = (
+            f"queue={self.num_pending}, sent={self.num_sent}, "
+            f"requests={self.num_requests} (batch {self.mean_batch_size:.1f}), "
+            f"failed={self.num_failed}, dropped={self.num_dropped}, "
+            f"latency={self.mean_latency:.2f}s (max {self.max_latency:.2f}s), "
+            f"send={self.mean_send_time:.2f}s"
+        )
+        extra_stats = self.format_extra_stats()
+        if extra_stats:
+            stats += f", {extra_stats}"
+        if self.last_error is not None:
+            stats += f", last error: {self.last_error}"
+        return stats
@@ -0,0 +1,314 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dataclasses import dataclass
+
+from config.config import Config, DATE_FORMAT, DATE_MS_FORMAT
+
+# increase when schema changes, index is then rebuilt from the events logs
+SCHEMA_VERSION = 4
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    datetime TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    hour INTEGER NOT NULL,
+    camera_name TEXT,
+    roi_name TEXT,
+    image_path TEXT,
+    thumbnail_path TEXT,
+    sequence_id INTEGER,
+    sequence_start INTEGER NOT NULL DEFAULT 0,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE COLLATE NOCASE
+);
+CREATE TABLE IF NOT EXISTS event_labels (
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    label_id INTEGER NOT NULL REFERENCES labels(id),
+    PRIMARY KEY (event_id, label_id)
+);
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_roi ON events(roi_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_camera ON events(camera_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_sequence ON events(sequence_id);
+CREATE INDEX IF NOT EXISTS idx_events_sequence_start ON events(sequence_start, timestamp);
+CREATE INDEX IF NOT EXISTS idx_event_labels_label ON event_labels(label_id, event_id);
+"""
+DROP_SCHEMA = """
+DROP TABLE IF EXISTS event_labels;
+DROP TABLE IF EXISTS labels;
+DROP TABLE IF EXISTS events;
+"""
+
+# position of the last event on the page: (timestamp, event id)
+Cursor = Tuple[float, int]
+
+
+def format_event_date(date: datetime) -> str:
+    """Format event date with millisecond precision"""
+    return date.strftime(DATE_MS_FORMAT)[:-3]
+
+
+def parse_event_date(date: str) -> datetime:
+    """Parse event date, with or without milliseconds"""
+    if "." in date:
+        return datetime.strptime(date, DATE_MS_FORMAT)
+    return datetime.strptime(date, DATE_FORMAT)
+
+
+def record_date(record: Dict[str, Any]) -> datetime:
+    return parse_event_date(record["datetime"])
+
+
+def normalize_label(label: str) -> str:
+    """Labels are counted and searched case-insensitively"""
+    return label.lower()
+
+
+@dataclass(frozen=True)
+class EventsQuery:
+    """
+    Events search parameters. Events are selected by date range and label,
+    optionally only the first events of the sequences are kept.
+    """
+
+    start_date: datetime
+    end_date: datetime
+    label: Optional[str] = None
+    camera_name: Optional[str] = None
+    only_unique: bool = False
+
+
+def placeholders(values: Tuple[Any, ...]) -> str:
+    return ", ".join("?" * len(values))
+
+
+def build_selection(query: EventsQuery) -> Tuple[str, List[Any]]:
+    """
+    Returns SQL which selects (id, timestamp) of events matching the query
+    together with the query parameters.
+    """
+    where = "timestamp >= ? AND timestamp < ?"
+    params: List[Any] = [query.start_date.timestamp(), query.end_date.timestamp()]
+    if query.label is not None:
+        where += (
+            " AND id IN (SELECT event_id FROM event_labels"
+            " JOIN labels ON labels.id = event_labels.label_id"
+            " WHERE labels.name = ?)"
+        )
+        params.append(query.label)
+    if query.camera_name is not None:
+        where += " AND camera_name = ?"
+        params.append(query.camera_name)
+    if query.only_unique:
+        where += " AND sequence_start = 1"
+    return f"SELECT id, timestamp FROM events WHERE {where}", params
+
+
+class EventIndex:
+    def __init__(self, path: Path):
+        """
+        Embedded SQLite index of all history events. Index is a cache of
+        the day events logs, it can be always rebuilt from them.
+
+        Args:
+            path: path to the database file
+        """
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._labels_ids: Dict[str, int] = {}
+        self.is_new = False
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            self.is_new = not self.path.exists()
+            connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                connection.executescript(DROP_SCHEMA)
+                connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+                self.is_new = True
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def close(self) -> None:
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = None
+            self._labels_ids = {}
+
+    def _get_label_id(self, label: str) -> int:
+        label = normalize_label(label)
+        if label not in self._labels_ids:
+            cursor = self.connection.cursor()
+            cursor.execute("INSERT OR IGNORE INTO labels(name) VALUES (?)", (label,))
+            cursor.execute("SELECT id FROM labels WHERE name = ?", (label,))
+            self._labels_ids[label] = cursor.fetchone()[0]
+        return self._labels_ids[label]
+
+    def _insert(self, record: Dict[str, Any]) -> int:
+        date = record_date(record)
+        cursor = self.connection.execute(
+            "INSERT INTO events(datetime, timestamp, hour, camera_name, roi_name, "
+            "image_path, thumbnail_path, sequence_id, sequence_start, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record["datetime"],
+                date.timestamp(),
+                date.hour,
+                record.get("camera_name"),
+                record.get("roi_name"),
+                record.get("image_path"),
+                record.get("thumbnail_path"),
+                record.get("sequence_id"),
+                int(record.get("sequence_start", False)),
+                json.dumps(record),
+            ),
+        )
+        event_id = cursor.lastrowid
+        labels_ids = {self._get_label_id(label) for label in record["labels"]}
+        self.connection.executemany(
+            "INSERT INTO event_labels(event_id, label_id) VALUES (?, ?)",
+            [(event_id, label_id) for label_id in labels_ids],
+        )
+        return event_id
+
+    def add_event(self, record: Dict[str, Any]) -> int:
+        with self.lock, self.connection:
+            return self._insert(record)
+
+    def rebuild(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Remove all events from the index and insert given records.
+
+        Returns:
+            number of indexed events
+        """
+        num_events = 0
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM event_labels")
+            self.connection.execute("DELETE FROM events")
+            for record in records:
+                self._insert(record)
+                num_events += 1
+        return num_events
+
+    def delete_before(self, date: datetime) -> int:
+        """Remove events older than date, returns number of removed events"""
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM events WHERE timestamp < ?", (date.timestamp(),)
+            )
+            return cursor.rowcount
+
+    def search(
+        self,
+        query: EventsQuery,
+        cursor: Optional[Cursor] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+        """
+        Find events matching the query, from the most recent to older.
+
+        Args:
+            query: search parameters
+            cursor: returns events older than the cursor position
+            limit: maximum number of returned events
+
+        Returns:
+            list of events records, every record has additional "event_id"
+            field and cursor to the next page (None if there are no more
+            events)
+        """
+        selection, params = build_selection(query)
+        sql = (
+            "SELECT events.id, events.timestamp, events.record FROM events"
+            f" JOIN ({selection}) AS selected ON selected.id = events.id"
+        )
+        if cursor is not None:
+            sql += (
+                " WHERE events.timestamp < ?"
+                " OR (events.timestamp = ? AND events.id < ?)"
+            )
+            params += [cursor[0], cursor[0], cursor[1]]
+        sql += " ORDER BY events.timestamp DESC, events.id DESC"
+        if limit is not None:
+            # fetch one more to check if there is a next page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1][1], rows[-1][0])
+
+        records = []
+        for event_id, _, record in rows:
+            record = json.loads(record)
+            record["event_id"] = event_id
+            records.append(record)
+        return records, next_cursor
+
+    def get_events(self, event_ids: List[int]) -> Iterator[Dict[str, Any]]:
+        """Stream records of the given events, ordered by event id"""
+        event_ids = sorted(event_ids)
+        # keep the number of SQL variables below SQLite limit
+        batch_size = 500
+        for i in range(0, len(event_ids), batch_size):
+            batch = tuple(event_ids[i : i + batch_size])
+            sql = (
+                f"SELECT id, record FROM events WHERE id IN ({placeholders(batch)})"
+                " ORDER BY id"
+            )
+            with self.lock:
+                rows = self.connection.execute(sql, batch).fetchall()
+            for event_id, record in rows:
+                record = json.loads(record)
+                record["event_id"] = event_id
+                yield record
+
+    def get_facets_rows(
+        self, query: EventsQuery
+    ) -> Tuple[List[Tuple[int, float, int, str]], List[Tuple[int, str]]]:
+        """
+        Returns (id, timestamp, hour, roi name) rows of events matching the
+        query, from the most recent to older, and (event id, label) rows of
+        their labels.
+        """
+        selection, params = build_selection(query)
+        events_sql = (
+            "SELECT events.id, events.timestamp, events.hour, events.roi_name"
+            f" FROM events JOIN ({selection}) AS selected"
+            " ON selected.id = events.id"
+            " ORDER BY events.timestamp DESC, events.id DESC"
+        )
+        labels_sql = (
+            "SELECT event_labels.event_id, labels.name FROM event_labels"
+            " JOIN labels ON labels.id = event_labels.label_id"
+            f" WHERE event_labels.event_id IN (SELECT id FROM ({selection}))"
+        )
+        with self.lock:
+            events_rows = self.connection.execute(events_sql, params).fetchall()
+            labels_rows = self.connection.execute(labels_sql, params).fetchall()
+        return events_rows, labels_rows
+
+
+EVENTS_INDEX = EventIndex(Config.EVENTS_INDEX_PATH)
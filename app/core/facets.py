@@ -0,0 +1,130 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from dataclasses import dataclass
+
+from core.event_index import EVENTS_INDEX, EventsQuery, normalize_label
+from core.history import ensure_events_index
+
+# labels are stored as bits of uint64 words
+BITS_PER_WORD = 64
+
+
+@dataclass(frozen=True)
+class EventsColumns:
+    """
+    Search result kept as columnar arrays, so filters and facets counts are
+    computed with vectorized masks without querying the index again. Rows
+    are sorted from the most recent event to older.
+    """
+
+    event_ids: np.ndarray
+    # epoch seconds
+    timestamps: np.ndarray
+    hours: np.ndarray
+    # index of the ROI name in roi_names
+    roi_ids: np.ndarray
+    roi_names: Tuple[str, ...]
+    # (num events, num words) bitsets, bit i is set if event has label i
+    label_bits: np.ndarray
+    label_names: Tuple[str, ...]
+
+    @classmethod
+    def from_rows(
+        cls,
+        events_rows: List[Tuple[int, float, int, str]],
+        labels_rows: List[Tuple[int, str]],
+    ) -> "EventsColumns":
+        num_events = len(events_rows)
+        event_ids = np.array([row[0] for row in events_rows], dtype=np.int64)
+        timestamps = np.array([row[1] for row in events_rows], dtype=np.float64)
+        hours = np.array([row[2] for row in events_rows], dtype=np.int8)
+
+        roi_names: Dict[str, int] = {}
+        roi_ids = np.array(
+            [roi_names.setdefault(row[3], len(roi_names)) for row in events_rows],
+            dtype=np.int32,
+        )
+
+        label_names: Dict[str, int] = {}
+        rows_index = {event_id: i for i, event_id in enumerate(event_ids.tolist())}
+        rows, labels = [], []
+        for event_id, label in labels_rows:
+            rows.append(rows_index[event_id])
+            labels.append(label_names.setdefault(label, len(label_names)))
+
+        num_words = max(1, -(-len(label_names) // BITS_PER_WORD))
+        label_bits = np.zeros((num_events, num_words), dtype="<u8")
+        if rows:
+            labels = np.array(labels, dtype=np.uint64)
+            bits = np.left_shift(np.uint64(1), labels % np.uint64(BITS_PER_WORD))
+            words = (labels // np.uint64(BITS_PER_WORD)).astype(np.int64)
+            np.bitwise_or.at(label_bits, (np.array(rows), words), bits)
+
+        return cls(
+            event_ids=event_ids,
+            timestamps=timestamps,
+            hours=hours,
+            roi_ids=roi_ids,
+            roi_names=tuple(roi_names),
+            label_bits=label_bits,
+            label_names=tuple(label_names),
+        )
+
+    def __len__(self) -> int:
+        return len(self.event_ids)
+
+    def get_mask(
+        self,
+        labels: Sequence[str] = (),
+        rois: Sequence[str] = (),
+        hours: Sequence[int] = (),
+    ) -> np.ndarray:
+        """
+        Select events having any of the labels, detected in any of the ROIs
+        and in any of the hours. Empty filter accepts all events.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if labels:
+            query_bits = np.zeros(self.label_bits.shape[1], dtype="<u8")
+            for label in map(normalize_label, labels):
+                if label in self.label_names:
+                    i = self.label_names.index(label)
+                    query_bits[i // BITS_PER_WORD] |= np.uint64(
+                        1 << (i % BITS_PER_WORD)
+                    )
+            mask &= (self.label_bits & query_bits).any(axis=1)
+        if rois:
+            roi_ids = [i for i, name in enumerate(self.roi_names) if name in rois]
+            mask &= np.isin(self.roi_ids, roi_ids)
+        if hours:
+            mask &= np.isin(self.hours, list(hours))
+        return mask
+
+    def count_labels(self, mask: np.ndarray) -> List[Tuple[str, int]]:
+        """Returns (label, count) pairs sorted from the most common label"""
+        bits = np.unpackbits(
+            self.label_bits[mask].view(np.uint8), axis=1, bitorder="little"
+        )
+        counts = bits[:, : len(self.label_names)].sum(axis=0)
+        return sort_counts(self.label_names, counts)
+
+    def count_rois(self, mask: np.ndarray) -> List[Tuple[str, int]]:
+        """Returns (roi name, count) pairs sorted from the most common ROI"""
+        counts = np.bincount(self.roi_ids[mask], minlength=len(self.roi_names))
+        return sort_counts(self.roi_names, counts)
+
+    def count_hours(self, mask: np.ndarray) -> Dict[int, int]:
+        """Returns number of events for every hour of the day"""
+        counts = np.bincount(self.hours[mask], minlength=24)
+        return {hour: int(count) for hour, count in enumerate(counts) if count > 0}
+
+
+def sort_counts(names: Tuple[str, ...], counts: np.ndarray) -> List[Tuple[str, int]]:
+    order = np.argsort(-counts, kind="stable")
+    return [(names[i], int(counts[i])) for i in order]
+
+
+def load_events_columns(query: EventsQuery) -> EventsColumns:
+    ensure_events_index()
+    return EventsColumns.from_rows(*EVENTS_INDEX.get_facets_rows(query))
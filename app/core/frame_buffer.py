@@ -0,0 +1,124 @@
+import threading
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, List, Optional
+
+from dataclasses import dataclass
+
+from config.config import Config, DAY_FORMAT, HOUR_FORMAT
+from core.camera_client import CameraFrame
+from core.persistence import SNAPSHOT_WRITER
+
+
+@dataclass(frozen=True)
+class BufferedFrame:
+    frame_id: int
+    timestamp: float
+    date: datetime
+    jpeg_bytes: bytes
+
+    @property
+    def filename(self) -> str:
+        hour = self.date.strftime(HOUR_FORMAT)
+        return f"frame-{hour}.{self.date.microsecond // 1000:03d}.jpg"
+
+
+class FrameRingBuffer:
+    def __init__(self, max_seconds: float, max_bytes: int):
+        """
+        Memory bounded buffer of the last camera frames stored as raw
+        JPEG bytes, as they were received from the camera.
+
+        Args:
+            max_seconds: frames older than this number of seconds
+                (with respect to the newest frame) are dropped
+            max_bytes: maximum total size of the buffered frames
+        """
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.frames: Deque[BufferedFrame] = deque()
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def append(self, frame: BufferedFrame) -> None:
+        with self.lock:
+            self.frames.append(frame)
+            self.num_bytes += len(frame.jpeg_bytes)
+            self._evict(frame.timestamp)
+
+    def _evict(self, now: float) -> None:
+        while self.frames and (
+            self.num_bytes > self.max_bytes
+            or now - self.frames[0].timestamp > self.max_seconds
+        ):
+            frame = self.frames.popleft()
+            self.num_bytes -= len(frame.jpeg_bytes)
+
+    def pop_all(self) -> List[BufferedFrame]:
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+            self.num_bytes = 0
+        return frames
+
+
+def get_sequence_dir(date: datetime) -> Path:
+    day = date.strftime(DAY_FORMAT)
+    hour = date.strftime(HOUR_FORMAT)
+    return Config.SNAPSHOTS_DIR / day / f"sequence-{hour}"
+
+
+class EventFramesRecorder:
+    def __init__(
+        self,
+        max_seconds: float = Config.PRE_EVENT_BUFFER_SECONDS,
+        max_bytes: int = Config.PRE_EVENT_BUFFER_MAX_BYTES,
+    ):
+        """
+        Keeps pre-event camera frames in the ring buffer. When events
+        sequence starts buffered frames are written to the sequence folder
+        and all following frames are written there directly until the
+        sequence is finished. Frames are saved by the snapshot writer
+        threads, without re-encoding, to the blob store and linked into the
+        sequence folder, so frames also saved as event snapshots are stored
+        once.
+        """
+        self.buffer = FrameRingBuffer(max_seconds=max_seconds, max_bytes=max_bytes)
+        self.sequence_dir: Optional[Path] = None
+
+    @property
+    def is_recording(self) -> bool:
+        return self.sequence_dir is not None
+
+    def add_frame(self, frame: CameraFrame) -> None:
+        if frame.jpeg_bytes is None:
+            return
+        buffered_frame = BufferedFrame(
+            frame_id=frame.frame_id,
+            timestamp=frame.timestamp,
+            date=frame.date,
+            jpeg_bytes=frame.jpeg_bytes,
+        )
+        if self.is_recording:
+            self.save_frames([buffered_frame])
+        else:
+            self.buffer.append(buffered_frame)
+
+    def start_sequence(self, date: datetime) -> Path:
+        self.sequence_dir = get_sequence_dir(date)
+        self.save_frames(self.buffer.pop_all())
+        return self.sequence_dir
+
+    def stop_sequence(self) -> None:
+        self.sequence_dir = None
+
+    def save_frames(self, frames: List[BufferedFrame]) -> None:
+        """Queue frames to be written in the background"""
+        SNAPSHOT_WRITER.submit_frames(
+            [(frame.filename, frame.jpeg_bytes) for frame in frames],
+            self.sequence_dir,
+        )
@@ -0,0 +1,650 @@
+import json
+import os
+from io import BytesIO
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Union, Iterable, Iterator, IO, Tuple
+
+from dataclasses import dataclass, field
+
+from config.config import Config, DAY_FORMAT, EVENTS_SEQUENCE_SEPARATION
+from core.blob_store import BLOB_STORE
+from core.day_summary import DAY_SUMMARIES, DaySummary
+from core.event_index import (
+    EVENTS_INDEX,
+    EventsQuery,
+    Cursor,
+    format_event_date,
+    parse_event_date,
+    record_date,
+)
+from core.image_utils import PILImage
+
+# legacy history file, a JSON list of all day events
+HISTORY_FILENAME = "history.json"
+# append-only history file with single JSON event per line
+EVENTS_LOG_FILENAME = "history.jsonl"
+# saved events sequences kept in memory until they are handed to listeners
+MAX_TRACKED_SEQUENCES = 8
+
+
+def get_day_folder(date: Union[str, datetime]) -> Path:
+    if type(date) is str:
+        date = datetime.strptime(date, DAY_FORMAT)
+    return Config.SNAPSHOTS_DIR / date.strftime(DAY_FORMAT)
+
+
+def list_days() -> List[datetime]:
+    """Returns sorted dates of all days with snapshots"""
+    days = []
+    if not Config.SNAPSHOTS_DIR.is_dir():
+        return days
+    for folder in Config.SNAPSHOTS_DIR.iterdir():
+        try:
+            days.append(datetime.strptime(folder.name, DAY_FORMAT))
+        except ValueError:
+            continue
+    return sorted(days)
+
+
+def migrate_day_history(folder: Path) -> None:
+    """
+    One-time conversion of the legacy history.json file to the events log.
+    The old file is kept with ".migrated" suffix.
+    """
+    history_path = folder / HISTORY_FILENAME
+    log_path = folder / EVENTS_LOG_FILENAME
+    if not history_path.exists() or log_path.exists():
+        return
+
+    with history_path.open("r") as file:
+        history = json.load(file)
+
+    tmp_path = folder / f"{EVENTS_LOG_FILENAME}.tmp"
+    with tmp_path.open("w") as file:
+        for record in history:
+            file.write(json.dumps(record) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    tmp_path.replace(log_path)
+    history_path.replace(folder / f"{HISTORY_FILENAME}.migrated")
+
+
+class EventLog:
+    def __init__(
+        self,
+        fsync_every: int = Config.EVENTS_LOG_FSYNC_RECORDS,
+        fsync_interval: float = Config.EVENTS_LOG_FSYNC_INTERVAL,
+    ):
+        """
+        Append-only writer of the day events logs. Every record is written
+        as a single JSON line and flushed to the OS, fsync is done in
+        batches: every fsync_every records or fsync_interval seconds.
+
+        Args:
+            fsync_every: maximum number of records not synced to the disk
+            fsync_interval: maximum time in seconds between two fsync calls
+        """
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self._file: Optional[IO[str]] = None
+        self._path: Optional[Path] = None
+        self._num_pending = 0
+        self._last_fsync = time.monotonic()
+
+    def _open(self, path: Path) -> IO[str]:
+        if self._path == path:
+            return self._file
+
+        self._close()
+        migrate_day_history(path.parent)
+        needs_new_line = False
+        if path.exists() and path.stat().st_size > 0:
+            # last line could be left incomplete after crash
+            with path.open("rb") as file:
+                file.seek(-1, os.SEEK_END)
+                needs_new_line = file.read(1) != b"\n"
+
+        self._file = path.open("a")
+        self._path = path
+        if needs_new_line:
+            self._file.write("\n")
+        return self._file
+
+    def _sync(self) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._num_pending = 0
+        self._last_fsync = time.monotonic()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        self._file = None
+        self._path = None
+
+    def append(self, folder: Path, record: Dict[str, Any]) -> None:
+        with self.lock:
+            file = self._open(folder / EVENTS_LOG_FILENAME)
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            self._num_pending += 1
+            elapsed = time.monotonic() - self._last_fsync
+            if self._num_pending >= self.fsync_every or elapsed > self.fsync_interval:
+                self._sync()
+
+    def sync(self) -> None:
+        with self.lock:
+            self._sync()
+
+    def close(self) -> None:
+        with self.lock:
+            self._close()
+
+
+EVENTS_LOG = EventLog()
+
+
+@dataclass(frozen=True)
+class SnapshotEvent:
+    """Event detected in a single ROI of the camera frame"""
+
+    labels: List[str]
+    labels_filter: str
+    roi_name: str
+    camera_name: str
+    image_change: float
+
+
+def encode_jpeg(image: PILImage) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def save_frame_events(
+    image: PILImage,
+    events: List[SnapshotEvent],
+    event_date: Optional[datetime] = None,
+    jpeg_bytes: Optional[bytes] = None,
+    sequence_dir: Optional[Path] = None,
+    max_sequence_length: Optional[float] = None,
+    sequence_id: Optional[int] = None,
+    sequence_start: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Save camera frame with its thumbnail to the blob store and add history
+    record for every event detected in the frame. Image and thumbnail are
+    stored once and shared by all the records.
+
+    Args:
+        image: camera frame
+        events: events detected in the frame ROIs
+        event_date: frame capture date, now if not given
+        jpeg_bytes: camera JPEG of the frame, written without re-encoding
+        sequence_dir: folder with pre-event and post-event camera frames
+        max_sequence_length: maximum duration of the events sequence in
+            seconds, used only when sequence_id is not given
+        sequence_id: sequence assigned by EVENTS_SEQUENCES.add_frame, frame
+            is assigned by its date if not given
+        sequence_start: frame is the first one of the sequence
+
+    Returns:
+        list of saved records
+    """
+    now = event_date if event_date is not None else datetime.now()
+    saveDir = get_day_folder(now)
+    saveDir.mkdir(exist_ok=True, parents=True)
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail(Config.THUMBNAIL_SIZE)
+    thumbnail_path = BLOB_STORE.put(encode_jpeg(thumbnail))
+    if jpeg_bytes is None:
+        jpeg_bytes = encode_jpeg(image)
+    image_path = BLOB_STORE.put(jpeg_bytes)
+
+    records = []
+    for event in events:
+        data = {
+            "datetime": format_event_date(now),
+            "thumbnail_path": str(thumbnail_path),
+            "image_path": str(image_path),
+            "labels": event.labels,
+            "class_filter": event.labels_filter,
+            "camera_name": event.camera_name,
+            "roi_name": event.roi_name,
+            "image_change": event.image_change,
+        }
+        if sequence_dir is not None:
+            data["sequence_dir"] = str(sequence_dir)
+        records.append(data)
+
+    if sequence_id is None:
+        sequence_id, sequence_start = EVENTS_SEQUENCES.add_frame(
+            now, max_sequence_length
+        )
+    EVENTS_SEQUENCES.add_records(records, sequence_id, sequence_start)
+    with DAY_SUMMARIES.lock:
+        load_day_summary(now)
+        for data in records:
+            EVENTS_LOG.append(saveDir, data)
+            EVENTS_INDEX.add_event(data)
+        DAY_SUMMARIES.add_records(saveDir, records)
+    return records
+
+
+def get_image_filename(date: datetime) -> str:
+    """Readable name of the event image used for downloads"""
+    return f"image-{date:%Y-%m-%d_%H-%M-%S}.{date.microsecond // 1000:03d}.jpg"
+
+
+def string_to_datetime(date: str) -> datetime:
+    return parse_event_date(date)
+
+
+def iter_day_events(date: Union[str, datetime]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream events of the given day in the chronological order.
+    """
+    folder = get_day_folder(date)
+    if not folder.is_dir():
+        return
+
+    migrate_day_history(folder)
+    log_path = folder / EVENTS_LOG_FILENAME
+    if not log_path.exists():
+        return
+
+    with log_path.open("r") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # skip empty or incomplete lines
+                continue
+
+
+def iter_day_events_reversed(
+    date: Union[str, datetime], chunk_size: int = Config.EVENTS_LOG_TAIL_CHUNK
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream events of the given day from the most recent to older. Events
+    log is read backwards block by block, so reading the last events does
+    not depend on the log size.
+    """
+    log_path = get_day_folder(date) / EVENTS_LOG_FILENAME
+    if not log_path.exists():
+        # legacy history files are migrated by iter_day_events
+        yield from reversed(list(iter_day_events(date)))
+        return
+
+    with log_path.open("rb") as file:
+        position = file.seek(0, os.SEEK_END)
+        # incomplete line left from the previous block
+        tail = b""
+        while position > 0:
+            size = min(chunk_size, position)
+            position -= size
+            file.seek(position)
+            lines = (file.read(size) + tail).split(b"\n")
+            # first line can continue in the previous block
+            tail = lines.pop(0) if position > 0 else b""
+            for line in reversed(lines):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # skip empty or incomplete lines
+                    continue
+        if tail:
+            try:
+                yield json.loads(tail)
+            except ValueError:
+                pass
+
+
+def load_day_history(date: Union[str, datetime]) -> Optional[List[Dict[str, Any]]]:
+    """Returns events of the given day, from the most recent to older"""
+    history = list(iter_day_events(date))
+    return history[::-1]
+
+
+@dataclass
+class EventsSequence:
+    """Events separated by less than EVENTS_SEQUENCE_SEPARATION seconds"""
+
+    # epoch milliseconds of the first event, see get_sequence_id
+    sequence_id: int
+    # records in the chronological order
+    records: List[Dict[str, Any]] = field(default_factory=list)
+    # unique labels in the order of detection
+    labels: List[str] = field(default_factory=list)
+
+    def add_record(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+        for label in record["labels"]:
+            if label not in self.labels:
+                self.labels.append(label)
+
+    @property
+    def start_date(self) -> datetime:
+        return parse_event_date(self.records[0]["datetime"])
+
+    @property
+    def end_date(self) -> datetime:
+        return parse_event_date(self.records[-1]["datetime"])
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "EventsSequence":
+        sequence_id = records[0].get("sequence_id")
+        if sequence_id is None:
+            sequence_id = get_sequence_id(record_date(records[0]))
+        sequence = cls(sequence_id=sequence_id)
+        for record in records:
+            sequence.add_record(record)
+        return sequence
+
+
+def get_sequence_id(start_date: datetime) -> int:
+    return int(start_date.timestamp() * 1000)
+
+
+def is_sequence_finished(
+    start_date: datetime,
+    last_date: datetime,
+    date: datetime,
+    max_sequence_length: Optional[float] = None,
+) -> bool:
+    """
+    Check if event detected at the given date starts a new sequence.
+
+    Args:
+        start_date: date of the first sequence event
+        last_date: date of the last sequence event
+        date: date of the new event or the current date
+        max_sequence_length: maximum sequence duration in seconds, None - no
+            limit
+
+    Returns:
+        True if event is too far from the last one or sequence is too long
+    """
+    if (date - last_date).total_seconds() > EVENTS_SEQUENCE_SEPARATION:
+        return True
+    if max_sequence_length is None:
+        return False
+    return (date - start_date).total_seconds() > max_sequence_length
+
+
+@dataclass
+class OpenSequence:
+    """Events sequence which can still get new events"""
+
+    sequence_id: int
+    # dates of the first and the last frame with events
+    start_date: datetime
+    last_date: datetime
+    num_frames: int = 1
+
+
+class EventsSequenceTracker:
+    def __init__(self, max_sequences: int = MAX_TRACKED_SEQUENCES):
+        """
+        Single source of the events sequences. The monitoring loop assigns
+        frames with events to sequences and closes them, the snapshot writer
+        adds saved records to the sequences, so the finished sequence is
+        handed to the listeners without reading the events log.
+
+        Args:
+            max_sequences: saved sequences kept in memory until they are
+                finished, the oldest ones are dropped
+        """
+        self.lock = threading.Lock()
+        self.max_sequences = max_sequences
+        self.open_sequence: Optional[OpenSequence] = None
+        # sequence id -> records saved so far
+        self.sequences: Dict[int, EventsSequence] = {}
+
+    def add_frame(
+        self, date: datetime, max_sequence_length: Optional[float] = None
+    ) -> Tuple[int, bool]:
+        """
+        Assign frame with events to the open sequence or start a new one.
+
+        Args:
+            date: frame capture date
+            max_sequence_length: maximum sequence duration in seconds, None -
+                sequence is split only by the events separation
+
+        Returns:
+            sequence id and True if the frame starts the sequence
+        """
+        with self.lock:
+            sequence = self.open_sequence
+            if sequence is not None and not is_sequence_finished(
+                sequence.start_date, sequence.last_date, date, max_sequence_length
+            ):
+                sequence.last_date = max(sequence.last_date, date)
+                sequence.num_frames += 1
+                return sequence.sequence_id, False
+            sequence_id = get_sequence_id(date)
+            self.open_sequence = OpenSequence(sequence_id, date, date)
+            return sequence_id, True
+
+    def close_if_finished(
+        self, date: datetime, max_sequence_length: Optional[float] = None
+    ) -> Optional[OpenSequence]:
+        """
+        Close the open sequence if frame captured at the given date would
+        start a new one, with the same rules as add_frame.
+
+        Returns:
+            closed sequence or None
+        """
+        with self.lock:
+            sequence = self.open_sequence
+            if sequence is None or not is_sequence_finished(
+                sequence.start_date, sequence.last_date, date, max_sequence_length
+            ):
+                return None
+            self.open_sequence = None
+            return sequence
+
+    def close(self) -> Optional[OpenSequence]:
+        """Close the open sequence e.g. when monitoring stops"""
+        with self.lock:
+            sequence, self.open_sequence = self.open_sequence, None
+            return sequence
+
+    def add_records(
+        self, records: List[Dict[str, Any]], sequence_id: int, sequence_start: bool
+    ) -> None:
+        """
+        Stamp saved records of the single frame with "sequence_id" and
+        "sequence_start" fields and add them to their sequence.
+
+        Args:
+            records: records of the frame events
+            sequence_id: sequence assigned by add_frame
+            sequence_start: frame is the first one of the sequence
+        """
+        with self.lock:
+            sequence = self.sequences.get(sequence_id)
+            if sequence is None:
+                sequence = self.sequences[sequence_id] = EventsSequence(sequence_id)
+                while len(self.sequences) > self.max_sequences:
+                    del self.sequences[min(self.sequences)]
+            for i, record in enumerate(records):
+                record["sequence_id"] = sequence_id
+                record["sequence_start"] = sequence_start and i == 0
+                sequence.add_record(record)
+
+    def finish(self, sequence_id: int) -> Optional[EventsSequence]:
+        """
+        Returns records of the closed sequence, called once they are saved.
+        When the sequence is not tracked (e.g. it was dropped) it is read
+        from the tail of the events log.
+
+        Args:
+            sequence_id: id of the closed sequence
+
+        Returns:
+            finished sequence or None if there are no events
+        """
+        with self.lock:
+            sequence = self.sequences.pop(sequence_id, None)
+        if sequence is None or len(sequence.records) == 0:
+            start_date = datetime.fromtimestamp(sequence_id / 1000)
+            sequence = load_last_sequence(start_date, start_date=start_date)
+        return sequence
+
+
+EVENTS_SEQUENCES = EventsSequenceTracker()
+
+
+def load_last_sequence(
+    date: datetime, start_date: Optional[datetime] = None
+) -> Optional[EventsSequence]:
+    """
+    Read the most recent events sequence of the day from the end of the
+    events log. Records saved without sequence id are grouped by the events
+    separation.
+
+    Args:
+        date: day of the sequence
+        start_date: records older than this date are not read
+
+    Returns:
+        sequence or None if there are no matching events
+    """
+    records = []
+    last_date = None
+    for record in iter_day_events_reversed(date):
+        event_date = record_date(record)
+        if start_date is not None and event_date < start_date:
+            break
+        if len(records) > 0:
+            sequence_id = records[0].get("sequence_id")
+            if sequence_id is not None:
+                if record.get("sequence_id") != sequence_id:
+                    break
+            elif is_sequence_finished(event_date, event_date, last_date):
+                break
+        records.append(record)
+        last_date = event_date
+        if record.get("sequence_start", False):
+            break
+
+    if len(records) == 0:
+        return None
+    return EventsSequence.from_records(records[::-1])
+
+
+def load_day_summary(date: Union[str, datetime]) -> DaySummary:
+    """
+    Returns counts of the day events. Summary file is created from the
+    events log if it does not exist yet.
+    """
+    folder = get_day_folder(date)
+    with DAY_SUMMARIES.lock:
+        try:
+            return DAY_SUMMARIES.get(folder)
+        except (OSError, ValueError, KeyError):
+            summary = DaySummary.from_records(iter_day_events(date))
+            if folder.is_dir():
+                DAY_SUMMARIES.set(folder, summary)
+            return summary
+
+
+def summarize_days(start_date: datetime, end_date: datetime) -> DaySummary:
+    """Returns counts of all events in the [start_date, end_date) days range"""
+    summary = DaySummary()
+    day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end_date:
+        if get_day_folder(day).is_dir():
+            summary.update(load_day_summary(day))
+        day += timedelta(days=1)
+    return summary
+
+
+def iter_all_events() -> Iterator[Dict[str, Any]]:
+    for day in list_days():
+        yield from iter_day_events(day)
+
+
+def assign_sequences(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Stamp sequence fields of the chronologically ordered records saved
+    before sequences were assigned at write time.
+    """
+    start_date = last_date = None
+    sequence_id = None
+    for record in records:
+        date = record_date(record)
+        if "sequence_id" in record:
+            if record["sequence_id"] != sequence_id:
+                start_date = date
+                sequence_id = record["sequence_id"]
+        elif sequence_id is None or is_sequence_finished(start_date, last_date, date):
+            start_date = date
+            sequence_id = get_sequence_id(date)
+            record["sequence_id"] = sequence_id
+            record["sequence_start"] = True
+        else:
+            record["sequence_id"] = sequence_id
+            record["sequence_start"] = False
+        last_date = date
+        yield record
+
+
+def rebuild_events_index() -> int:
+    """
+    Re-scan all events logs in the snapshots folder and rebuild the events
+    index from scratch.
+
+    Returns:
+        number of indexed events
+    """
+    return EVENTS_INDEX.rebuild(assign_sequences(iter_all_events()))
+
+
+def ensure_events_index() -> None:
+    """
+    Build events index from the events logs if index was just created.
+    Called at startup before events are saved, so the snapshot writer never
+    waits for the rebuild, and before searches.
+    """
+    with EVENTS_INDEX.lock:
+        if EVENTS_INDEX.connection is not None and EVENTS_INDEX.is_new:
+            EVENTS_INDEX.is_new = False
+            rebuild_events_index()
+
+
+def search_events(
+    query: EventsQuery, cursor: Optional[Cursor] = None, limit: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+    """
+    Find events matching the query using events index.
+
+    Args:
+        query: search parameters
+        cursor: position returned with the previous page
+        limit: page size, None returns all events
+
+    Returns:
+        list of events records from the most recent to older and cursor to
+        the next page (None if there are no more events)
+    """
+    ensure_events_index()
+    return EVENTS_INDEX.search(query, cursor=cursor, limit=limit)
+
+
+def load_events(event_ids: List[int]) -> List[Dict[str, Any]]:
+    """Returns records of the given events in the order of ids"""
+    ensure_events_index()
+    records = {r["event_id"]: r for r in EVENTS_INDEX.get_events(event_ids)}
+    return [records[event_id] for event_id in event_ids if event_id in records]
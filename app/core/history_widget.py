@@ -1,23 +1,25 @@
-import base64
-import json
 import os
 import threading
-import zipfile
-from collections import Counter
 from datetime import datetime, timedelta
-from io import BytesIO
-from pathlib import Path
-from typing import List, Dict, Any, Tuple, Optional, Union
+from typing import List, Dict, Any, Tuple, Optional, Union, Set
 
-from PIL import Image
+import numpy as np
 from remi import gui
 
 import config.styles as css
-from config.config import Config, DAY_FORMAT, HOUR_FORMAT, DATE_FORMAT, \
-    EVENTS_SEQUENCE_SEPARATION
+from config.config import Config, DAY_FORMAT
+from core.day_summary import DaySummary
+from core.event_index import EventsQuery, Cursor, parse_event_date
+from core.facets import EventsColumns, load_events_columns
+from core.history import (
+    load_events,
+    get_image_filename,
+    search_events,
+    summarize_days,
+)
+from core.routes import get_snapshot_url, DOWNLOADS
+from core.ui_updates import UI_UPDATES
 from core.widgets import (
-    PILImage,
-    StaticPILImageWidget,
     HorizontalLine,
     CustomFormWidget,
     ToggleButton,
@@ -32,7 +34,9 @@ class HistoryEventWidget(gui.Container):
         self.css_margin = "5px auto"
         self.add_class("border border-secondary")
         self.image_path: Optional[str] = None
-        self.image_thumbnail = StaticPILImageWidget(None)
+        self.event_id: Optional[int] = None
+        self.image_thumbnail = gui.Image("")
+        self.image_thumbnail.attributes["loading"] = "lazy"
         self.labels_lbl = gui.Label("")
         self.event_date_lbl = gui.Label("")
         self.camera_name_lbl = gui.Label("")
@@ -66,23 +70,26 @@ class HistoryEventWidget(gui.Container):
     @staticmethod
     def from_config(config: Dict[str, Any]) -> "HistoryEventWidget":
         widget = HistoryEventWidget()
-        thumbnail = Image.open(config["thumbnail_path"])
-        widget.image_thumbnail.set_image(thumbnail)
+        widget.image_thumbnail.set_image(get_snapshot_url(config["thumbnail_path"]))
         widget.labels_lbl.set_text(", ".join(config["labels"]))
         widget.event_date_lbl.set_text(config["datetime"])
         widget.camera_name_lbl.set_text(config["camera_name"])
         widget.roi_name_lbl.set_text(config["roi_name"])
         widget.image_path = config["image_path"]
+        if not os.path.exists(widget.image_path):
+            # full resolution image removed by the snapshots cleanup
+            widget.download_image_btn.css_visibility = "hidden"
+        widget.event_id = config.get("event_id")
         return widget
 
     def on_download_image(self, emitter):
-        with open(self.image_path, "rb") as f:
-            image_bytes = base64.b64encode(f.read()).decode()
-        filename = Path(self.image_path).name
-
+        if not os.path.exists(self.image_path):
+            return
+        filename = self.download_filename
+        url = get_snapshot_url(self.image_path, download_name=filename)
         Config.APP_INSTANCE.execute_javascript(
             f"""
-            downloadImage(imageBytes="{image_bytes}", filename="{filename}")
+            downloadUrl(url="{url}", filename="{filename}")
             """
         )
 
@@ -102,12 +109,22 @@ class HistoryEventWidget(gui.Container):
 
     @property
     def event_date(self) -> datetime:
-        return datetime.strptime(self.event_date_lbl.get_text(), DATE_FORMAT)
+        return parse_event_date(self.event_date_lbl.get_text())
+
+    @property
+    def download_filename(self) -> str:
+        return get_image_filename(self.event_date)
 
     def checkbox_toggled(self, emitter: gui.CheckBox):
         is_selected = not emitter.get_value()
         emitter.set_value(is_selected)
         self.layout.redraw()
+        self.on_selection_changed(is_selected)
+
+    @gui.decorate_set_on_listener("(self, emitter, is_selected)")
+    @gui.decorate_event
+    def on_selection_changed(self, is_selected: bool):
+        return (is_selected,)
 
 
 class HistoryWidget(gui.Container):
@@ -120,7 +137,22 @@ class HistoryWidget(gui.Container):
         self.unique_labels_list = gui.ListView()
         self.unique_rois_list = gui.ListView()
 
+        self.load_more_btn = SButton("Load more", "fa-angle-double-down")
+        self.load_more_btn.add_class("btn btn-secondary")
+        self.load_more_btn.css_display = "none"
+        self.query: Optional[EventsQuery] = None
+        # search result loaded when needed, filters are applied to it in memory
+        self.columns: Optional[EventsColumns] = None
+        # ids of the filtered events and the number of loaded ones, None if
+        # all query events are displayed and read from the index page by page
+        self.displayed_ids: Optional[np.ndarray] = None
+        self.num_loaded = 0
+        self.next_cursor: Optional[Cursor] = None
+        # selected events are kept by id, also these not loaded yet
+        self.selected_event_ids: Set[int] = set()
+
         self.container.append(self.events_hist_list)
+        self.container.append(self.load_more_btn)
 
         btn_class = "btn btn-primary"
         btn_css = css.HISTORY_SEARCH_STYLE
@@ -197,54 +229,117 @@ class HistoryWidget(gui.Container):
         self.deselect_all_btn.onclick.do(self.deselect_all_images)
         self.reset_filters_btn.onclick.do(self.reset_filters)
         self.apply_filters_btn.onclick.do(self.apply_filters)
+        self.load_more_btn.onclick.do(self.load_next_page)
 
-    def search_for_events(self) -> Tuple[List[HistoryEventWidget], List[str], bool]:
-        widgets, labels, msg = load_history_widgets(
+    def create_search_query(self) -> Optional[EventsQuery]:
+        query, msg = create_events_query(
             start_date=self.search_from_date_widget.get_value(),
             end_date=self.search_to_date_widget.get_value(),
             labels_filter=self.filter_by_label_input.get_text(),
             only_unique_events=self.show_only_unique_events_btn.is_toggled,
         )
-        if widgets is None:
+        if query is None:
             self.search_info_lbl.set_text(f"Error: {msg}")
-            return [], [], False
-
-        return widgets, labels, True
+        return query
 
     def update_events_history_list_thread(self, emitter=None):
+        query = self.create_search_query()
+        if query is None:
+            return False
         self.search_history_btn.set_icon("fa-spin fa-search")
-        threading.Thread(target=self.update_events_history_list).start()
-
-    def update_events_history_list(self, emitter=None):
+        threading.Thread(target=self.update_events_history_list, args=(query,)).start()
+
+    def update_events_history_list(self, query: EventsQuery) -> None:
+        """Load counts of the query events in the background thread"""
+        summary = None
+        columns = None
+        if query.label is None and not query.only_unique:
+            # counts of all events are read from the per-day summaries
+            summary = summarize_days(query.start_date, query.end_date)
+        else:
+            columns = load_events_columns(query)
+        UI_UPDATES.post(
+            self, "search_results", self.show_search_results, query, summary, columns
+        )
 
-        self.events_hist_list.empty()
+    def show_search_results(
+        self,
+        query: EventsQuery,
+        summary: Optional[DaySummary],
+        columns: Optional[EventsColumns],
+    ) -> None:
+        self.query = query
+        self.columns = columns
         self.unique_labels_list.empty()
         self.unique_rois_list.empty()
-
-        widgets, labels, is_ok = self.search_for_events()
-        if not is_ok:
-            return False
-
-        for widget in widgets:
-            self.events_hist_list.append(widget)
-
-        self.search_info_lbl.set_text(f"Found {len(widgets)} events.")
-
-        labels_counts = Counter(labels).most_common()
+        if columns is None:
+            num_events = summary.num_events
+            labels_counts = summary.count_labels()
+            rois_counts = summary.count_rois()
+            hours_counts = summary.count_hours()
+            event_ids = None
+        else:
+            mask = columns.get_mask()
+            num_events = len(columns)
+            labels_counts = columns.count_labels(mask)
+            rois_counts = columns.count_rois(mask)
+            hours_counts = columns.count_hours(mask)
+            event_ids = columns.event_ids
+
+        self.search_info_lbl.set_text(f"Found {num_events} events.")
         for label, count in labels_counts:
             label_btn = ToggleButton(f"{label} ({count})", label)
             label_btn.set_style(css.SMALL_BUTTON_STYLE)
             self.unique_labels_list.append(label_btn)
 
-        rois_counts = Counter([w.roi_name for w in widgets]).most_common()
         for roi, count in rois_counts:
             label_btn = ToggleButton(f"{roi} ({count})", roi)
             label_btn.set_style(css.SMALL_BUTTON_STYLE)
             self.unique_rois_list.append(label_btn)
 
-        self.hourly_hist_widget.update_from_dates([w.event_date for w in widgets])
+        self.hourly_hist_widget.update_from_counts(hours_counts)
+        self.show_events(event_ids)
         self.search_history_btn.set_icon("fa-search")
 
+    def get_columns(self) -> Optional[EventsColumns]:
+        if self.columns is None and self.query is not None:
+            self.columns = load_events_columns(self.query)
+        return self.columns
+
+    def show_events(self, event_ids: Optional[np.ndarray]) -> None:
+        """
+        Replace displayed events with the first page of the given events
+        or of all query events if event_ids is None.
+        """
+        self.displayed_ids = event_ids
+        self.next_cursor = None
+        self.num_loaded = 0
+        self.selected_event_ids.clear()
+        self.events_hist_list.empty()
+        self.load_next_page()
+
+    def load_next_page(self, emitter=None) -> None:
+        if self.displayed_ids is None:
+            if self.query is None:
+                return
+            records, self.next_cursor = search_events(
+                self.query, cursor=self.next_cursor, limit=Config.HISTORY_PAGE_SIZE
+            )
+            has_more = self.next_cursor is not None
+        else:
+            end = self.num_loaded + Config.HISTORY_PAGE_SIZE
+            page_ids = self.displayed_ids[self.num_loaded : end].tolist()
+            records = load_events(page_ids)
+            self.num_loaded += len(page_ids)
+            has_more = self.num_loaded < len(self.displayed_ids)
+
+        for record in records:
+            widget = HistoryEventWidget.from_config(record)
+            widget.set_selected(widget.event_id in self.selected_event_ids)
+            widget.on_selection_changed.do(self.on_event_selection_changed)
+            self.events_hist_list.append(widget)
+        self.load_more_btn.css_display = "block" if has_more else "none"
+
     def reset_filters(self, emitter=None):
         for btn in self.unique_rois_list.children.values():
             btn.set_checked(False)
@@ -268,52 +363,31 @@ class HistoryWidget(gui.Container):
         ]
 
     def apply_filters(self, emitter=None):
-        widgets, _, is_ok = self.search_for_events()
-        if not is_ok:
+        columns = self.get_columns()
+        if columns is None:
             return False
 
-        selected_labels = set(self.get_selected_labels())
-        selected_rois = self.get_selected_rois()
-        selected_hours = self.hourly_hist_widget.get_selected_hours()
-
-        labels_empty = len(selected_labels) == 0
-        rois_empty = len(selected_rois) == 0
-        hours_empty = len(selected_hours) == 0
-
-        self.events_hist_list.empty()
-        filtered_labels = []
-        for widget in widgets:
-
-            roi = widget.roi_name
-            labels = set(widget.labels)
-            hour = widget.event_date.hour
-
-            roi_test = roi in selected_rois or rois_empty
-            labels_test = len(labels.intersection(selected_labels)) > 0 or labels_empty
-            hours_test = hour in selected_hours or hours_empty
-
-            if all([roi_test, labels_test, hours_test]):
-                self.events_hist_list.append(widget)
-                filtered_labels += list(labels)
-
-        self.search_info_lbl.set_text(
-            f"Filtered {len(self.events_hist_list.children)} events."
+        mask = columns.get_mask(
+            labels=self.get_selected_labels(),
+            rois=self.get_selected_rois(),
+            hours=self.hourly_hist_widget.get_selected_hours(),
         )
+        self.search_info_lbl.set_text(f"Filtered {int(mask.sum())} events.")
 
-        labels_counts = Counter(filtered_labels)
+        labels_counts = dict(columns.count_labels(mask))
         for btn in self.unique_labels_list.children.values():
             label = btn.internal_value
             count = labels_counts.get(label, 0)
             btn.set_text(f"{label} ({count})")
 
-        rois_counts = Counter(
-            [w.roi_name for w in self.events_hist_list.children.values()]
-        )
+        rois_counts = dict(columns.count_rois(mask))
         for btn in self.unique_rois_list.children.values():
             roi = btn.internal_value
             count = rois_counts.get(roi, 0)
             btn.set_text(f"{roi} ({count})")
 
+        self.show_events(columns.event_ids[mask])
+
     def set_today_date(self, emitter=None):
         todays_date = datetime.now().strftime(DAY_FORMAT)
         self.search_from_date_widget.set_value(todays_date)
@@ -336,108 +410,46 @@ class HistoryWidget(gui.Container):
         date = self.search_end_date + delta
         self.search_to_date_widget.set_value(date.strftime(DAY_FORMAT))
 
-    def selected_images(self) -> List[str]:
-        images_to_pack = []
-        for name, widget in self.events_hist_list.children.items():
-            if type(widget) == HistoryEventWidget and widget.is_selected():
-                images_to_pack.append(widget.image_path)
-        return images_to_pack
+    def on_event_selection_changed(self, emitter: HistoryEventWidget, is_selected):
+        if is_selected:
+            self.selected_event_ids.add(emitter.event_id)
+        else:
+            self.selected_event_ids.discard(emitter.event_id)
 
-    def select_all_images(self, emitter=None) -> None:
+    def set_all_selected(self, toggle: bool) -> None:
         for name, widget in self.events_hist_list.children.items():
             if type(widget) == HistoryEventWidget:
-                widget.set_selected(True)
+                widget.set_selected(toggle)
+
+    def select_all_images(self, emitter=None) -> None:
+        # select all displayed events, not only the loaded ones
+        event_ids = self.displayed_ids
+        if event_ids is None and self.get_columns() is not None:
+            event_ids = self.columns.event_ids
+        if event_ids is not None:
+            self.selected_event_ids = set(event_ids.tolist())
+        self.set_all_selected(True)
 
     def deselect_all_images(self, emitter=None) -> None:
-        for name, widget in self.events_hist_list.children.items():
-            if type(widget) == HistoryEventWidget:
-                widget.set_selected(False)
+        self.selected_event_ids.clear()
+        self.set_all_selected(False)
 
     def on_download_images(self, emitter):
-        if not self.selected_images():
+        if not self.selected_event_ids:
             return
-        Config.APP_INSTANCE.execute_javascript(
-            f'window.location = "/{id(self)}/direct_download_selected"'
-        )
-
-    def direct_download_selected(self):
-
-        images_to_pack = self.selected_images()
         start_date = self.search_from_date_widget.get_value()
         end_date = self.search_to_date_widget.get_value()
         zip_name = f"snapshots-{start_date}-{end_date}.zip"
-        zip_bytes = BytesIO()
-        zip_file = zipfile.ZipFile(zip_bytes, "w")
-        for image in images_to_pack:
-            image_bytes = open(image, "r+b").read()
-            image_name = Path(image).name
-            zip_file.writestr(image_name, image_bytes)
-        zip_file.close()
-
-        headers = {
-            "Content-type": "application/zip",
-            "Content-Disposition": f'attachment; filename="{zip_name}"',
-        }
-        return [zip_bytes.getvalue(), headers]
-
-
-def append_snapshots_history(
-    image: PILImage,
-    labels: List[str],
-    labels_filter: str,
-    roi_name: str,
-    camera_name: str,
-    image_change: float,
-) -> bool:
-    now = datetime.now()
-    date = now.strftime(DAY_FORMAT)
-    hour = now.strftime(HOUR_FORMAT)
-    saveDir = Config.SNAPSHOTS_DIR / str(date)
-    saveDir.mkdir(exist_ok=True, parents=True)
-
-    thumbnail = image.copy()
-    thumbnail.thumbnail(Config.THUMBNAIL_SIZE)
-    thumbnail_path = f"{saveDir}/thumbnail-{hour}.jpg"
-    image_path = f"{saveDir}/image-{hour}.jpg"
-
-    thumbnail.save(thumbnail_path)
-    image.save(image_path)
-
-    data = {
-        "datetime": now.strftime(f"{DAY_FORMAT} {HOUR_FORMAT}"),
-        "thumbnail_path": thumbnail_path,
-        "image_path": image_path,
-        "labels": labels,
-        "class_filter": labels_filter,
-        "camera_name": camera_name,
-        "roi_name": roi_name,
-        "image_change": image_change,
-    }
-    history_file = Path(f"{saveDir}/history.json")
-    if history_file.exists():
-        with history_file.open("r") as file:
-            history = json.load(file)
-    else:
-        history = []
-
-    history.append(data)
-    with history_file.open("w") as file:
-        json.dump(history, file, indent=2)
-
-    return True
-
-
-def string_to_datetime(date: str) -> datetime:
-    return datetime.strptime(date, DATE_FORMAT)
-
-
-def load_history_widgets(
+        url = DOWNLOADS.register(sorted(self.selected_event_ids), zip_name)
+        Config.APP_INSTANCE.execute_javascript(f'window.location = "{url}"')
+
+
+def create_events_query(
     start_date: Union[str, datetime],
     end_date: Union[str, datetime],
     labels_filter: str,
     only_unique_events: bool,
-    max_days: int = 30,
-) -> Tuple[Optional[List[HistoryEventWidget]], List[str], str]:
+) -> Tuple[Optional[EventsQuery], str]:
 
     if type(start_date) is str:
         start_date = datetime.strptime(start_date, DAY_FORMAT)
@@ -446,63 +458,16 @@ def load_history_widgets(
 
     labels_filter = labels_filter.strip().lower()
     if end_date < start_date:
-        return None, [], "End date cannot be smaller than start day"
-
-    widgets = []
-    labels = []
-    search_day = start_date
-    add_one_day = timedelta(days=1)
-    while search_day <= end_date:
-        folder = Config.SNAPSHOTS_DIR / search_day.strftime(DAY_FORMAT)
-        if not folder.is_dir():
-            search_day += add_one_day
-            continue
-
-        day_config_path = Path(folder) / "history.json"
-        if not day_config_path.exists():
-            search_day += add_one_day
-            continue
-
-        with day_config_path.open("r") as file:
-            day_history_list = json.load(file)
-
-        for event in day_history_list:
-            event_labels = event["labels"]
-            if labels_filter in ["*", ""] + event_labels:
-                widget = HistoryEventWidget.from_config(event)
-                widgets.append(widget)
-                labels += event_labels
-        search_day += add_one_day
-
-    # reverse events from most recent to older
-    event_widgets = widgets[::-1]
-
-    if only_unique_events:
-        # return these events which are separated by more then
-        # 5 seconds
-        new_event_widgets = []
-        last_date = datetime.now()
-        for event in event_widgets:
-            dt = last_date - event.event_date
-            if dt.total_seconds() > EVENTS_SEQUENCE_SEPARATION:
-                new_event_widgets.append(event)
-            last_date = event.event_date
-
-        event_widgets = new_event_widgets
-
-    return event_widgets, labels, ""
-
-
-def load_day_history(date: Union[str, datetime]) -> Optional[List[Dict[str, Any]]]:
-
-    if type(date) is str:
-        date = datetime.strptime(date, DAY_FORMAT)
-
-    folder = Config.SNAPSHOTS_DIR / date.strftime(DAY_FORMAT)
-    day_config_path = Path(folder) / "history.json"
-    if not day_config_path.exists():
-        return []
-
-    with day_config_path.open("r") as file:
-        history = json.load(file)
-    return history[::-1]
+        return None, "End date cannot be smaller than start day"
+
+    label = None
+    if labels_filter not in ["*", ""]:
+        label = labels_filter
+
+    query = EventsQuery(
+        start_date=start_date,
+        end_date=end_date + timedelta(days=1),
+        label=label,
+        only_unique=only_unique_events,
+    )
+    return query, ""
@@ -0,0 +1,95 @@
+from functools import lru_cache
+from typing import List, Tuple, Union
+
+import PIL
+import PIL.Image
+from PIL import ImageDraw, ImageFont
+
+from config.config import Config
+
+PILImage = PIL.Image.Image
+Color = Union[str, Tuple[int, int, int, int]]
+
+ROI_FONT_SIZE = 30
+ROI_ENABLED_COLOR = (40, 167, 69, 250)
+ROI_DISABLED_COLOR = "red"
+
+
+@lru_cache(maxsize=None)
+def load_font(size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(str(Config.FONT_PATH), size=size)
+
+
+def draw_roi_on_image(
+    image: PILImage, box: Tuple[int, int, int, int], name: str, color: Color
+) -> PILImage:
+    """
+    Draw ROI rectangle together with its name on the image (inplace).
+    Args:
+        image: image to draw on
+        box: ROI box in pixels (x_min, y_min, x_max, y_max)
+        name: text to be drawn above the ROI
+        color: ROI rectangle color
+
+    Returns:
+        the same image
+    """
+    font_size = ROI_FONT_SIZE
+    fnt = load_font(font_size)
+    draw = ImageDraw.Draw(image, "RGBA")
+    x1, y1, x2, y2 = box
+    draw.rectangle((box[:2], box[2:]), outline=color, width=3)
+    draw.rectangle((x1, y1 - font_size - 2, x2, y1), fill=color, width=3)
+    draw.text((box[0], box[1] - font_size + 2), name, font=fnt)
+    return image
+
+
+def get_preview_size(
+    image_size: Tuple[int, int], max_size: Tuple[int, int]
+) -> Tuple[int, int]:
+    """
+    Compute size of the image which fits into max_size, smaller images are
+    upscaled to match max_size width.
+    """
+    sw, sh = image_size
+    tw, th = max_size
+    scale = max(tw / sw, 1.0)
+    scale = scale * min(tw / (sw * scale), th / (sh * scale), 1.0)
+    return max(1, int(sw * scale)), max(1, int(sh * scale))
+
+
+def resize_to_preview(image: PILImage, max_size: Tuple[int, int]) -> PILImage:
+    """Returns a new image resized with single resampling to the preview size"""
+    size = get_preview_size(image.size, max_size)
+    if size == image.size:
+        return image.copy()
+    return image.resize(size)
+
+
+def create_montage(
+    images: List[PILImage], tile_size: Tuple[int, int], num_columns: int
+) -> PILImage:
+    """
+    Paste images downscaled to tile_size into a grid, row by row.
+
+    Args:
+        images: non empty list of images
+        tile_size: maximum size of the single image in the grid
+        num_columns: maximum number of images in a row
+
+    Returns:
+        RGB montage image
+    """
+    num_columns = min(num_columns, len(images))
+    num_rows = -(-len(images) // num_columns)
+    tw, th = tile_size
+    montage = PIL.Image.new("RGB", (tw * num_columns, th * num_rows))
+    for i, image in enumerate(images):
+        tile = image.convert("RGB")
+        tile.thumbnail(tile_size)
+        row, column = divmod(i, num_columns)
+        # center tile in its cell
+        x = column * tw + (tw - tile.width) // 2
+        y = row * th + (th - tile.height) // 2
+        montage.paste(tile, (x, y))
+    return montage
@@ -0,0 +1,298 @@
+"""
+In-process application metrics: counters, gauges and fixed-bucket
+histograms. Metrics are registered once at the module import and updated
+from any thread, the registry is rendered in the System tab and served in
+the Prometheus text format by the metrics route.
+"""
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# metric names exposed to Prometheus start with this prefix
+METRICS_PREFIX = "clever_camera_"
+# histogram buckets upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_float(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric(ABC):
+    type_name = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        """
+        Args:
+            name: metric name without the prefix, e.g. "predict_seconds"
+            description: short help text
+            label_names: names of the labels, values are given as keyword
+                arguments of the update methods
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+
+    def get_label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def format_labels(self, values: LabelValues, **extra: str) -> str:
+        pairs = list(zip(self.label_names, values)) + list(extra.items())
+        if len(pairs) == 0:
+            return ""
+        text = ",".join(f'{k}="{escape_label_value(v)}"' for k, v in pairs)
+        return f"{{{text}}}"
+
+    @abstractmethod
+    def format_samples(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def format_summary(self) -> str:
+        pass
+
+    def format_prometheus(self) -> str:
+        name = METRICS_PREFIX + self.name
+        lines = [
+            f"# HELP {name} {self.description}",
+            f"# TYPE {name} {self.type_name}",
+        ]
+        lines.extend(self.format_samples())
+        return "\n".join(lines)
+
+    @staticmethod
+    def format_series_name(values: LabelValues) -> str:
+        return "/".join(values) if values else "total"
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self.lock:
+            return self.values.get(self.get_label_values(labels), 0.0)
+
+    def format_samples(self) -> List[str]:
+        name = METRICS_PREFIX + self.name
+        with self.lock:
+            values = sorted(self.values.items())
+        return [
+            f"{name}{self.format_labels(key)} {format_float(value)}"
+            for key, value in values
+        ]
+
+    def format_summary(self) -> str:
+        with self.lock:
+            values = sorted(self.values.items())
+        return ", ".join(
+            f"{self.format_series_name(key)}={value:g}" for key, value in values
+        )
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self.values: Dict[LabelValues, float] = {}
+        self.functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        """Read value of the gauge from function when metrics are rendered"""
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.functions[key] = function
+
+    def collect(self) -> List[Tuple[LabelValues, float]]:
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for key, function in functions.items():
+            try:
+                values[key] = float(function())
+            except Exception:
+                values.pop(key, None)
+        return sorted(values.items())
+
+    def format_samples(self) -> List[str]:
+        name = METRICS_PREFIX + self.name
+        return [
+            f"{name}{self.format_labels(key)} {format_float(value)}"
+            for key, value in self.collect()
+        ]
+
+    def format_summary(self) -> str:
+        return ", ".join(
+            f"{self.format_series_name(key)}={value:g}" for key, value in self.collect()
+        )
+
+
+class HistogramSeries:
+    def __init__(self, num_buckets: int):
+        # the last bucket counts values above the highest bound
+        self.buckets = [0] * (num_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, label_names)
+        self.bounds = tuple(sorted(buckets))
+        self.series: Dict[LabelValues, HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = HistogramSeries(len(self.bounds))
+            series.buckets[index] += 1
+            series.count += 1
+            series.sum += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe duration of the with block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_quantile(self, series: HistogramSeries, quantile: float) -> float:
+        """Upper bound of the bucket containing the quantile"""
+        rank = quantile * series.count
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), series.buckets):
+            total += count
+            if total >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self) -> List[Tuple[LabelValues, HistogramSeries]]:
+        with self.lock:
+            items = []
+            for key, series in sorted(self.series.items()):
+                copy = HistogramSeries(len(self.bounds))
+                copy.buckets = list(series.buckets)
+                copy.count = series.count
+                copy.sum = series.sum
+                items.append((key, copy))
+            return items
+
+    def format_samples(self) -> List[str]:
+        name = METRICS_PREFIX + self.name
+        lines = []
+        for key, series in self.snapshot():
+            total = 0
+            for bound, count in zip(self.bounds + (math.inf,), series.buckets):
+                total += count
+                labels = self.format_labels(key, le=format_float(bound))
+                lines.append(f"{name}_bucket{labels} {total}")
+            labels = self.format_labels(key)
+            lines.append(f"{name}_sum{labels} {format_float(series.sum)}")
+            lines.append(f"{name}_count{labels} {series.count}")
+        return lines
+
+    def format_summary(self) -> str:
+        stats = []
+        for key, series in self.snapshot():
+            if series.count == 0:
+                continue
+            mean = series.sum / series.count
+            p95 = self.get_quantile(series, 0.95)
+            if math.isinf(p95):
+                p95_text = f">{1000 * self.bounds[-1]:g}ms"
+            else:
+                p95_text = f"<={1000 * p95:g}ms"
+            stats.append(
+                f"{self.format_series_name(key)}: n={series.count}, "
+                f"mean={1000 * mean:.1f}ms, p95{p95_text}"
+            )
+        return "; ".join(stats)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Application metrics by name, metrics are created once and shared"""
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) != type(metric):
+                    raise ValueError(f"Metric {metric.name} already registered")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> Counter:
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> Gauge:
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, description, label_names, buckets))
+
+    def list_metrics(self) -> List[Metric]:
+        with self.lock:
+            return [self.metrics[name] for name in sorted(self.metrics)]
+
+    def format_prometheus(self) -> str:
+        """Text exposition format version 0.0.4"""
+        return "\n".join(m.format_prometheus() for m in self.list_metrics()) + "\n"
+
+
+METRICS = MetricsRegistry()
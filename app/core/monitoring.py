@@ -0,0 +1,435 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List, Tuple
+
+from config.config import Config
+from core.base_predictor import ClassificationOutput
+from core.camera_client import get_camera_client, BaseCameraClient
+from core.history import (
+    SnapshotEvent,
+    EventsSequence,
+    EVENTS_LOG,
+    EVENTS_SEQUENCES,
+    OpenSequence,
+)
+from core.frame_buffer import EventFramesRecorder
+from core.image_utils import PILImage
+from core.metrics import METRICS
+from core.persistence import SNAPSHOT_WRITER
+from core.scheduler import DeadlineScheduler
+from core.settings import CameraSettings, ROISettings
+from core.tflite_classifier_predictor import TFClassifierPredictor
+from core.tracing import TRACER
+
+MONITORING_STOPPED = "stopped"
+MONITORING_RUNNING = "running"
+MONITORING_SLEEPING = "sleeping"
+MEAN_CHANGE_THRESHOLD = 0.01
+
+logger = logging.getLogger("clever-camera")
+
+FRAMES_COUNTER = METRICS.counter(
+    "monitoring_frames_total", "Camera frames processed by the monitoring loop"
+)
+MOTION_SECONDS = METRICS.histogram(
+    "motion_score_seconds", "Image change computation time of all ROIs"
+)
+PREDICT_SECONDS = METRICS.histogram("predict_seconds", "Classifier prediction time")
+EVENTS_COUNTER = METRICS.counter("events_total", "Detected snapshot events", ["roi"])
+LATENESS_COUNTER = METRICS.counter(
+    "monitoring_overruns_total", "Monitoring iterations longer than check period"
+)
+
+
+class MonitoringObserver:
+    """
+    Base class for objects which want to be notified about the monitoring
+    engine state e.g. web UI. All methods are optional.
+    """
+
+    def on_log(self, level: str, text: str) -> None:
+        pass
+
+    def on_state_changed(self, state: str) -> None:
+        pass
+
+    def on_frame(self, image: PILImage) -> None:
+        pass
+
+    def on_events_sequence_saved(self, sequence: EventsSequence) -> None:
+        """Called from the dispatcher thread once sequence records are saved"""
+        pass
+
+
+class LoggingObserver(MonitoringObserver):
+    """Forwards engine messages to the python logging module"""
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        if logger is None:
+            logger = logging.getLogger("clever-camera")
+        self.logger = logger
+
+    def on_log(self, level: str, text: str) -> None:
+        self.logger.log(logging.getLevelName(level.upper()), text)
+
+    def on_state_changed(self, state: str) -> None:
+        self.logger.info(f"Monitoring state: {state}")
+
+
+class MonitoringEngine:
+    def __init__(self, settings: Optional[CameraSettings] = None):
+        """
+        Camera monitoring loop which does not depend on the web UI. Engine
+        state changes are reported to the registered observers.
+
+        Args:
+            settings: camera and ROIs settings
+        """
+        if settings is None:
+            settings = CameraSettings.from_dict({})
+        self.settings = settings
+        self._settings_lock = threading.Lock()
+        self.camera_client: Optional[BaseCameraClient] = None
+        self.predictor: Optional[TFClassifierPredictor] = None
+        self.is_running = False
+        self.state = MONITORING_STOPPED
+        self.observers: List[MonitoringObserver] = []
+        self.frames_recorder = EventFramesRecorder()
+        self._thread: Optional[threading.Thread] = None
+        # ids of the closed sequences waiting for the observers
+        self.finished_sequences: "queue.Queue[int]" = queue.Queue()
+        self._dispatcher_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config_file(cls, path: Optional[Path] = None) -> "MonitoringEngine":
+        """Create engine from the settings.yaml file saved by the web UI"""
+        if path is not None:
+            Config.CONFIG_PATH = Path(path)
+        config = Config.load_config()
+        if config is None:
+            raise FileNotFoundError(f"Cannot find config at: {Config.CONFIG_PATH}")
+        return cls(CameraSettings.from_dict(config["camera_settings"]))
+
+    def add_observer(self, observer: MonitoringObserver) -> None:
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def remove_observer(self, observer: MonitoringObserver) -> None:
+        if observer in self.observers:
+            self.observers.remove(observer)
+
+    def info(self, text: str):
+        for observer in self.observers:
+            observer.on_log("info", text)
+
+    def warning(self, text: str):
+        for observer in self.observers:
+            observer.on_log("warning", text)
+
+    def error(self, text: str):
+        for observer in self.observers:
+            observer.on_log("error", text)
+
+    def set_state(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        for observer in self.observers:
+            observer.on_state_changed(state)
+
+    def emit_frame(self, image: PILImage):
+        for observer in self.observers:
+            observer.on_frame(image)
+
+    def emit_events_sequence_finished(self, sequence_id: int):
+        # observers get sequence records once they are saved, the writer
+        # only signals it and observers are called by the dispatcher thread,
+        # so neither the loop nor the writer waits for them
+        self.start_dispatcher()
+        SNAPSHOT_WRITER.call_when_written(self.finished_sequences.put, sequence_id)
+
+    def start_dispatcher(self) -> None:
+        if self._dispatcher_thread is not None and self._dispatcher_thread.is_alive():
+            return
+        self._dispatcher_thread = threading.Thread(
+            target=self.dispatch_finished_sequences, daemon=True
+        )
+        self._dispatcher_thread.start()
+
+    def dispatch_finished_sequences(self) -> None:
+        while True:
+            sequence_id = self.finished_sequences.get()
+            try:
+                self.finish_events_sequence(sequence_id)
+            except Exception:
+                logger.exception("Cannot dispatch finished events sequence")
+
+    def finish_events_sequence(self, sequence_id: int):
+        sequence = EVENTS_SEQUENCES.finish(sequence_id)
+        if sequence is None:
+            return
+        for observer in self.observers:
+            observer.on_events_sequence_saved(sequence)
+
+    def end_events_sequence(self, sequence: Optional[OpenSequence]) -> None:
+        if sequence is None:
+            return
+        self.info(f"Sequence of {sequence.num_frames} frames finished")
+        self.emit_events_sequence_finished(sequence.sequence_id)
+        self.frames_recorder.stop_sequence()
+
+    def set_settings(self, settings: CameraSettings) -> None:
+        """
+        Replace settings snapshot, monitoring loop will use it starting from
+        the next frame.
+        """
+        with self._settings_lock:
+            image_size = self.settings.image_size
+            if image_size is not None:
+                settings = settings.with_image_size(image_size)
+            self.settings = settings
+
+    def get_frame_settings(self, image: PILImage) -> CameraSettings:
+        """
+        Returns current settings snapshot with ROIs pixel boxes precomputed
+        for the camera image size.
+        """
+        with self._settings_lock:
+            if self.settings.image_size != image.size:
+                self.settings = self.settings.with_image_size(image.size)
+            return self.settings
+
+    def reload_camera_client(self) -> Tuple[Optional[PILImage], str]:
+        """
+        Create new camera client and try to get camera image
+
+        Returns:
+            camera image or None if not possible and status message
+        """
+        self.camera_client = get_camera_client(
+            user=self.settings.user,
+            password=self.settings.password,
+            url=self.settings.url,
+            timeout=self.settings.timeout,
+        )
+        return self.camera_client.get_snapshot()
+
+    def load_classifier(self):
+        model_path = Config.MODELS_DIR / self.settings.model_name
+        self.predictor = None
+        if self.settings.model_name and model_path.exists():
+            try:
+                self.predictor = TFClassifierPredictor.load(model_path)
+            except Exception as e:
+                self.error(f"Cannot load classifier: {e}")
+        else:
+            self.error(f"Cannot find model at path: {model_path}")
+
+    def can_run_predictions(self) -> bool:
+        self.load_classifier()
+        if self.predictor is None:
+            return False
+
+        if self.camera_client is None:
+            self.error("Camera client not loaded! Click 'Check Camera' button.")
+            return False
+        return True
+
+    def predict(
+        self, image: PILImage, rois: Optional[List[ROISettings]] = None
+    ) -> Tuple[List[ROISettings], List[ClassificationOutput], float]:
+
+        start = time.time()
+        crops = []
+        if rois is None:
+            rois = self.settings.enabled_rois
+
+        for roi in rois:
+            crops.append(roi.crop(image))
+
+        if len(rois) == 0:
+            return [], [], 0.0
+
+        predictions = self.predictor.predict(images=crops)
+        dt = time.time() - start
+        PREDICT_SECONDS.observe(dt)
+        return rois, predictions, dt
+
+    @staticmethod
+    def format_predictions(
+        rois: List[ROISettings],
+        predictions: List[ClassificationOutput],
+        timedelta: float,
+    ) -> str:
+        predictions = [f"{r.name}: [{p}]" for r, p in zip(rois, predictions)]
+        return f"Predicted in {timedelta:.2f} seconds: {predictions}"
+
+    def start(self, blocking: bool = False) -> bool:
+        if not self.can_run_predictions():
+            return False
+
+        if self.is_running:
+            self.warning("Already running!")
+            return False
+
+        self.is_running = True
+        if blocking:
+            self.run()
+        else:
+            self._thread = threading.Thread(target=self.run)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self.info("Monitoring stopped!")
+        self.is_running = False
+
+    def run(self):
+        scheduler = DeadlineScheduler(period=self.settings.check_period)
+        prev_image: Optional[PILImage] = None
+        scheduler.start()
+        while self.is_running:
+            settings = self.settings
+            # check period can be changed in the settings while running
+            scheduler.set_period(settings.check_period)
+            self.end_events_sequence(
+                EVENTS_SEQUENCES.close_if_finished(
+                    datetime.now(), settings.max_sequence_length
+                )
+            )
+
+            if not settings.schedule.is_date_in_schedule():
+                self.set_state(MONITORING_SLEEPING)
+                scheduler.wait()
+                continue
+
+            self.set_state(MONITORING_RUNNING)
+            with TRACER.span("get_frame", camera=settings.camera_name):
+                frame, msg = self.camera_client.get_async_frame()
+
+            if frame is None:
+                self.warning(
+                    f"Image not found. Waiting for {scheduler.period} seconds."
+                )
+                scheduler.wait()
+                continue
+
+            if scheduler.is_frame_stale(frame.frame_id, frame.timestamp):
+                scheduler.wait()
+                continue
+
+            FRAMES_COUNTER.inc()
+            self.frames_recorder.add_frame(frame)
+            current_image = frame.image
+            settings = self.get_frame_settings(current_image)
+            tags = {"frame_id": frame.frame_id, "camera": settings.camera_name}
+            rois_to_check = []
+            rois_change_value = []
+            if prev_image is not None:
+                with MOTION_SECONDS.time():
+                    for roi in settings.enabled_rois:
+                        with TRACER.span(
+                            "compute_roi_image_change", roi=roi.name, **tags
+                        ):
+                            change = roi.compute_roi_image_change(
+                                prev_image, current_image
+                            )
+                        if change > MEAN_CHANGE_THRESHOLD:
+                            rois_to_check.append(roi)
+                            rois_change_value.append(change)
+            else:
+                rois_to_check = list(settings.enabled_rois)
+            prev_image = current_image.copy()
+            if len(rois_to_check) == 0:
+                self.info(f"Image not changed ({scheduler.format_stats()}).")
+                with TRACER.span("emit_frame", **tags):
+                    self.emit_frame(current_image)
+                scheduler.wait()
+                continue
+
+            info = [
+                f"{r.name} Δ={int(100*v)}%"
+                for r, v in zip(rois_to_check, rois_change_value)
+            ]
+            info = ", ".join(info)
+            self.info(f"Image changed in ROIs ({info}), doing predictions.")
+
+            with TRACER.span("predict", rois=[r.name for r in rois_to_check], **tags):
+                rois, predictions, delta = self.predict(
+                    image=current_image, rois=rois_to_check
+                )
+
+            self.info(self.format_predictions(rois, predictions, delta))
+            events = []
+            for roi, roi_pred, im_delta in zip(rois, predictions, rois_change_value):
+                event = self.create_snapshot_event(
+                    roi=roi, predictions=roi_pred, image_change=im_delta
+                )
+                if event is not None:
+                    EVENTS_COUNTER.inc(roi=roi.name)
+                    events.append(event)
+            if len(events) > 0:
+                # use capture time, async snapshot is one frame behind, only
+                # frames with events not filtered out extend the sequence
+                self.end_events_sequence(
+                    EVENTS_SEQUENCES.close_if_finished(
+                        frame.date, settings.max_sequence_length
+                    )
+                )
+                sequence_id, sequence_start = EVENTS_SEQUENCES.add_frame(
+                    frame.date, settings.max_sequence_length
+                )
+                if sequence_start:
+                    # save pre-event frames, next frames are saved directly
+                    self.frames_recorder.start_sequence(frame.date)
+                # frame is encoded and saved once for all ROIs in background
+                with TRACER.span("submit_snapshot", **tags):
+                    SNAPSHOT_WRITER.submit(
+                        frame,
+                        events,
+                        sequence_dir=self.frames_recorder.sequence_dir,
+                        sequence_id=sequence_id,
+                        sequence_start=sequence_start,
+                    )
+            with TRACER.span("emit_frame", **tags):
+                self.emit_frame(current_image)
+
+            lateness = scheduler.wait()
+            if lateness > 0:
+                LATENESS_COUNTER.inc()
+                self.warning(
+                    f"Iteration overran by {lateness:.2f} seconds "
+                    f"({scheduler.format_stats()}, "
+                    f"writer: {SNAPSHOT_WRITER.format_stats()})."
+                )
+        self.end_events_sequence(EVENTS_SEQUENCES.close())
+        self.frames_recorder.stop_sequence()
+        SNAPSHOT_WRITER.flush()
+        EVENTS_LOG.sync()
+        self.set_state(MONITORING_STOPPED)
+
+    def create_snapshot_event(
+        self,
+        roi: ROISettings,
+        predictions: ClassificationOutput,
+        image_change: float,
+    ) -> Optional[SnapshotEvent]:
+
+        if predictions.is_empty():
+            return None
+
+        labels = roi.filter_labels(predictions.labels)
+        if len(labels) == 0:
+            return None
+
+        return SnapshotEvent(
+            labels=labels,
+            labels_filter=roi.labels_filter,
+            roi_name=roi.name,
+            camera_name=self.settings.camera_name,
+            image_change=image_change,
+        )
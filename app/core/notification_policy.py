@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import PIL.Image
+from dataclasses import dataclass
+
+from config.config import Config
+from core.history import EventsSequence
+from core.image_utils import PILImage, create_montage
+
+logger = logging.getLogger("clever-camera")
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period: float):
+        """
+        Rate limiter which allows bursts of up to capacity messages and on
+        average one message per period.
+
+        Args:
+            capacity: maximum number of tokens
+            period: seconds to refill a single token
+        """
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.last_update = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.last_update)
+        if self.period > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed / self.period)
+        else:
+            self.tokens = float(self.capacity)
+        self.last_update = now
+
+    def has_token(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= 1.0
+
+    def take(self, now: float) -> bool:
+        """Returns True if token was taken"""
+        if not self.has_token(now):
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+@dataclass(frozen=True)
+class DigestEntry:
+    """Sequence suppressed by the rate limits, sent later in the digest"""
+
+    sequence_id: int
+    start_date: datetime
+    end_date: datetime
+    labels: List[str]
+    num_events: int
+    # None if thumbnails have been removed or digest is already full
+    montage: Optional[PILImage]
+
+
+def create_sequence_montage(
+    sequence: EventsSequence, max_images: int = Config.NOTIFICATIONS_MONTAGE_IMAGES
+) -> Optional[PILImage]:
+    """Returns grid of the sequence thumbnails sampled uniformly in time"""
+    paths = list(dict.fromkeys(r["thumbnail_path"] for r in sequence.records))
+    if len(paths) > max_images:
+        step = len(paths) / max_images
+        paths = [paths[int(i * step)] for i in range(max_images)]
+
+    images = []
+    for path in paths:
+        try:
+            with PIL.Image.open(path) as image:
+                images.append(image.convert("RGB"))
+        except OSError:
+            continue
+    if len(images) == 0:
+        return None
+    return create_montage(images, Config.MINI_THUMBNAIL_SIZE, num_columns=3)
+
+
+DigestHandler = Callable[[str, List[DigestEntry]], None]
+
+
+class NotificationPolicy:
+    def __init__(
+        self,
+        burst: int = Config.NOTIFICATIONS_BURST,
+        label_burst: int = Config.NOTIFICATIONS_LABEL_BURST,
+        label_period: float = Config.NOTIFICATIONS_LABEL_PERIOD,
+        digest_period: float = Config.NOTIFICATIONS_DIGEST_PERIOD,
+    ):
+        """
+        Decides which events sequences are notified immediately. Every
+        channel (e.g. email) and every label of the channel has its own
+        token bucket, sequence is sent when the channel has a token and at
+        least one of its labels has a token, only the first available label
+        token is taken. Other sequences are collected and sent periodically
+        as a single digest message of the channel.
+
+        Args:
+            burst: number of messages sent at once by a channel
+            label_burst: number of messages sent at once about a label
+            label_period: seconds to refill a single label token
+            digest_period: seconds between digest messages
+        """
+        self.burst = burst
+        self.label_burst = label_burst
+        self.label_period = label_period
+        self.digest_period = digest_period
+        self.lock = threading.Lock()
+        self.channel_buckets: Dict[str, TokenBucket] = {}
+        self.label_buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self.digest_handlers: Dict[str, DigestHandler] = {}
+        self.digests: Dict[str, List[DigestEntry]] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self.num_sequences: Counter = Counter()
+        self.num_sent: Counter = Counter()
+        self.num_suppressed: Counter = Counter()
+        self.num_digests: Counter = Counter()
+        # channel -> number of suppressed sequences per label
+        self.suppressed_labels: Dict[str, Counter] = {}
+
+    def add_channel(
+        self, channel: str, period: float, digest_handler: DigestHandler
+    ) -> None:
+        """
+        Register channel or update its rate.
+
+        Args:
+            channel: channel name
+            period: seconds to refill a single channel token
+            digest_handler: called from the timer thread with the channel
+                name and suppressed sequences
+        """
+        with self.lock:
+            self.digest_handlers[channel] = digest_handler
+            bucket = self.channel_buckets.get(channel)
+            if bucket is None:
+                self.channel_buckets[channel] = TokenBucket(self.burst, period)
+            else:
+                bucket.refill(time.monotonic())
+                bucket.period = period
+
+    def get_label_bucket(self, channel: str, label: str) -> TokenBucket:
+        buckets = self.label_buckets.setdefault(channel, {})
+        if label not in buckets:
+            buckets[label] = TokenBucket(self.label_burst, self.label_period)
+        return buckets[label]
+
+    def allow(self, channel: str, sequence: EventsSequence) -> bool:
+        """
+        Check if the sequence is notified now, otherwise it is added to the
+        channel digest.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.num_sequences[channel] += 1
+            channel_bucket = self.channel_buckets[channel]
+            is_allowed = False
+            if channel_bucket.has_token(now):
+                # tokens of the other labels are kept for the next sequences
+                is_allowed = any(
+                    self.get_label_bucket(channel, label).take(now)
+                    for label in sequence.labels
+                )
+            if is_allowed:
+                channel_bucket.take(now)
+                self.num_sent[channel] += 1
+                return True
+
+            self.num_suppressed[channel] += 1
+            self.suppressed_labels.setdefault(channel, Counter()).update(
+                sequence.labels
+            )
+        self.add_to_digest(channel, sequence)
+        return False
+
+    def add_to_digest(self, channel: str, sequence: EventsSequence) -> None:
+        with self.lock:
+            num_entries = len(self.digests.get(channel, []))
+        # montage is rendered now, thumbnails can be removed before digest,
+        # under events storm only the first sequences get montages
+        montage = None
+        if num_entries < Config.NOTIFICATIONS_DIGEST_MAX_SEQUENCES:
+            montage = create_sequence_montage(sequence)
+        entry = DigestEntry(
+            sequence_id=sequence.sequence_id,
+            start_date=sequence.start_date,
+            end_date=sequence.end_date,
+            labels=list(sequence.labels),
+            num_events=len(sequence.records),
+            montage=montage,
+        )
+        with self.lock:
+            self.digests.setdefault(channel, []).append(entry)
+            if channel not in self._timers:
+                timer = threading.Timer(
+                    self.digest_period, self.send_digest, args=(channel,)
+                )
+                timer.daemon = True
+                self._timers[channel] = timer
+                timer.start()
+
+    def send_digest(self, channel: str) -> None:
+        with self.lock:
+            self._timers.pop(channel, None)
+            entries = self.digests.pop(channel, [])
+            handler = self.digest_handlers.get(channel)
+            if len(entries) == 0 or handler is None:
+                return
+            self.num_digests[channel] += 1
+        try:
+            handler(channel, entries)
+        except Exception:
+            logger.exception(f"Cannot send {channel} notifications digest")
+
+    def format_stats(self) -> str:
+        with self.lock:
+            stats = []
+            for channel in sorted(self.channel_buckets):
+                pending = len(self.digests.get(channel, []))
+                channel_stats = (
+                    f"{channel}: sequences={self.num_sequences[channel]}, "
+                    f"sent={self.num_sent[channel]}, "
+                    f"suppressed={self.num_suppressed[channel]}, "
+                    f"digests={self.num_digests[channel]} ({pending} pending)"
+                )
+                suppressed_labels = self.suppressed_labels.get(channel, Counter())
+                top_labels = ", ".join(
+                    f"{label}={count}"
+                    for label, count in suppressed_labels.most_common(3)
+                )
+                if top_labels:
+                    channel_stats += f", most suppressed: {top_labels}"
+                stats.append(channel_stats)
+        if len(stats) == 0:
+            return "no channels"
+        return "; ".join(stats)
+
+
+NOTIFICATION_POLICY = NotificationPolicy()
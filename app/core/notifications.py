@@ -0,0 +1,293 @@
+import logging
+import smtplib
+import time
+from email.message import EmailMessage
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import PIL.Image
+from dataclasses import dataclass, replace
+
+from config.config import Config
+from core.durable_queue import NOTIFICATIONS_QUEUE, DurableQueue, get_message_id
+
+logger = logging.getLogger("clever-camera")
+
+# JPEG qualities tried when attachment exceeds its size budget
+ATTACHMENT_QUALITIES = (85, 75, 65, 50, 35)
+
+
+@dataclass(frozen=True)
+class SmtpSettings:
+    user: str
+    password: str
+    receiver: str
+    host: str = Config.SMTP_HOST
+    port: int = Config.SMTP_PORT
+    use_ssl: bool = Config.SMTP_USE_SSL
+
+
+@dataclass(frozen=True)
+class NotificationMessage:
+    message_id: str
+    subject: str
+    contents: Tuple[str, ...]
+    # camera images, replaced by the downscaled copies in the queue folder
+    # before the first attempt
+    attachments: Tuple[str, ...]
+    # epoch time when message was submitted
+    created: float
+    is_prepared: bool = False
+    num_attempts: int = 0
+    # epoch time of the next sending attempt
+    next_attempt: float = 0.0
+
+    @property
+    def item_id(self) -> str:
+        return self.message_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "message_id": self.message_id,
+            "subject": self.subject,
+            "contents": list(self.contents),
+            "attachments": list(self.attachments),
+            "created": self.created,
+            "is_prepared": self.is_prepared,
+            "num_attempts": self.num_attempts,
+            "next_attempt": self.next_attempt,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NotificationMessage":
+        return cls(
+            message_id=data["message_id"],
+            subject=data["subject"],
+            contents=tuple(data["contents"]),
+            attachments=tuple(data["attachments"]),
+            created=data["created"],
+            is_prepared=data.get("is_prepared", False),
+            num_attempts=data.get("num_attempts", 0),
+            next_attempt=data.get("next_attempt", 0.0),
+        )
+
+
+def encode_attachment(
+    image: PIL.Image.Image, max_size: Tuple[int, int], max_bytes: int
+) -> bytes:
+    """
+    Downscale image to max_size and recompress it with decreasing JPEG
+    quality until it fits max_bytes. Image is downscaled further if the
+    lowest quality is still too large.
+    """
+    image = image.convert("RGB")
+    image.thumbnail(max_size)
+    while True:
+        for quality in ATTACHMENT_QUALITIES:
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        width, height = image.size
+        if width <= 64 or height <= 64:
+            return buffer.getvalue()
+        image = image.resize((width * 3 // 4, height * 3 // 4), PIL.Image.BILINEAR)
+
+
+class NotificationDispatcher(DurableQueue):
+    channel = "email"
+    item_class = NotificationMessage
+
+    def __init__(
+        self,
+        queue_dir: Path = Config.NOTIFICATIONS_QUEUE_DIR,
+        max_attempts: int = Config.NOTIFICATIONS_MAX_ATTEMPTS,
+        retry_delay: float = Config.NOTIFICATIONS_RETRY_DELAY,
+        idle_timeout: float = Config.SMTP_IDLE_TIMEOUT,
+    ):
+        """
+        Sends email notifications in the background thread. Messages are
+        saved in the queue folder until they are sent, so they survive
+        restarts and are retried with exponential backoff when sending
+        fails. SMTP connection is reused between messages.
+
+        Args:
+            queue_dir: folder with pending messages and their attachments
+            max_attempts: message is dropped after this number of failures
+            retry_delay: delay after the first failure, doubled with every
+                next failure
+            idle_timeout: seconds after which unused connection is closed
+        """
+        super().__init__(
+            queue_dir, max_attempts, retry_delay, idle_timeout=idle_timeout
+        )
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_settings: Optional[SmtpSettings] = None
+        self._last_used = 0.0
+        self.num_connections = 0
+
+    def submit(
+        self, subject: str, contents: List[str], attachments: List[str]
+    ) -> NotificationMessage:
+        """
+        Save message in the queue, it is sent by the background thread.
+        Attachments are downscaled just before the first attempt.
+        """
+        created = time.time()
+        message = NotificationMessage(
+            message_id=get_message_id(created),
+            subject=subject,
+            contents=tuple(contents),
+            attachments=tuple(str(path) for path in attachments),
+            created=created,
+        )
+        self.put(message)
+        return message
+
+    def submit_images(
+        self, subject: str, contents: List[str], images: List[PIL.Image.Image]
+    ) -> NotificationMessage:
+        """Save message with images rendered in memory e.g. digest montages"""
+        created = time.time()
+        message_id = get_message_id(created)
+        max_bytes = Config.NOTIFICATIONS_ATTACHMENTS_MAX_BYTES // max(1, len(images))
+        self.queue_dir.mkdir(exist_ok=True, parents=True)
+        attachments = []
+        for i, image in enumerate(images):
+            path = self.queue_dir / f"{message_id}-{i}.jpg"
+            path.write_bytes(
+                encode_attachment(
+                    image, Config.NOTIFICATIONS_ATTACHMENT_SIZE, max_bytes
+                )
+            )
+            attachments.append(str(path))
+        message = NotificationMessage(
+            message_id=message_id,
+            subject=subject,
+            contents=tuple(contents),
+            attachments=tuple(attachments),
+            created=created,
+            is_prepared=True,
+        )
+        self.put(message)
+        return message
+
+    def remove(self, message: NotificationMessage) -> None:
+        super().remove(message)
+        if not message.is_prepared:
+            return
+        for path in message.attachments:
+            try:
+                Path(path).unlink()
+            except FileNotFoundError:
+                pass
+
+    def prepare(self, message: NotificationMessage) -> NotificationMessage:
+        """Replace attachments with downscaled copies saved in the queue"""
+        attachments = []
+        max_bytes = Config.NOTIFICATIONS_ATTACHMENTS_MAX_BYTES // max(
+            1, len(message.attachments)
+        )
+        for i, source in enumerate(message.attachments):
+            try:
+                with PIL.Image.open(source) as image:
+                    data = encode_attachment(
+                        image, Config.NOTIFICATIONS_ATTACHMENT_SIZE, max_bytes
+                    )
+            except OSError:
+                # image removed by the snapshots cleanup
+                logger.warning(f"Skipping missing attachment: {source}")
+                continue
+            path = self.queue_dir / f"{message.message_id}-{i}.jpg"
+            path.write_bytes(data)
+            attachments.append(str(path))
+        message = replace(message, attachments=tuple(attachments), is_prepared=True)
+        self.save(message)
+        return message
+
+    def process(self, batch: List[NotificationMessage], settings: SmtpSettings) -> None:
+        try:
+            batch = [m if m.is_prepared else self.prepare(m) for m in batch]
+        except Exception as e:
+            logger.warning(f"Cannot prepare notification attachments: {e}")
+            self.on_failure(batch, str(e))
+            return
+        super().process(batch, settings)
+
+    def build_email(
+        self, message: NotificationMessage, settings: SmtpSettings
+    ) -> EmailMessage:
+        email = EmailMessage()
+        email["Subject"] = message.subject
+        email["From"] = settings.user
+        email["To"] = settings.receiver
+        email.set_content("\n\n".join(message.contents))
+        for path in message.attachments:
+            path = Path(path)
+            email.add_attachment(
+                path.read_bytes(), maintype="image", subtype="jpeg", filename=path.name
+            )
+        return email
+
+    def connect(self, settings: SmtpSettings) -> smtplib.SMTP:
+        """Returns open SMTP connection, reused if settings did not change"""
+        if self._smtp is not None and self._smtp_settings != settings:
+            self.close_connection()
+        if self._smtp is None:
+            if settings.use_ssl:
+                smtp = smtplib.SMTP_SSL(
+                    settings.host, settings.port, timeout=Config.SMTP_TIMEOUT
+                )
+            else:
+                smtp = smtplib.SMTP(
+                    settings.host, settings.port, timeout=Config.SMTP_TIMEOUT
+                )
+                smtp.ehlo()
+                if smtp.has_extn("starttls"):
+                    smtp.starttls()
+                    smtp.ehlo()
+            if settings.password:
+                smtp.login(settings.user, settings.password)
+            self._smtp = smtp
+            self._smtp_settings = settings
+            self.num_connections += 1
+        return self._smtp
+
+    def send(self, batch: List[NotificationMessage], settings: SmtpSettings) -> None:
+        for message in batch:
+            email = self.build_email(message, settings)
+            try:
+                self.connect(settings).send_message(email)
+            except smtplib.SMTPServerDisconnected:
+                # server closed the kept-alive connection, reconnect once
+                self.close_connection()
+                self.connect(settings).send_message(email)
+            except Exception:
+                self.close_connection()
+                raise
+        self._last_used = time.monotonic()
+
+    def close_connection(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._smtp = None
+        self._smtp_settings = None
+
+    def on_idle(self) -> None:
+        self.close_idle_connection()
+
+    def close_idle_connection(self) -> None:
+        if time.monotonic() - self._last_used > self.idle_timeout:
+            self.close_connection()
+
+    def format_extra_stats(self) -> str:
+        return f"connections={self.num_connections}"
+
+
+NOTIFICATIONS = NotificationDispatcher()
+NOTIFICATIONS_QUEUE.set_function(lambda: NOTIFICATIONS.num_pending, channel="email")
@@ -0,0 +1,268 @@
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Set, Tuple, Union
+
+from dataclasses import dataclass
+
+from config.config import Config
+from core.blob_store import BLOB_STORE
+from core.camera_client import CameraFrame
+from core.history import SnapshotEvent, save_frame_events
+from core.metrics import METRICS
+from core.tracing import TRACER
+
+logger = logging.getLogger("clever-camera")
+
+WRITE_SECONDS = METRICS.histogram(
+    "history_write_seconds", "Snapshot encoding and history write time"
+)
+WRITE_LATENCY_SECONDS = METRICS.histogram(
+    "history_write_latency_seconds", "Time from frame submit to saved history"
+)
+WRITE_ERRORS = METRICS.counter("history_write_errors_total", "Failed history writes")
+WRITER_QUEUE = METRICS.gauge("history_writer_queue", "Frames waiting to be saved")
+
+
+@dataclass(frozen=True)
+class SnapshotJob:
+    frame: CameraFrame
+    events: Tuple[SnapshotEvent, ...]
+    sequence_dir: Optional[Path]
+    # assigned by EVENTS_SEQUENCES.add_frame
+    sequence_id: Optional[int]
+    sequence_start: bool
+    # monotonic time when job was submitted
+    submit_time: float
+
+
+@dataclass(frozen=True)
+class SequenceFramesJob:
+    # (file name, camera JPEG bytes) of the frames
+    frames: Tuple[Tuple[str, bytes], ...]
+    sequence_dir: Path
+    submit_time: float
+
+
+@dataclass(frozen=True)
+class CallbackJob:
+    """Called by the writer once all previously submitted jobs are done"""
+
+    callback: Callable[..., Any]
+    args: Tuple[Any, ...]
+
+
+WriterJob = Union[SnapshotJob, SequenceFramesJob, CallbackJob]
+
+
+class SnapshotWriter:
+    def __init__(
+        self,
+        num_workers: int = Config.SNAPSHOT_WRITER_THREADS,
+        max_queue_size: int = Config.SNAPSHOT_WRITER_QUEUE_SIZE,
+    ):
+        """
+        Saves events snapshots in the background threads, so the monitoring
+        loop does not wait for JPEG encoding and disk writes. Every frame is
+        submitted once with all events detected in its ROIs. Pre-event and
+        sequence frames are saved by the same threads.
+
+        Args:
+            num_workers: number of writer threads
+            max_queue_size: maximum number of frames waiting to be saved,
+                submit blocks when the queue is full
+        """
+        self.num_workers = num_workers
+        # jobs are numbered in the submission order
+        self.queue: "queue.Queue[Tuple[int, WriterJob]]" = queue.Queue(
+            max_queue_size
+        )
+        self.lock = threading.Lock()
+        self.put_lock = threading.Lock()
+        self.done_condition = threading.Condition(self.lock)
+        self._num_submitted = 0
+        # all jobs with id up to this number are done
+        self._num_done = 0
+        self._done_ids: Set[int] = set()
+        self.workers: List[threading.Thread] = []
+        self.num_written = 0
+        self.num_frames_written = 0
+        self.num_failed = 0
+        self.num_blocked = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    @property
+    def mean_latency(self) -> float:
+        with self.lock:
+            if self.num_written == 0:
+                return 0.0
+            return self.total_latency / self.num_written
+
+    def start(self) -> None:
+        with self.lock:
+            self.workers = [w for w in self.workers if w.is_alive()]
+            while len(self.workers) < self.num_workers:
+                worker = threading.Thread(target=self.run, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def submit(
+        self,
+        frame: CameraFrame,
+        events: List[SnapshotEvent],
+        sequence_dir: Optional[Path] = None,
+        sequence_id: Optional[int] = None,
+        sequence_start: bool = False,
+    ) -> None:
+        """Queue frame to be saved, blocks if the writer is behind"""
+        self.start()
+        job = SnapshotJob(
+            frame=frame,
+            events=tuple(events),
+            sequence_dir=sequence_dir,
+            sequence_id=sequence_id,
+            sequence_start=sequence_start,
+            submit_time=time.monotonic(),
+        )
+        self.put(job)
+
+    def submit_frames(
+        self, frames: List[Tuple[str, bytes]], sequence_dir: Path
+    ) -> None:
+        """
+        Queue camera frames to be saved in the sequence folder.
+
+        Args:
+            frames: (file name, camera JPEG bytes) of the frames
+            sequence_dir: events sequence folder, created if missing
+        """
+        if len(frames) == 0:
+            return
+        self.start()
+        job = SequenceFramesJob(
+            frames=tuple(frames),
+            sequence_dir=sequence_dir,
+            submit_time=time.monotonic(),
+        )
+        self.put(job)
+
+    def call_when_written(self, callback: Callable[..., Any], *args: Any) -> None:
+        """
+        Call callback(*args) in the writer thread after all jobs submitted so
+        far are saved, the caller does not wait for the writer.
+        """
+        self.start()
+        self.put(CallbackJob(callback=callback, args=args))
+
+    def put(self, job: WriterJob) -> None:
+        # ids must follow the queue order, callback waits for the lower ids
+        with self.put_lock:
+            with self.lock:
+                self._num_submitted += 1
+                item = (self._num_submitted, job)
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                with self.lock:
+                    self.num_blocked += 1
+                self.queue.put(item)
+
+    def flush(self) -> None:
+        """Wait until all submitted frames are saved"""
+        self.queue.join()
+
+    def run(self) -> None:
+        while True:
+            job_id, job = self.queue.get()
+            try:
+                if isinstance(job, CallbackJob):
+                    self.run_callback(job_id, job)
+                elif isinstance(job, SequenceFramesJob):
+                    self.write_frames(job)
+                else:
+                    self.write(job)
+            finally:
+                self.set_done(job_id)
+                self.queue.task_done()
+
+    def set_done(self, job_id: int) -> None:
+        with self.done_condition:
+            self._done_ids.add(job_id)
+            while self._num_done + 1 in self._done_ids:
+                self._num_done += 1
+                self._done_ids.remove(self._num_done)
+            self.done_condition.notify_all()
+
+    def run_callback(self, job_id: int, job: CallbackJob) -> None:
+        # with several workers the previous jobs can be still written
+        with self.done_condition:
+            self.done_condition.wait_for(lambda: self._num_done >= job_id - 1)
+        try:
+            job.callback(*job.args)
+        except Exception:
+            logger.exception("Writer callback failed")
+
+    def write(self, job: SnapshotJob) -> None:
+        start = time.monotonic()
+        try:
+            with TRACER.span("save_frame_events", frame_id=job.frame.frame_id):
+                save_frame_events(
+                    image=job.frame.image,
+                    events=list(job.events),
+                    event_date=job.frame.date,
+                    jpeg_bytes=job.frame.jpeg_bytes,
+                    sequence_dir=job.sequence_dir,
+                    sequence_id=job.sequence_id,
+                    sequence_start=job.sequence_start,
+                )
+        except Exception:
+            logger.exception("Cannot save events snapshot")
+            WRITE_ERRORS.inc()
+            with self.lock:
+                self.num_failed += 1
+            return
+
+        end = time.monotonic()
+        latency = end - job.submit_time
+        WRITE_SECONDS.observe(end - start)
+        WRITE_LATENCY_SECONDS.observe(latency)
+        with self.lock:
+            self.num_written += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def write_frames(self, job: SequenceFramesJob) -> None:
+        """Save frames to the blob store and link them into the sequence folder"""
+        try:
+            with TRACER.span("save_sequence_frames", num_frames=len(job.frames)):
+                job.sequence_dir.mkdir(exist_ok=True, parents=True)
+                for filename, jpeg_bytes in job.frames:
+                    blob_path = BLOB_STORE.put(jpeg_bytes)
+                    BLOB_STORE.link(blob_path, job.sequence_dir / filename)
+        except Exception:
+            logger.exception("Cannot save sequence frames")
+            WRITE_ERRORS.inc()
+            with self.lock:
+                self.num_failed += 1
+            return
+        with self.lock:
+            self.num_frames_written += len(job.frames)
+
+    def format_stats(self) -> str:
+        return (
+            f"queue={self.queue_depth}, written={self.num_written}, "
+            f"frames={self.num_frames_written}, "
+            f"failed={self.num_failed}, blocked={self.num_blocked}, "
+            f"latency={self.mean_latency:.2f}s (max {self.max_latency:.2f}s)"
+        )
+
+
+SNAPSHOT_WRITER = SnapshotWriter()
+WRITER_QUEUE.set_function(lambda: SNAPSHOT_WRITER.queue_depth)
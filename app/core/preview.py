@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import Counter
+from io import BytesIO
+from typing import Dict, Optional, Sequence, Tuple, Hashable
+
+import PIL.Image
+
+from config.config import Config
+from core.image_utils import PILImage, resize_to_preview
+from core.settings import ROISettings
+
+
+class PreviewRenderer:
+    def __init__(self, max_size: Tuple[int, int], max_fps: float):
+        """
+        Renders camera preview with ROIs drawn on top. ROIs are drawn once
+        to a transparent RGBA overlay which is reused until ROIs geometry or
+        preview size changes.
+
+        Args:
+            max_size: maximum size of the preview image
+            max_fps: maximum number of previews rendered per second by
+                the monitoring loop, see should_render method
+        """
+        self.max_size = max_size
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.last_render_time: Optional[float] = None
+        self._overlay: Optional[PILImage] = None
+        self._overlay_key: Optional[Hashable] = None
+
+    def should_render(self) -> bool:
+        """Check if enough time passed since the last rendered preview"""
+        if self.last_render_time is None:
+            return True
+        return time.monotonic() - self.last_render_time >= self.min_interval
+
+    def get_overlay(
+        self, size: Tuple[int, int], rois: Sequence[ROISettings]
+    ) -> PILImage:
+        key = (size, tuple((roi.name, roi.enabled, roi.box) for roi in rois))
+        if key != self._overlay_key:
+            overlay = PIL.Image.new("RGBA", size, (0, 0, 0, 0))
+            for roi in rois:
+                roi.draw_roi_on_image(overlay)
+            self._overlay = overlay
+            self._overlay_key = key
+        return self._overlay
+
+    def render(self, image: PILImage, rois: Sequence[ROISettings]) -> PILImage:
+        preview = resize_to_preview(image, self.max_size)
+        if preview.mode != "RGB":
+            preview = preview.convert("RGB")
+        if len(rois) > 0:
+            overlay = self.get_overlay(preview.size, rois)
+            preview.paste(overlay, (0, 0), overlay)
+        self.last_render_time = time.monotonic()
+        return preview
+
+
+class PreviewStream:
+    def __init__(
+        self,
+        tiers: Dict[str, Tuple[Tuple[int, int], int]] = Config.PREVIEW_TIERS,
+        max_frames: int = Config.PREVIEW_CACHE_FRAMES,
+    ):
+        """
+        Latest rendered previews shared by all live preview viewers. Every
+        preview is encoded lazily, at most once per resolution tier, when
+        the first viewer of the tier requests it. Viewers of the same tier
+        send the same bytes.
+
+        Args:
+            tiers: tier name -> (maximum size, JPEG quality)
+            max_frames: number of the most recent previews kept in the cache
+        """
+        self.tiers = tiers
+        self.max_frames = max_frames
+        self.condition = threading.Condition()
+        # serializes encoding, so concurrent viewers do not encode twice
+        self.encode_lock = threading.Lock()
+        self.frame_id = 0
+        self.frames: Dict[int, PILImage] = {}
+        # (frame id, tier, quality) -> JPEG bytes
+        self.cache: Dict[Tuple[int, str, int], bytes] = {}
+        self.viewers: Counter = Counter()
+        self.num_encoded = 0
+        self.num_cache_hits = 0
+        self.is_closed = False
+
+    @property
+    def num_viewers(self) -> int:
+        return sum(self.viewers.values())
+
+    def publish(self, image: PILImage) -> None:
+        with self.condition:
+            self.frame_id += 1
+            self.frames[self.frame_id] = image
+            # evict old frames together with their encoded tiers
+            min_frame_id = self.frame_id - self.max_frames + 1
+            self.frames = {k: v for k, v in self.frames.items() if k >= min_frame_id}
+            self.cache = {k: v for k, v in self.cache.items() if k[0] >= min_frame_id}
+            self.condition.notify_all()
+
+    def wait_frame(self, last_frame_id: int, timeout: float) -> Optional[int]:
+        """
+        Wait for the frame newer than last_frame_id.
+
+        Returns:
+            frame id or None if there is no new frame after timeout or the
+            stream was closed
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.frame_id != last_frame_id or self.is_closed, timeout
+            )
+            if self.frame_id == last_frame_id or self.is_closed:
+                return None
+            if self.frame_id not in self.frames:
+                return None
+            return self.frame_id
+
+    def get_jpeg(self, frame_id: int, tier: str) -> Optional[bytes]:
+        """
+        Returns preview encoded for the resolution tier or None if frame was
+        already evicted.
+        """
+        size, quality = self.tiers[tier]
+        key = (frame_id, tier, quality)
+        with self.encode_lock:
+            with self.condition:
+                jpeg_bytes = self.cache.get(key)
+                image = self.frames.get(frame_id)
+            if jpeg_bytes is not None:
+                self.num_cache_hits += 1
+                return jpeg_bytes
+            if image is None:
+                return None
+
+            if image.width > size[0] or image.height > size[1]:
+                image = image.copy()
+                image.thumbnail(size)
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=quality)
+            jpeg_bytes = buffer.getvalue()
+            self.num_encoded += 1
+            with self.condition:
+                if frame_id in self.frames:
+                    self.cache[key] = jpeg_bytes
+        return jpeg_bytes
+
+    def add_viewer(self, tier: str) -> None:
+        with self.condition:
+            self.viewers[tier] += 1
+
+    def remove_viewer(self, tier: str) -> None:
+        with self.condition:
+            self.viewers[tier] -= 1
+
+    def close(self) -> None:
+        """Finish all streams e.g. when the server is stopped"""
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+
+    def format_stats(self) -> str:
+        viewers = ", ".join(
+            f"{tier}={count}" for tier, count in self.viewers.items() if count > 0
+        )
+        return (
+            f"viewers: {viewers or 'none'}, frames={self.frame_id}, "
+            f"encoded={self.num_encoded}, cache hits={self.num_cache_hits}"
+        )
+
+
+PREVIEW_STREAM = PreviewStream()
@@ -1,11 +1,24 @@
 import threading
 from datetime import datetime
+from typing import Any, Dict
+
 import psutil
 import remi.gui as gui
 import core.widgets as wg
+from config.config import Config
+from core.metrics import METRICS
+from core.notification_policy import NOTIFICATION_POLICY
+from core.notifications import NOTIFICATIONS
+from core.persistence import SNAPSHOT_WRITER
+from core.preview import PREVIEW_STREAM
+from core.retention import RETENTION_MANAGER
+from core.routes import TRACE_URL
+from core.tracing import TRACER
+from core.ui_updates import UI_UPDATES
+from core.webhooks import WEBHOOKS
 
 LABEL_WIDTH = "15%"
-UPDATE_FREQUENCY_SEC = 30
+UPDATE_FREQUENCY_SEC = 10
 
 
 class SystemResourcesWidget(gui.VBox):
@@ -14,12 +27,28 @@ class SystemResourcesWidget(gui.VBox):
 
         self.last_update = datetime.now()
         self.refresh_btn = wg.SButton("Refresh", "fa-sync-alt", "btn-primary")
+        self.tracing_btn = wg.ToggleButton("Tracing")
+        self.tracing_btn.set_checked(TRACER.enabled)
+        self.download_trace_btn = wg.SButton("Download trace", "fa-download")
 
         self.others = wg.SettingsWidget("Other parameters", LABEL_WIDTH)
         self.others.add_text_field(f"boot_time", f"Boot time")
+        self.others.add_text_field(f"snapshot_writer", f"Snapshot writer")
+        self.others.add_text_field(f"retention", f"Snapshots cleanup")
+        self.others.add_text_field(f"notifications", f"Notifications")
+        self.others.add_text_field(f"webhooks", f"Webhook notifications")
+        self.others.add_text_field(f"notification_policy", f"Notifications limits")
+        self.others.add_text_field(f"preview_stream", f"Live preview")
+        self.others.add_text_field(f"ui_updates", f"UI updates")
+        self.others.add_text_field(f"tracing", f"Tracing")
         self.append(self.others)
         self.append(self.others.settings)
 
+        self.metrics = wg.SettingsWidget("Application metrics", LABEL_WIDTH)
+        self.add_metrics_fields()
+        self.append(self.metrics)
+        self.append(self.metrics.settings)
+
         self.cpu_usage = wg.SettingsWidget("CPU usage", LABEL_WIDTH)
         for cpu in range(psutil.cpu_count()):
             self.cpu_usage.add_progress_bar(f"cpu-{cpu}", f"CPU-{cpu+1}")
@@ -35,22 +64,68 @@ class SystemResourcesWidget(gui.VBox):
         self.disk_usage.add_progress_bar(f"disk", f"Disk usage [%]")
         self.append(self.disk_usage)
         self.append(self.disk_usage.settings)
-        self.append(self.refresh_btn)
+        buttons = gui.HBox()
+        buttons.append(self.refresh_btn)
+        buttons.append(self.tracing_btn)
+        buttons.append(self.download_trace_btn)
+        self.append(buttons)
 
         self.refresh_btn.onclick.do(self.update_thread_fn)
+        self.tracing_btn.on_toggled.do(self.on_tracing_toggled)
+        self.download_trace_btn.onclick.do(self.download_trace)
+        # first call starts the measurement, the next ones return usage since
+        # the previous call without blocking
+        psutil.cpu_percent(interval=None, percpu=True)
 
     def update_thread_fn(self, emitter=None):
-        cpu_usage = psutil.cpu_percent(interval=1, percpu=True)
-        for cpu, usage in enumerate(cpu_usage):
-            self.cpu_usage[f"cpu-{cpu}"].set_value(usage)
-
-        self.ram_usage["ram"].set_value(psutil.virtual_memory().percent)
-        self.disk_usage["disk"].set_value(psutil.disk_usage("/").percent)
+        cpu_usage = psutil.cpu_percent(interval=None, percpu=True)
+        values = {f"cpu-{cpu}": usage for cpu, usage in enumerate(cpu_usage)}
+        values["ram"] = psutil.virtual_memory().percent
+        values["disk"] = psutil.disk_usage("/").percent
         secs = psutil.boot_time()
         boot_date = datetime.fromtimestamp(secs)
         dt = datetime.now() - boot_date
         boot_time = boot_date.strftime("%Y-%m-%d %H:%M:%S")
-        self.others["boot_time"].set_value(f"{boot_time} (since {dt.days} days)")
+        values["boot_time"] = f"{boot_time} (since {dt.days} days)"
+        values["snapshot_writer"] = SNAPSHOT_WRITER.format_stats()
+        values["retention"] = RETENTION_MANAGER.format_stats()
+        values["notifications"] = NOTIFICATIONS.format_stats()
+        values["webhooks"] = WEBHOOKS.format_stats()
+        values["notification_policy"] = NOTIFICATION_POLICY.format_stats()
+        values["preview_stream"] = PREVIEW_STREAM.format_stats()
+        values["ui_updates"] = UI_UPDATES.format_stats()
+        values["tracing"] = TRACER.format_stats()
+        for metric in METRICS.list_metrics():
+            values[metric.name] = metric.format_summary() or "-"
+        UI_UPDATES.post(self, "values", self.set_values, values)
+
+    def add_metrics_fields(self) -> None:
+        """Add fields of the metrics registered since the last refresh"""
+        for metric in METRICS.list_metrics():
+            if not self.metrics.settings.has_field(metric.name):
+                self.metrics.add_text_field(metric.name, metric.description)
+
+    def set_values(self, values: Dict[str, Any]) -> None:
+        self.add_metrics_fields()
+        widgets = [
+            self.others,
+            self.metrics,
+            self.cpu_usage,
+            self.ram_usage,
+            self.disk_usage,
+        ]
+        for widget in widgets:
+            for key, value in values.items():
+                if widget.settings.has_field(key):
+                    widget[key].set_value(value)
+
+    def on_tracing_toggled(self, emitter, is_toggled: bool) -> None:
+        TRACER.set_enabled(is_toggled)
+        self.update_thread_fn()
+
+    def download_trace(self, emitter=None) -> None:
+        """Save spans as JSON, it can be opened in chrome://tracing or Perfetto"""
+        Config.APP_INSTANCE.execute_javascript(f'window.location = "{TRACE_URL}"')
 
     def update(self):
         delta = datetime.now() - self.last_update
@@ -0,0 +1,272 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Tuple
+
+import psutil
+from dataclasses import dataclass
+
+from config.config import Config
+from core.blob_store import BLOB_STORE
+from core.day_summary import DAY_SUMMARIES
+from core.event_index import EVENTS_INDEX
+from core.history import get_day_folder, iter_day_events, list_days
+
+logger = logging.getLogger("clever-camera")
+
+# created in the day folder when its full resolution images were removed
+IMAGES_EVICTED_MARKER = ".images-evicted"
+# number of the last cleanup reports kept in memory
+MAX_REPORTS = 10
+
+
+@dataclass(frozen=True)
+class RetentionReport:
+    date: datetime
+    # snapshots folder size before the cleanup
+    usage_bytes: int
+    reclaimed_bytes: int
+    num_removed_files: int
+    # days with removed full resolution images
+    num_evicted_days: int
+    # days removed together with thumbnails and history records
+    num_removed_days: int
+
+    def format(self) -> str:
+        return (
+            f"{self.date:%Y-%m-%d %H:%M}: reclaimed "
+            f"{self.reclaimed_bytes / 2 ** 20:.1f} MB in "
+            f"{self.num_removed_files} files (images of "
+            f"{self.num_evicted_days} days, {self.num_removed_days} days "
+            f"removed), usage {self.usage_bytes / 2 ** 20:.1f} MB"
+        )
+
+
+def iter_files(folder: Path) -> Iterator[os.DirEntry]:
+    if not folder.is_dir():
+        return
+    for entry in os.scandir(folder):
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_files(Path(entry.path))
+        elif entry.is_file(follow_symlinks=False):
+            yield entry
+
+
+def measure_usage(folder: Path) -> int:
+    """Size of all files in the folder, hard linked files are counted once"""
+    inodes: Set[Tuple[int, int]] = set()
+    num_bytes = 0
+    for entry in iter_files(folder):
+        stat = entry.stat(follow_symlinks=False)
+        if (stat.st_dev, stat.st_ino) in inodes:
+            continue
+        inodes.add((stat.st_dev, stat.st_ino))
+        num_bytes += stat.st_size
+    return num_bytes
+
+
+class RetentionManager:
+    def __init__(
+        self,
+        max_bytes: Optional[int] = Config.RETENTION_MAX_BYTES,
+        max_days: Optional[int] = Config.RETENTION_MAX_DAYS,
+        thumbnails_max_days: Optional[int] = Config.RETENTION_THUMBNAILS_MAX_DAYS,
+        period: float = Config.RETENTION_PERIOD,
+    ):
+        """
+        Keeps snapshots folder within the disk budget. Full resolution
+        images (event images and sequence frames) of the oldest days are
+        removed first, thumbnails and history records are removed only when
+        images removal is not enough or when they exceed their own age
+        limit. Current day is never removed.
+
+        Args:
+            max_bytes: maximum size of the snapshots folder, None - no limit
+            max_days: full resolution images older than this number of days
+                are removed, None - no limit
+            thumbnails_max_days: days older than this are removed together
+                with thumbnails and history records, None - no limit
+            period: seconds between cleanups in the background thread
+        """
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        self.thumbnails_max_days = thumbnails_max_days
+        self.period = period
+        self.lock = threading.Lock()
+        self.reports: List[RetentionReport] = []
+        self.total_reclaimed_bytes = 0
+        self._thread: Optional[threading.Thread] = None
+        # counters of the currently running cleanup
+        self._reclaimed_bytes = 0
+        self._num_removed_files = 0
+
+    @property
+    def is_enabled(self) -> bool:
+        limits = [self.max_bytes, self.max_days, self.thumbnails_max_days]
+        return any(limit is not None for limit in limits)
+
+    @property
+    def last_report(self) -> Optional[RetentionReport]:
+        return self.reports[-1] if self.reports else None
+
+    def start(self) -> None:
+        """Run cleanup periodically in the background thread"""
+        if not self.is_enabled:
+            logger.info("Snapshots retention is disabled, no limits are set")
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self) -> None:
+        set_idle_io_priority()
+        while True:
+            try:
+                self.enforce()
+            except Exception:
+                logger.exception("Snapshots retention failed")
+            time.sleep(self.period)
+
+    def enforce(self) -> RetentionReport:
+        """Remove snapshots exceeding the budget, returns cleanup summary"""
+        with self.lock:
+            self._reclaimed_bytes = 0
+            self._num_removed_files = 0
+            usage = measure_usage(Config.SNAPSHOTS_DIR)
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            days = [day for day in list_days() if day < today]
+
+            num_evicted_days = 0
+            for day in days:
+                over_budget = self.is_over_budget(usage - self._reclaimed_bytes)
+                too_old = self.is_older_than(day, self.max_days)
+                if not (over_budget or too_old):
+                    break
+                if self.evict_day_images(day):
+                    num_evicted_days += 1
+
+            num_removed_days = 0
+            for day in days:
+                over_budget = self.is_over_budget(usage - self._reclaimed_bytes)
+                too_old = self.is_older_than(day, self.thumbnails_max_days)
+                if not (over_budget or too_old):
+                    break
+                self.remove_day(day)
+                num_removed_days += 1
+
+            report = RetentionReport(
+                date=datetime.now(),
+                usage_bytes=usage,
+                reclaimed_bytes=self._reclaimed_bytes,
+                num_removed_files=self._num_removed_files,
+                num_evicted_days=num_evicted_days,
+                num_removed_days=num_removed_days,
+            )
+            self.total_reclaimed_bytes += report.reclaimed_bytes
+            self.reports = self.reports[-MAX_REPORTS + 1 :] + [report]
+        if report.num_removed_files > 0:
+            logger.info(f"Snapshots retention: {report.format()}")
+        return report
+
+    def is_over_budget(self, usage: int) -> bool:
+        return self.max_bytes is not None and usage > self.max_bytes
+
+    @staticmethod
+    def is_older_than(day: datetime, max_days: Optional[int]) -> bool:
+        if max_days is None:
+            return False
+        return datetime.now() - day > timedelta(days=max_days + 1)
+
+    def remove_file(self, path: Path) -> None:
+        """Remove file and count its size if it was the last link to data"""
+        try:
+            stat = path.stat()
+            path.unlink()
+        except OSError:
+            return
+        self._num_removed_files += 1
+        if stat.st_nlink == 1:
+            self._reclaimed_bytes += stat.st_size
+        if self._num_removed_files % Config.RETENTION_BATCH_SIZE == 0:
+            # spread disk writes over time
+            time.sleep(Config.RETENTION_BATCH_PAUSE)
+
+    def evict_day_images(self, day: datetime) -> bool:
+        """
+        Remove full resolution images and sequence frames of the day.
+
+        Returns:
+            False if images have been already removed
+        """
+        folder = get_day_folder(day)
+        marker = folder / IMAGES_EVICTED_MARKER
+        if marker.exists():
+            return False
+
+        for record in iter_day_events(day):
+            self.remove_file(Path(record["image_path"]))
+        self.remove_sequence_frames(day)
+        # images saved before the blob store was introduced
+        for path in folder.glob("image-*.jpg"):
+            self.remove_file(path)
+        marker.touch()
+        return True
+
+    def remove_sequence_frames(self, day: datetime) -> None:
+        """
+        Remove sequence frames of the day together with their blobs, unless
+        the blob is still linked elsewhere or it is the image of the next
+        day event (sequence started before midnight).
+        """
+        next_day_images = {
+            record["image_path"] for record in iter_day_events(day + timedelta(days=1))
+        }
+        for path in get_day_folder(day).glob("sequence-*/*"):
+            blob_path = BLOB_STORE.find_blob(path)
+            self.remove_file(path)
+            if blob_path is None or str(blob_path) in next_day_images:
+                continue
+            try:
+                num_links = blob_path.stat().st_nlink
+            except OSError:
+                continue
+            if num_links == 1:
+                self.remove_file(blob_path)
+
+    def remove_day(self, day: datetime) -> None:
+        """Remove day thumbnails, events log and the day history records"""
+        for record in iter_day_events(day):
+            self.remove_file(Path(record["thumbnail_path"]))
+            self.remove_file(Path(record["image_path"]))
+        self.remove_sequence_frames(day)
+        folder = get_day_folder(day)
+        for path in list(iter_files(folder)):
+            self.remove_file(Path(path.path))
+        shutil.rmtree(folder, ignore_errors=True)
+        DAY_SUMMARIES.invalidate(folder)
+        EVENTS_INDEX.delete_before(day + timedelta(days=1))
+
+    def format_stats(self) -> str:
+        report = self.last_report
+        if report is None:
+            return "not run yet" if self.is_enabled else "disabled"
+        total = self.total_reclaimed_bytes / 2 ** 20
+        return f"{report.format()}, total reclaimed {total:.1f} MB"
+
+
+def set_idle_io_priority() -> None:
+    """Lower disk priority of the calling thread (Linux only)"""
+    try:
+        # "<pid>/task/<thread id>"
+        thread_id = int(os.readlink("/proc/thread-self").split("/")[-1])
+        psutil.Process(thread_id).ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (AttributeError, ValueError, psutil.Error, OSError):
+        pass
+
+
+RETENTION_MANAGER = RetentionManager()
@@ -0,0 +1,344 @@
+"""
+Plain HTTP routes served by the application next to the remi UI. Routes
+are matched by the path prefix in CleverCameraApp._process_all, after the
+user has been authenticated.
+"""
+import mimetypes
+import os
+import secrets
+import shutil
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit, parse_qs, urlencode
+
+from config.config import Config
+from core.event_index import EVENTS_INDEX, parse_event_date
+from core.history import get_image_filename
+from core.metrics import METRICS
+from core.preview import PREVIEW_STREAM
+from core.tracing import TRACER
+
+SNAPSHOTS_URL = "/snapshots/"
+DOWNLOADS_URL = "/downloads/"
+PREVIEW_STREAM_URL = "/preview/stream"
+METRICS_URL = "/metrics"
+TRACE_URL = "/trace.json"
+# boundary between JPEG frames of the preview stream
+PREVIEW_BOUNDARY = "preview-frame"
+# seconds without new preview after which the last frame is sent again to
+# check if the viewer is still connected
+PREVIEW_WAIT_TIMEOUT = 5.0
+# size of the chunks streamed to the client
+CHUNK_SIZE = 64 * 1024
+
+RouteHandler = Callable[[BaseHTTPRequestHandler, str, Dict[str, str]], None]
+ROUTES: Dict[str, RouteHandler] = {}
+
+
+def route(prefix: str) -> Callable[[RouteHandler], RouteHandler]:
+    """Register handler called for the requests starting with prefix"""
+
+    def register(handler: RouteHandler) -> RouteHandler:
+        ROUTES[prefix] = handler
+        return handler
+
+    return register
+
+
+def dispatch(request: BaseHTTPRequestHandler, url: str) -> bool:
+    """
+    Call handler of the registered route matching the url.
+
+    Returns:
+        False if url does not match any route
+    """
+    parts = urlsplit(url)
+    for prefix, handler in ROUTES.items():
+        if parts.path.startswith(prefix):
+            params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            handler(request, parts.path[len(prefix) :], params)
+            return True
+    return False
+
+
+def send_error(request: BaseHTTPRequestHandler, code: int) -> None:
+    request.send_response(code)
+    request.send_header("Content-Length", "0")
+    request.end_headers()
+
+
+def get_file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def send_file(
+    request: BaseHTTPRequestHandler,
+    path: Path,
+    max_age: int,
+    download_name: Optional[str] = None,
+) -> None:
+    """
+    Stream file to the client using sendfile. Files are served with ETag,
+    so the browser revalidates cached files without downloading them.
+    """
+    try:
+        file = path.open("rb")
+    except OSError:
+        send_error(request, 404)
+        return
+
+    with file:
+        stat = os.fstat(file.fileno())
+        etag = get_file_etag(stat)
+        if request.headers.get("If-None-Match") == etag:
+            request.send_response(304)
+            request.send_header("ETag", etag)
+            request.end_headers()
+            return
+
+        mimetype, _ = mimetypes.guess_type(path.name)
+        request.send_response(200)
+        request.send_header("Content-Type", mimetype or "application/octet-stream")
+        request.send_header("Content-Length", str(stat.st_size))
+        request.send_header("ETag", etag)
+        request.send_header("Cache-Control", f"private, max-age={max_age}")
+        if download_name is not None:
+            disposition = f'attachment; filename="{download_name}"'
+            request.send_header("Content-Disposition", disposition)
+        request.end_headers()
+        request.wfile.flush()
+        request.connection.sendfile(file)
+
+
+def resolve_snapshot_path(relative_path: str) -> Optional[Path]:
+    """Returns path to the file in the snapshots dir or None if outside it"""
+    snapshots_dir = Config.SNAPSHOTS_DIR.resolve()
+    path = (snapshots_dir / relative_path).resolve()
+    if snapshots_dir not in path.parents:
+        return None
+    return path
+
+
+def get_snapshot_url(path: str, download_name: Optional[str] = None) -> str:
+    """
+    Convert path of the file saved in the snapshots dir to its url. File is
+    downloaded as download_name if given.
+    """
+    relative_path = Path(path).resolve().relative_to(Config.SNAPSHOTS_DIR.resolve())
+    url = SNAPSHOTS_URL + quote(relative_path.as_posix())
+    if download_name is not None:
+        url += "?" + urlencode({"download": download_name})
+    return url
+
+
+@route(SNAPSHOTS_URL)
+def serve_snapshot(
+    request: BaseHTTPRequestHandler, relative_path: str, params: Dict[str, str]
+) -> None:
+    path = resolve_snapshot_path(relative_path)
+    if path is None:
+        send_error(request, 404)
+        return
+    download_name = params.get("download")
+    if download_name is not None:
+        download_name = Path(download_name).name.replace('"', "")
+    send_file(
+        request, path, Config.SNAPSHOTS_CACHE_MAX_AGE, download_name=download_name
+    )
+
+
+class DownloadsRegistry:
+    def __init__(self, max_age: float = Config.DOWNLOAD_LINK_MAX_AGE):
+        """
+        Keeps events selected for download under random tokens, so the
+        archive url does not depend on the widgets state.
+
+        Args:
+            max_age: seconds after which the download link expires
+        """
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.downloads: Dict[str, Tuple[float, List[int], str]] = {}
+
+    def register(self, event_ids: List[int], filename: str) -> str:
+        """Returns url of the ZIP archive with images of the given events"""
+        token = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self.lock:
+            self.downloads = {
+                key: download
+                for key, download in self.downloads.items()
+                if now - download[0] < self.max_age
+            }
+            self.downloads[token] = (now, list(event_ids), filename)
+        return DOWNLOADS_URL + token
+
+    def get(self, token: str) -> Optional[Tuple[List[int], str]]:
+        with self.lock:
+            download = self.downloads.get(token)
+        if download is None or time.monotonic() - download[0] > self.max_age:
+            return None
+        return download[1], download[2]
+
+
+DOWNLOADS = DownloadsRegistry()
+
+
+def stream_zip(
+    request: BaseHTTPRequestHandler, files: List[Tuple[Path, str]], filename: str
+) -> None:
+    """
+    Stream ZIP archive of the files to the client. Entries are not
+    compressed and written chunk by chunk, so memory usage does not depend
+    on the archive size.
+
+    Args:
+        request: request handler
+        files: (path, name in the archive) pairs
+        filename: archive file name
+    """
+    request.send_response(200)
+    request.send_header("Content-Type", "application/zip")
+    request.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+    # archive size is unknown, end of the response is marked by closing
+    # the connection
+    request.send_header("Connection", "close")
+    request.end_headers()
+    request.close_connection = True
+
+    with zipfile.ZipFile(request.wfile, "w", zipfile.ZIP_STORED) as archive:
+        for path, name in files:
+            try:
+                file = path.open("rb")
+            except OSError:
+                # image removed by the snapshots cleanup
+                continue
+            with file, archive.open(name, "w") as entry:
+                shutil.copyfileobj(file, entry, CHUNK_SIZE)
+
+
+@route(DOWNLOADS_URL)
+def serve_download(
+    request: BaseHTTPRequestHandler, token: str, params: Dict[str, str]
+) -> None:
+    download = DOWNLOADS.get(token)
+    if download is None:
+        send_error(request, 404)
+        return
+
+    event_ids, filename = download
+    files = {}
+    for record in EVENTS_INDEX.get_events(event_ids):
+        # ROIs detected on the same frame share the image
+        date = parse_event_date(record["datetime"])
+        files.setdefault(record["image_path"], get_image_filename(date))
+    files = [(Path(path), name) for path, name in files.items()]
+    stream_zip(request, files, filename)
+
+
+def get_preview_srcset(timestamp: float) -> str:
+    """
+    Preview stream url of every tier with its width, the browser selects
+    the tier from the displayed image size.
+
+    Args:
+        timestamp: makes urls unique, so the browser opens a new stream
+
+    Returns:
+        value of the <img> srcset attribute
+    """
+    return ", ".join(
+        f"{PREVIEW_STREAM_URL}?{urlencode({'tier': tier, 't': timestamp})} "
+        f"{size[0]}w"
+        for tier, (size, _) in PREVIEW_STREAM.tiers.items()
+    )
+
+
+@route(PREVIEW_STREAM_URL)
+def serve_preview_stream(
+    request: BaseHTTPRequestHandler, path: str, params: Dict[str, str]
+) -> None:
+    """
+    Stream camera previews of the requested tier as multipart/x-mixed-replace
+    MJPEG, the browser replaces the image with every received frame.
+    """
+    tier = params.get("tier", Config.PREVIEW_DEFAULT_TIER)
+    if tier not in PREVIEW_STREAM.tiers:
+        send_error(request, 404)
+        return
+
+    request.send_response(200)
+    request.send_header(
+        "Content-Type", f"multipart/x-mixed-replace; boundary={PREVIEW_BOUNDARY}"
+    )
+    request.send_header("Cache-Control", "no-store")
+    request.send_header("Connection", "close")
+    request.end_headers()
+    request.close_connection = True
+
+    PREVIEW_STREAM.add_viewer(tier)
+    try:
+        # send the latest preview immediately
+        frame_id = -1
+        # the last sent part, repeated as heartbeat when there is no new
+        # preview, so a disconnected viewer is detected by the failed write
+        part = b"\r\n"
+        while not PREVIEW_STREAM.is_closed:
+            new_frame_id = PREVIEW_STREAM.wait_frame(frame_id, PREVIEW_WAIT_TIMEOUT)
+            if new_frame_id is None:
+                if not PREVIEW_STREAM.is_closed:
+                    request.wfile.write(part)
+                    request.wfile.flush()
+                continue
+            frame_id = new_frame_id
+            jpeg_bytes = PREVIEW_STREAM.get_jpeg(frame_id, tier)
+            if jpeg_bytes is None:
+                # viewer is behind, frame already evicted
+                continue
+            header = (
+                f"--{PREVIEW_BOUNDARY}\r\n"
+                "Content-Type: image/jpeg\r\n"
+                f"Content-Length: {len(jpeg_bytes)}\r\n\r\n"
+            )
+            part = header.encode() + jpeg_bytes + b"\r\n"
+            request.wfile.write(part)
+            request.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        # viewer closed the page or switched the tab
+        pass
+    finally:
+        PREVIEW_STREAM.remove_viewer(tier)
+
+
+@route(METRICS_URL)
+def serve_metrics(
+    request: BaseHTTPRequestHandler, path: str, params: Dict[str, str]
+) -> None:
+    """Application metrics in the Prometheus text exposition format"""
+    data = METRICS.format_prometheus().encode()
+    request.send_response(200)
+    request.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    request.send_header("Content-Length", str(len(data)))
+    request.send_header("Cache-Control", "no-store")
+    request.end_headers()
+    request.wfile.write(data)
+
+
+@route(TRACE_URL)
+def serve_trace(
+    request: BaseHTTPRequestHandler, path: str, params: Dict[str, str]
+) -> None:
+    """Collected tracing spans as Chrome trace-event JSON file"""
+    data = TRACER.dumps().encode()
+    filename = f"clever-camera-trace-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    request.send_response(200)
+    request.send_header("Content-Type", "application/json")
+    request.send_header("Content-Length", str(len(data)))
+    request.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+    request.send_header("Cache-Control", "no-store")
+    request.end_headers()
+    request.wfile.write(data)
@@ -0,0 +1,139 @@
+import time
+from collections import deque
+from typing import Callable, Optional
+
+# shortest allowed period of the monitoring loop
+MIN_PERIOD = 0.05
+# number of the last ticks used to estimate achieved frames/s
+FPS_WINDOW_SIZE = 20
+
+
+class DeadlineScheduler:
+    def __init__(
+        self,
+        period: float,
+        max_frame_age: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep_fn: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Ticks the monitoring loop against absolute deadlines t0 + k * period
+        of the monotonic clock. Overrunning iterations do not shift the
+        following deadlines, instead the missed ticks are skipped, so the
+        loop never tries to process a backlog of frames.
+
+        Args:
+            period: configured time between two ticks in seconds
+            max_frame_age: frames older than this number of seconds are
+                considered stale, by default two periods
+            clock: monotonic clock function
+            sleep_fn: sleep function
+        """
+        # frame age follows the period when it is not set explicitly
+        self.fixed_frame_age = max_frame_age
+        self.period = MIN_PERIOD
+        self.max_frame_age = 2 * MIN_PERIOD
+        self.set_period(period)
+        self.clock = clock
+        self.sleep_fn = sleep_fn
+
+        self.next_deadline: Optional[float] = None
+        self.last_frame_id: Optional[int] = None
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.num_ticks = 0
+        self.num_skipped_ticks = 0
+        self.num_stale_frames = 0
+        self.ticks_history = deque(maxlen=FPS_WINDOW_SIZE)
+
+    def set_period(self, period: float) -> None:
+        """
+        Change the period e.g. when settings are updated, the next deadline
+        is one new period after the previous one.
+
+        Args:
+            period: time between two ticks in seconds
+        """
+        self.period = max(float(period), MIN_PERIOD)
+        if self.fixed_frame_age is None:
+            self.max_frame_age = 2 * self.period
+        else:
+            self.max_frame_age = self.fixed_frame_age
+
+    def start(self) -> None:
+        now = self.clock()
+        self.next_deadline = now
+        self.ticks_history.clear()
+        self.ticks_history.append(now)
+
+    def wait(self) -> float:
+        """
+        Sleep until the next deadline. When the deadline has already passed
+        the method returns immediately and all ticks missed in between are
+        dropped.
+
+        Returns:
+            lateness of the current tick in seconds
+        """
+        if self.next_deadline is None:
+            self.start()
+
+        self.next_deadline += self.period
+        now = self.clock()
+        delta = self.next_deadline - now
+        if delta > 0:
+            self.sleep_fn(delta)
+            lateness = 0.0
+        else:
+            # realign to the latest deadline which is not in the future
+            missed_ticks = int(-delta // self.period)
+            self.num_skipped_ticks += missed_ticks
+            self.next_deadline += missed_ticks * self.period
+            lateness = now - self.next_deadline
+
+        self.lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.num_ticks += 1
+        self.ticks_history.append(self.clock())
+        return lateness
+
+    def is_frame_stale(self, frame_id: int, frame_time: float) -> bool:
+        """
+        Check whether frame should be skipped, because it was already
+        processed or it was captured too long time ago.
+
+        Args:
+            frame_id: camera frame counter
+            frame_time: monotonic time at which frame was captured
+
+        Returns:
+            True if the frame should not be processed
+        """
+        is_duplicate = frame_id == self.last_frame_id
+        is_old = self.clock() - frame_time > self.max_frame_age
+        self.last_frame_id = frame_id
+        if is_duplicate or is_old:
+            self.num_stale_frames += 1
+            return True
+        return False
+
+    @property
+    def configured_fps(self) -> float:
+        return 1.0 / self.period
+
+    @property
+    def achieved_fps(self) -> float:
+        if len(self.ticks_history) < 2:
+            return 0.0
+        dt = self.ticks_history[-1] - self.ticks_history[0]
+        if dt <= 0:
+            return 0.0
+        return (len(self.ticks_history) - 1) / dt
+
+    def format_stats(self) -> str:
+        return (
+            f"{self.achieved_fps:.2f}/{self.configured_fps:.2f} fps, "
+            f"lateness {self.lateness:.2f}s (max {self.max_lateness:.2f}s), "
+            f"skipped {self.num_skipped_ticks} ticks, "
+            f"{self.num_stale_frames} stale frames"
+        )
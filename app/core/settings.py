@@ -0,0 +1,299 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, FrozenSet
+
+import numpy as np
+from dataclasses import dataclass, replace
+
+from core.image_utils import (
+    PILImage,
+    draw_roi_on_image,
+    ROI_ENABLED_COLOR,
+    ROI_DISABLED_COLOR,
+)
+
+# camera settings keys, the same keys are used in the settings.yaml file
+NAME = "camera_name"
+SCHEDULE = "schedule"
+MODEL_NAME = "model_name"
+URL = "url"
+USER = "user"
+PASSWORD = "password"
+CHECK_PERIOD = "check_period"
+CAMERA_TIMEOUT = "timeout"
+MAX_SEQUENCE_LENGTH = "max_sequence_length"
+
+# ROI settings keys
+ROI_X_MIN = "roi_x_min"
+ROI_Y_MIN = "roi_y_min"
+ROI_X_MAX = "roi_x_max"
+ROI_Y_MAX = "roi_y_max"
+ROI_LABELS_FILTER = "labels_filter"
+ROI_NAME = "name"
+ROI_ENABLED = "enabled"
+
+PER_PIXEL_CHANGE_THRESHOLD = 0.2
+ROI_CHANGE_CROP_SIZE = (200, 200)
+
+
+DEFAULT_SCHEDULE = {"from": "8:00", "to": "18:00", "weekdays": [False] * 7}
+DEFAULT_ROI = {
+    ROI_NAME: "default",
+    ROI_ENABLED: True,
+    ROI_LABELS_FILTER: "*",
+    ROI_X_MIN: 0,
+    ROI_Y_MIN: 0,
+    ROI_X_MAX: 100,
+    ROI_Y_MAX: 100,
+}
+DEFAULT_CAMERA = {
+    NAME: "Home",
+    MODEL_NAME: "",
+    URL: "",
+    USER: "",
+    PASSWORD: "",
+    CHECK_PERIOD: 5,
+    CAMERA_TIMEOUT: 5,
+    MAX_SEQUENCE_LENGTH: 10,
+}
+
+Box = Tuple[int, int, int, int]
+RelativeBox = Tuple[float, float, float, float]
+ImageSize = Tuple[int, int]
+
+
+def parse_hour(hour: str) -> int:
+    """Convert hour in the format '8:00' to integer."""
+    return int(str(hour).split(":")[0])
+
+
+def parse_labels_filter(labels_filter: str) -> Optional[FrozenSet[str]]:
+    """
+    Convert comma separated labels filter to the set of lower case
+    labels. Returns None if all labels are accepted.
+    """
+    labels_filter = labels_filter.lower().strip()
+    if labels_filter == "*":
+        return None
+    return frozenset(label.strip() for label in labels_filter.split(","))
+
+
+def to_relative_box(x_min: int, y_min: int, x_max: int, y_max: int) -> RelativeBox:
+    """Convert ROI corners given in percents to ordered (0, 1) box"""
+    x_min, y_min = max(0, x_min) / 100.0, max(0, y_min) / 100.0
+    x_max, y_max = min(100, x_max) / 100.0, min(100, y_max) / 100.0
+    return (
+        min(x_min, x_max),
+        min(y_min, y_max),
+        max(x_min, x_max),
+        max(y_min, y_max),
+    )
+
+
+def to_pixel_box(box: RelativeBox, image_size: ImageSize) -> Box:
+    width, height = image_size
+    return (
+        int(box[0] * width),
+        int(box[1] * height),
+        int(box[2] * width),
+        int(box[3] * height),
+    )
+
+
+@dataclass(frozen=True)
+class ScheduleSettings:
+    __slots__ = ("from_hour", "to_hour", "weekdays")
+    from_hour: int
+    to_hour: int
+    weekdays: Tuple[bool, ...]
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "ScheduleSettings":
+        config = {**DEFAULT_SCHEDULE, **config}
+        return cls(
+            from_hour=parse_hour(config["from"]),
+            to_hour=parse_hour(config["to"]),
+            weekdays=tuple(bool(d) for d in config["weekdays"]),
+        )
+
+    def is_date_in_schedule(self, date: Optional[datetime] = None) -> bool:
+        if date is None:
+            date = datetime.now()
+        if not self.weekdays[date.weekday()]:
+            return False
+
+        return self.from_hour <= date.hour < self.to_hour
+
+
+@dataclass(frozen=True)
+class ROISettings:
+    """
+    Immutable snapshot of the ROI settings. Labels filter and ROI box are
+    precomputed, so the monitoring loop does not parse anything per frame.
+    """
+
+    __slots__ = (
+        "name",
+        "enabled",
+        "labels_filter",
+        "labels_set",
+        "box",
+        "image_size",
+        "pixel_box",
+    )
+    name: str
+    enabled: bool
+    labels_filter: str
+    # lower case labels to accept, None means all labels
+    labels_set: Optional[FrozenSet[str]]
+    # ROI box relative to image size
+    box: RelativeBox
+    # image size for which pixel_box was computed
+    image_size: Optional[ImageSize]
+    pixel_box: Optional[Box]
+
+    @classmethod
+    def from_dict(
+        cls, config: Dict[str, Any], image_size: Optional[ImageSize] = None
+    ) -> "ROISettings":
+        config = {**DEFAULT_ROI, **config}
+        labels_filter = str(config[ROI_LABELS_FILTER])
+        box = to_relative_box(
+            int(config[ROI_X_MIN]),
+            int(config[ROI_Y_MIN]),
+            int(config[ROI_X_MAX]),
+            int(config[ROI_Y_MAX]),
+        )
+        pixel_box = None
+        if image_size is not None:
+            pixel_box = to_pixel_box(box, image_size)
+        return cls(
+            name=str(config[ROI_NAME]),
+            enabled=bool(config[ROI_ENABLED]),
+            labels_filter=labels_filter,
+            labels_set=parse_labels_filter(labels_filter),
+            box=box,
+            image_size=image_size,
+            pixel_box=pixel_box,
+        )
+
+    def with_image_size(self, image_size: ImageSize) -> "ROISettings":
+        return replace(
+            self, image_size=image_size, pixel_box=to_pixel_box(self.box, image_size)
+        )
+
+    def filter_labels(self, labels: List[str]) -> List[str]:
+        if self.labels_set is None:
+            return labels
+        return [label for label in labels if label.lower() in self.labels_set]
+
+    def get_image_roi(self, image: PILImage) -> Box:
+        if image.size == self.image_size:
+            return self.pixel_box
+        return to_pixel_box(self.box, image.size)
+
+    def draw_roi_on_image(self, image: PILImage) -> PILImage:
+        color = ROI_ENABLED_COLOR if self.enabled else ROI_DISABLED_COLOR
+        return draw_roi_on_image(image, self.get_image_roi(image), self.name, color)
+
+    def crop(self, image: PILImage) -> PILImage:
+        roi = self.get_image_roi(image)
+        return image.crop(box=roi)
+
+    def compute_roi_image_change(
+        self, prev_image: PILImage, curr_image: PILImage
+    ) -> float:
+        """
+        Estimate the fraction of image ROI changed  between
+        to frames
+        Args:
+            prev_image:
+            curr_image:
+
+        Returns:
+            a number between (0, 1) which defines the fraction of
+            pixels in the ROI which changed more then "per pixel"
+            threshold
+        """
+        crop_size = ROI_CHANGE_CROP_SIZE
+        cim = self.crop(curr_image).resize(crop_size, resample=2)
+        pim = self.crop(prev_image).resize(crop_size, resample=2)
+        cim_gray = np.array(cim).mean(-1) / 255.0
+        pim_gray = np.array(pim).mean(-1) / 255.0
+        image_diff = np.abs(cim_gray - pim_gray)
+        fraction_changed = (image_diff > PER_PIXEL_CHANGE_THRESHOLD).mean()
+        return fraction_changed
+
+
+@dataclass(frozen=True)
+class CameraSettings:
+    """
+    Immutable snapshot of the camera and ROIs settings read by the
+    monitoring loop. A new snapshot is compiled when settings change.
+    """
+
+    __slots__ = (
+        "camera_name",
+        "model_name",
+        "url",
+        "user",
+        "password",
+        "check_period",
+        "timeout",
+        "max_sequence_length",
+        "schedule",
+        "rois",
+        "enabled_rois",
+        "image_size",
+    )
+    camera_name: str
+    model_name: str
+    url: str
+    user: str
+    password: str
+    check_period: float
+    timeout: int
+    max_sequence_length: float
+    schedule: ScheduleSettings
+    rois: Tuple[ROISettings, ...]
+    enabled_rois: Tuple[ROISettings, ...]
+    # camera image size for which ROI pixel boxes were computed
+    image_size: Optional[ImageSize]
+
+    @classmethod
+    def from_dict(
+        cls, config: Dict[str, Any], image_size: Optional[ImageSize] = None
+    ) -> "CameraSettings":
+        """
+        Create settings from the "camera_settings" section of the settings.yaml
+        file (the same structure is returned by CameraWidget.get_settings).
+        """
+        general = {**DEFAULT_CAMERA, **config.get("general", {})}
+        rois = tuple(
+            ROISettings.from_dict(roi, image_size) for roi in config.get("rois", [])
+        )
+        return cls(
+            camera_name=str(general[NAME]),
+            model_name=str(general[MODEL_NAME]),
+            url=str(general[URL]),
+            user=str(general[USER]),
+            password=str(general[PASSWORD]),
+            check_period=float(general[CHECK_PERIOD]),
+            timeout=int(general[CAMERA_TIMEOUT]),
+            max_sequence_length=float(general[MAX_SEQUENCE_LENGTH]),
+            schedule=ScheduleSettings.from_dict(general.get(SCHEDULE, {})),
+            rois=rois,
+            enabled_rois=tuple(roi for roi in rois if roi.enabled),
+            image_size=image_size,
+        )
+
+    def with_image_size(self, image_size: ImageSize) -> "CameraSettings":
+        """Returns snapshot with ROIs pixel boxes precomputed for image size"""
+        if image_size == self.image_size:
+            return self
+        rois = tuple(roi.with_image_size(image_size) for roi in self.rois)
+        return replace(
+            self,
+            rois=rois,
+            enabled_rois=tuple(roi for roi in rois if roi.enabled),
+            image_size=image_size,
+        )
@@ -1,15 +1,21 @@
-import threading
 from datetime import datetime
+from typing import Optional
 
 import remi.gui as gui
 
 from config.config import Config
-from core.camera_widget import CameraWidget, EVENTS_SEQUENCE_SEPARATION
-from core.history_widget import (
-    load_day_history,
-    string_to_datetime,
+from core.camera_widget import CameraWidget
+from core.history import EventsSequence, load_last_sequence
+from core.notification_policy import NOTIFICATION_POLICY
+from core.widgets import (
+    HorizontalLine,
+    SButton,
+    EmailNotifierWidget,
+    WebhookNotifierWidget,
 )
-from core.widgets import HorizontalLine, SButton, EmailNotifierWidget
+
+EMAIL_CHANNEL = "email"
+WEBHOOK_CHANNEL = "webhook"
 
 
 class AppSettingsWidget(gui.Container):
@@ -20,6 +26,7 @@ class AppSettingsWidget(gui.Container):
         self.save_btn.css_width = "300px"
         self.save_btn.css_margin = "5px auto"
         self.email_notifier_widget = EmailNotifierWidget(width="100%")
+        self.webhook_notifier_widget = WebhookNotifierWidget(width="100%")
         self.camera_widget = CameraWidget(width="100%")
 
         cam_layout = gui.VBox()
@@ -28,6 +35,7 @@ class AppSettingsWidget(gui.Container):
         layout = gui.VBox(width="100%")
         layout.css_display = "block"
         layout.append(self.email_notifier_widget)
+        layout.append(self.webhook_notifier_widget)
         layout.append(self.save_btn)
 
         self.append(HorizontalLine())
@@ -50,52 +58,60 @@ class AppSettingsWidget(gui.Container):
             do_checks=False,
         )
 
-    def maybe_send_notification(self, emitter=None):
-
-        if self.email_notifier_widget.cannot_send_email():
-            return False
-
-        now = datetime.now()
-        history = load_day_history(date=now)
-        if len(history) == 0:
+    def maybe_send_notification(
+        self, emitter=None, sequence: Optional[EventsSequence] = None
+    ):
+        email_widget = self.email_notifier_widget
+        webhook_widget = self.webhook_notifier_widget
+        if email_widget.cannot_send_email() and webhook_widget.cannot_send_event():
             return False
 
-        # scan history for sequence of co-occurring events
-        records_sequence = []
-        last_record_date = string_to_datetime(history[0]["datetime"])
-        for record in history:
-            event_date = string_to_datetime(record["datetime"])
-            dt = last_record_date - event_date
-            if dt.total_seconds() < EVENTS_SEQUENCE_SEPARATION:
-                records_sequence.append(record)
-                last_record_date = event_date
-            else:
-                break
-
-        if len(records_sequence) == 0:
+        if sequence is None:
+            sequence = load_last_sequence(datetime.now())
+        if sequence is None:
             return False
 
-        def send_email_thread_fn():
-            labels = []
-            for r in records_sequence:
-                labels += r["labels"]
-
-            start = string_to_datetime(records_sequence[0]["datetime"])
-            end = string_to_datetime(records_sequence[-1]["datetime"])
-            event_length = int((end - start).total_seconds())
-            self.email_notifier_widget.send_notification_message(
-                title=f"Detected labels {set(labels)}",
-                attachments=[r["image_path"] for r in records_sequence],
-                contents=[
-                    f"Detected {len(records_sequence)} events of total "
-                    f"time {event_length} seconds. Following labels "
-                    f"have been detected {set(labels)}"
-                ],
-                do_checks=True,
+        is_sent = False
+        if not email_widget.cannot_send_email():
+            is_sent |= self.send_email_notification(sequence)
+        if not webhook_widget.cannot_send_event():
+            NOTIFICATION_POLICY.add_channel(
+                WEBHOOK_CHANNEL,
+                period=webhook_widget.notification_frequency * 60,
+                digest_handler=webhook_widget.send_digest,
             )
+            # sequence is sent later in the digest if not allowed now
+            if NOTIFICATION_POLICY.allow(WEBHOOK_CHANNEL, sequence):
+                is_sent |= webhook_widget.send_sequence(sequence)
+        return is_sent
+
+    def send_email_notification(self, sequence: EventsSequence) -> bool:
+        email_widget = self.email_notifier_widget
+        NOTIFICATION_POLICY.add_channel(
+            EMAIL_CHANNEL,
+            period=email_widget.notification_frequency * 60,
+            digest_handler=email_widget.send_digest,
+        )
+        if not NOTIFICATION_POLICY.allow(EMAIL_CHANNEL, sequence):
+            # sequence is sent later in the digest
+            return False
 
-        send_email_thread = threading.Thread(target=send_email_thread_fn)
-        send_email_thread.start()
+        # records of the ROIs detected on the same frame share the image
+        records = sequence.records
+        labels = set(sequence.labels)
+        duration = sequence.end_date - sequence.start_date
+        event_length = int(duration.total_seconds())
+        # message is only queued, it is sent by the notifications dispatcher
+        return email_widget.send_notification_message(
+            title=f"Detected labels {labels}",
+            attachments=list(dict.fromkeys(r["image_path"] for r in records)),
+            contents=[
+                f"Detected {len(records)} events of total "
+                f"time {event_length} seconds. Following labels "
+                f"have been detected {labels}"
+            ],
+            do_checks=True,
+        )
 
     def save_settings(self, emitter=None):
         """
@@ -103,10 +119,12 @@ class AppSettingsWidget(gui.Container):
         """
         camera_config = self.camera_widget.get_settings()
         email_settings = self.email_notifier_widget.get_settings()
+        webhook_settings = self.webhook_notifier_widget.get_settings()
         Config.dump_config(
             {
                 "camera_settings": camera_config,
                 "email_notification_settings": email_settings,
+                "webhook_notification_settings": webhook_settings,
             }
         )
 
@@ -119,3 +137,7 @@ class AppSettingsWidget(gui.Container):
             return
         self.camera_widget.set_settings(config["camera_settings"])
         self.email_notifier_widget.set_settings(config["email_notification_settings"])
+        # settings saved before webhooks were added do not have this section
+        webhook_settings = config.get("webhook_notification_settings")
+        if webhook_settings is not None:
+            self.webhook_notifier_widget.set_settings(webhook_settings)
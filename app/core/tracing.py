@@ -0,0 +1,149 @@
+"""
+Lightweight tracing of the monitoring loop stages. Spans are kept in a
+bounded ring buffer and exported as Chrome trace-event JSON, which can be
+opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from config.config import Config
+
+# name, start [us], duration [us], thread id, arguments
+SpanRecord = Tuple[str, float, float, int, Dict[str, Any]]
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.tracer.add(self.name, self.start, time.perf_counter(), self.args)
+
+
+class NullSpan:
+    """Returned when tracing is disabled, does not measure anything"""
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(
+        self,
+        max_spans: int = Config.TRACING_MAX_SPANS,
+        enabled: bool = Config.TRACING_ENABLED,
+    ):
+        """
+        Collects timed spans of the processing stages, e.g.
+
+            with TRACER.span("predict", frame_id=frame.frame_id, camera=name):
+                ...
+
+        When tracing is disabled span returns a shared no-op context
+        manager, so the instrumented code only pays for a function call.
+
+        Args:
+            max_spans: number of the most recent spans kept in memory
+            enabled: collect spans from the start
+        """
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.spans: Deque[SpanRecord] = deque(maxlen=max_spans)
+        self.thread_names: Dict[int, str] = {}
+        self.num_spans = 0
+        # perf_counter is converted to the wall clock time in the export
+        self.clock_offset = time.time() - time.perf_counter()
+
+    def set_enabled(self, enabled: bool) -> None:
+        self.enabled = enabled
+
+    def span(self, name: str, **args: Any):
+        """
+        Context manager measuring the with block.
+
+        Args:
+            name: stage name
+            args: tags of the span, e.g. frame_id, camera, roi
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def add(self, name: str, start: float, end: float, args: Dict[str, Any]) -> None:
+        thread = threading.current_thread()
+        record = (name, start * 1e6, (end - start) * 1e6, thread.ident, args)
+        with self.lock:
+            self.spans.append(record)
+            self.thread_names[thread.ident] = thread.name
+            self.num_spans += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.spans.clear()
+            self.thread_names.clear()
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Returns collected spans as Chrome trace-event JSON object"""
+        with self.lock:
+            spans = list(self.spans)
+            thread_names = dict(self.thread_names)
+        pid = os.getpid()
+        offset = self.clock_offset * 1e6
+        events: List[Dict[str, Any]] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+            for thread_id, thread_name in thread_names.items()
+        ]
+        for name, start, duration, thread_id, args in spans:
+            events.append(
+                {
+                    "name": name,
+                    "cat": "monitoring",
+                    "ph": "X",
+                    "ts": round(start + offset, 1),
+                    "dur": round(duration, 1),
+                    "pid": pid,
+                    "tid": thread_id,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_chrome_trace(), default=str)
+
+    def format_stats(self) -> str:
+        with self.lock:
+            num_buffered = len(self.spans)
+        state = "enabled" if self.enabled else "disabled"
+        return (
+            f"{state}, buffered={num_buffered}/{self.spans.maxlen}, "
+            f"total={self.num_spans}"
+        )
+
+
+TRACER = Tracer()
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+from config.config import Config
+
+logger = logging.getLogger("clever-camera")
+
+UpdateKey = Tuple[int, Hashable]
+
+
+class UIUpdateBus:
+    def __init__(
+        self,
+        period: float = Config.UI_UPDATE_PERIOD,
+        max_updates: int = Config.UI_MAX_UPDATES,
+    ):
+        """
+        Widget updates posted by the background threads (monitoring, system
+        resources, history search) and applied by the UI thread from
+        CleverCameraApp.idle, while remi update lock is held. Updates are
+        coalesced per widget and name, only the latest posted update is
+        applied and the older ones are dropped, so a busy thread cannot
+        flood the browser with intermediate states.
+
+        Args:
+            period: minimum seconds between flushes
+            max_updates: maximum number of updates applied by a single
+                flush, the remaining ones wait for the next flush
+        """
+        self.period = period
+        self.max_updates = max_updates
+        self.lock = threading.Lock()
+        # keeps the order of the first post, so a frequently updated widget
+        # does not starve the others
+        self.pending: "OrderedDict[UpdateKey, Tuple[Callable, tuple]]" = (
+            OrderedDict()
+        )
+        self.last_flush = 0.0
+        self.num_posted = 0
+        self.num_applied = 0
+        self.num_dropped = 0
+
+    @property
+    def num_pending(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    def post(
+        self, widget: Any, name: Hashable, update: Callable[..., Any], *args: Any
+    ) -> None:
+        """
+        Schedule update(*args) in the UI thread, replacing the pending update
+        of the same widget and name.
+
+        Args:
+            widget: updated widget, identifies the update together with name
+            name: updated property of the widget e.g. "icon"
+            update: called by the UI thread
+            args: update arguments
+        """
+        key = (id(widget), name)
+        with self.lock:
+            self.num_posted += 1
+            if key in self.pending:
+                self.num_dropped += 1
+            self.pending[key] = (update, args)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Apply pending updates, must be called from the UI thread.
+
+        Args:
+            force: ignore the flush period and the updates limit
+
+        Returns:
+            number of applied updates
+        """
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_flush < self.period:
+                return 0
+            self.last_flush = now
+            num_updates = len(self.pending)
+            if not force:
+                num_updates = min(num_updates, self.max_updates)
+            updates = [self.pending.popitem(last=False)[1] for _ in range(num_updates)]
+
+        for update, args in updates:
+            try:
+                update(*args)
+            except Exception:
+                logger.exception("Cannot apply UI update")
+        with self.lock:
+            self.num_applied += len(updates)
+        return len(updates)
+
+    def format_stats(self) -> str:
+        with self.lock:
+            return (
+                f"posted={self.num_posted}, applied={self.num_applied}, "
+                f"dropped={self.num_dropped}, pending={len(self.pending)}"
+            )
+
+
+UI_UPDATES = UIUpdateBus()
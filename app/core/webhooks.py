@@ -0,0 +1,191 @@
+import base64
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from dataclasses import dataclass
+
+from config.config import Config
+from core.durable_queue import NOTIFICATIONS_QUEUE, DurableQueue, get_message_id
+from core.event_index import format_event_date
+from core.history import EventsSequence
+from core.notification_policy import DigestEntry
+from core.notifications import encode_attachment
+from core.routes import get_snapshot_url
+
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    url: str
+    # sent as "Authorization: Bearer <token>" header if not empty
+    token: str = ""
+    # application url used in the thumbnails links, e.g. http://camera:4000
+    public_url: str = ""
+    # send thumbnails as base64 JPEG instead of links
+    inline_images: bool = False
+
+
+@dataclass(frozen=True)
+class QueuedEvent:
+    event_id: str
+    payload: Dict[str, Any]
+    # epoch time when event was submitted
+    created: float
+    num_attempts: int = 0
+    # epoch time of the next sending attempt
+    next_attempt: float = 0.0
+
+    @property
+    def item_id(self) -> str:
+        return self.event_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "event_id": self.event_id,
+            "payload": self.payload,
+            "created": self.created,
+            "num_attempts": self.num_attempts,
+            "next_attempt": self.next_attempt,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QueuedEvent":
+        return cls(
+            event_id=data["event_id"],
+            payload=data["payload"],
+            created=data["created"],
+            num_attempts=data.get("num_attempts", 0),
+            next_attempt=data.get("next_attempt", 0.0),
+        )
+
+
+def encode_image_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as file:
+            return base64.b64encode(file.read()).decode()
+    except OSError:
+        return None
+
+
+def get_thumbnails(sequence: EventsSequence) -> List[str]:
+    """Returns unique thumbnails of the sequence sampled uniformly in time"""
+    paths = list(dict.fromkeys(r["thumbnail_path"] for r in sequence.records))
+    max_images = Config.NOTIFICATIONS_MONTAGE_IMAGES
+    if len(paths) > max_images:
+        step = len(paths) / max_images
+        paths = [paths[int(i * step)] for i in range(max_images)]
+    return paths
+
+
+def build_sequence_payload(
+    sequence: EventsSequence, settings: WebhookSettings
+) -> Dict[str, Any]:
+    """Compact description of the finished events sequence"""
+    records = sequence.records
+    payload = {
+        "type": "sequence",
+        "sequence_id": sequence.sequence_id,
+        "camera_name": records[0].get("camera_name"),
+        "start": format_event_date(sequence.start_date),
+        "end": format_event_date(sequence.end_date),
+        "labels": sequence.labels,
+        "rois": list(dict.fromkeys(r["roi_name"] for r in records)),
+        "num_events": len(records),
+    }
+    thumbnails = get_thumbnails(sequence)
+    if settings.inline_images:
+        images = [encode_image_file(path) for path in thumbnails]
+        payload["thumbnails_jpeg"] = [image for image in images if image is not None]
+    else:
+        payload["thumbnails"] = [
+            urljoin(settings.public_url, get_snapshot_url(path)) for path in thumbnails
+        ]
+    return payload
+
+
+def build_digest_payload(
+    entries: List[DigestEntry], settings: WebhookSettings
+) -> Dict[str, Any]:
+    """Sequences suppressed by the notifications limits"""
+    sequences = []
+    for entry in entries:
+        sequence = {
+            "sequence_id": entry.sequence_id,
+            "start": format_event_date(entry.start_date),
+            "end": format_event_date(entry.end_date),
+            "labels": entry.labels,
+            "num_events": entry.num_events,
+        }
+        if settings.inline_images and entry.montage is not None:
+            data = encode_attachment(entry.montage, entry.montage.size, 2 ** 20)
+            sequence["montage_jpeg"] = base64.b64encode(data).decode()
+        sequences.append(sequence)
+    return {"type": "digest", "sequences": sequences}
+
+
+class WebhookNotifier(DurableQueue):
+    channel = "webhook"
+    item_class = QueuedEvent
+
+    def __init__(
+        self,
+        queue_dir: Path = Config.WEBHOOK_QUEUE_DIR,
+        batch_size: int = Config.WEBHOOK_BATCH_SIZE,
+        batch_delay: float = Config.WEBHOOK_BATCH_DELAY,
+        max_attempts: int = Config.WEBHOOK_MAX_ATTEMPTS,
+        retry_delay: float = Config.WEBHOOK_RETRY_DELAY,
+    ):
+        """
+        Posts events as JSON to the webhook url in the background thread.
+        Events are saved in the queue folder until they are delivered and
+        sent in batches of up to batch_size events per request, failed
+        batches are retried with exponential backoff. HTTP connection is
+        kept alive in the session pool between requests.
+
+        Args:
+            queue_dir: folder with pending events
+            batch_size: maximum number of events posted in a single request
+            batch_delay: seconds to wait for more events before posting
+                incomplete batch
+            max_attempts: event is dropped after this number of failures
+            retry_delay: delay after the first failure, doubled with every
+                next failure
+        """
+        super().__init__(queue_dir, max_attempts, retry_delay, batch_size, batch_delay)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=1))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=1))
+
+    def is_configured(self, settings: Optional[WebhookSettings]) -> bool:
+        return settings is not None and bool(settings.url)
+
+    def submit(self, payload: Dict[str, Any]) -> QueuedEvent:
+        """Save event in the queue, it is posted by the background thread"""
+        created = time.time()
+        event = QueuedEvent(
+            event_id=get_message_id(created), payload=payload, created=created
+        )
+        self.put(event)
+        return event
+
+    def send(self, batch: List[QueuedEvent], settings: WebhookSettings) -> None:
+        self.post([event.payload for event in batch], settings)
+
+    def post(self, payloads: List[Dict[str, Any]], settings: WebhookSettings) -> None:
+        headers = {}
+        if settings.token:
+            headers["Authorization"] = f"Bearer {settings.token}"
+        response = self.session.post(
+            settings.url,
+            json={"events": payloads},
+            headers=headers,
+            timeout=Config.WEBHOOK_TIMEOUT,
+        )
+        response.raise_for_status()
+
+
+WEBHOOKS = WebhookNotifier()
+NOTIFICATIONS_QUEUE.set_function(lambda: WEBHOOKS.num_pending, channel="webhook")
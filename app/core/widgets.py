@@ -2,24 +2,31 @@ import base64
 import binascii
 import io
 import mimetypes
-import smtplib
+import threading
 import time
 from collections import Counter
 from datetime import datetime
 from pathlib import Path
 from typing import Union, Optional, List, Tuple, Dict, Any
-import numpy as np
 import PIL
 import PIL.Image
 import remi.gui as gui
-from PIL import ImageDraw, ImageFont
 from remi import App
-import yagmail
 
 from config.config import Config
 import config.styles as css
-
-PILImage = PIL.Image.Image
+import core.settings as cs
+from core.history import EventsSequence
+from core.image_utils import PILImage
+from core.notification_policy import DigestEntry
+from core.notifications import NOTIFICATIONS, SmtpSettings
+from core.ui_updates import UI_UPDATES
+from core.webhooks import (
+    WEBHOOKS,
+    WebhookSettings,
+    build_digest_payload,
+    build_sequence_payload,
+)
 
 
 class CustomButton(gui.Button):
@@ -105,7 +112,7 @@ class HourlyToggleHistogram(gui.Container):
             hours_layout.append(btn)
         self.append(hours_layout)
 
-        self.update_from_dates([])
+        self.update_from_counts({})
 
     def reset_selections(self):
         for btn in self.hourly_buttons:
@@ -121,7 +128,14 @@ class HourlyToggleHistogram(gui.Container):
         Args:
             dates: a list of events dates
         """
-        hour_count = Counter([date.hour for date in dates])
+        self.update_from_counts(Counter([date.hour for date in dates]))
+
+    def update_from_counts(self, hour_count: Dict[int, int]):
+        """
+        Creates histogram of events for every hour in the day.
+        Args:
+            hour_count: number of events for every hour of the day
+        """
         max_prob = 1
         total_count = 1
         if len(hour_count) > 0:
@@ -172,6 +186,17 @@ class MonitoringScheduleWidget(gui.VBox):
             layout.append(day)
         self.append(layout)
 
+        # signals
+        self.from_hour_combo.onchange.do(self.on_schedule_changed)
+        self.to_hour_combo.onchange.do(self.on_schedule_changed)
+        for day in self.weekdays:
+            day.on_toggled.do(self.on_schedule_changed)
+
+    @gui.decorate_set_on_listener("(self, emitter)")
+    @gui.decorate_event
+    def on_schedule_changed(self, *args):
+        return ()
+
     def get_values(self) -> Dict[str, Any]:
         return {
             "from": self.from_hour_combo.get_value(),
@@ -187,22 +212,21 @@ class MonitoringScheduleWidget(gui.VBox):
         if "weekdays" in config:
             for toggle, day in zip(config["weekdays"], self.weekdays):
                 day.set_checked(toggle)
+        self.on_schedule_changed()
 
     @property
     def from_hour(self) -> int:
-        return int(self.from_hour_combo.get_value().split(":")[0])
+        return cs.parse_hour(self.from_hour_combo.get_value())
 
     @property
     def to_hour(self) -> int:
-        return int(self.to_hour_combo.get_value().split(":")[0])
+        return cs.parse_hour(self.to_hour_combo.get_value())
 
-    def is_date_in_schedule(self, date: Optional[datetime] = None) -> bool:
-        if date is None:
-            date = datetime.now()
-        if not self.weekdays[date.weekday()].is_toggled:
-            return False
+    def to_schedule_settings(self) -> cs.ScheduleSettings:
+        return cs.ScheduleSettings.from_dict(self.get_values())
 
-        return self.from_hour <= date.hour < self.to_hour
+    def is_date_in_schedule(self, date: Optional[datetime] = None) -> bool:
+        return self.to_schedule_settings().is_date_in_schedule(date)
 
 
 class SButton(gui.Button):
@@ -295,17 +319,27 @@ class StyledDropDownMenu(gui.Container):
 
 class LoggerWidget(gui.ListView):
     def __init__(self, history_size: int = 5, *arg, **kwargs):
+        """
+        Latest log messages, messages can be added from any thread, the list
+        is rebuilt once per UI update with all new messages.
+        """
         super().__init__(*arg, **kwargs)
-        self.history = []
+        self.lock = threading.Lock()
+        self.history: List[str] = []
         self.history_size = history_size
         self.set_style(css.LOGGER_STYLE)
 
-    def update_history(self, label: gui.Label):
-        self.history = self.history[-self.history_size :]
-        self.history.append(label)
+    def update_history(self, text: str):
+        with self.lock:
+            self.history = (self.history + [text])[-self.history_size :]
+        UI_UPDATES.post(self, "history", self.refresh)
+
+    def refresh(self):
+        with self.lock:
+            history = list(self.history)
         self.empty()
-        for label in self.history:
-            self.append(label)
+        for text in history:
+            self.append(self.text_to_label(text))
 
     @staticmethod
     def time() -> str:
@@ -314,22 +348,20 @@ class LoggerWidget(gui.ListView):
     def format_text(self, level: str, text: str) -> str:
         return f"{self.time()}::{level.upper()}::{text}"
 
-    def text_to_label(self, level: str, text: str) -> gui.Label:
-        label = gui.Label(self.format_text(level, text))
+    @staticmethod
+    def text_to_label(text: str) -> gui.Label:
+        label = gui.Label(text)
         label.css_font_family = "monospace"
         return label
 
     def info(self, text: str):
-        label = self.text_to_label("Info", text)
-        self.update_history(label)
+        self.update_history(self.format_text("Info", text))
 
     def warning(self, text: str):
-        label = self.text_to_label("Warning", text)
-        self.update_history(label)
+        self.update_history(self.format_text("Warning", text))
 
     def error(self, text: str):
-        label = self.text_to_label("Error", text)
-        self.update_history(label)
+        self.update_history(self.format_text("Error", text))
 
 
 class PlainHTML(gui.Widget):
@@ -644,15 +676,13 @@ class PILImageWidget(gui.Image):
 
 
 class ROIWidget(SettingsWidget):
-    ROI_X_MIN = "roi_x_min"
-    ROI_Y_MIN = "roi_y_min"
-    ROI_X_MAX = "roi_x_max"
-    ROI_Y_MAX = "roi_y_max"
-    LABELS_FILTER = "labels_filter"
-    NAME = "name"
-    ENABLED = "enabled"
-    PER_PIXEL_CHANGE_THRESHOLD = 0.2
-    MEAN_CHANGE_THRESHOLD = 0.01
+    ROI_X_MIN = cs.ROI_X_MIN
+    ROI_Y_MIN = cs.ROI_Y_MIN
+    ROI_X_MAX = cs.ROI_X_MAX
+    ROI_Y_MAX = cs.ROI_Y_MAX
+    LABELS_FILTER = cs.ROI_LABELS_FILTER
+    NAME = cs.ROI_NAME
+    ENABLED = cs.ROI_ENABLED
 
     def __init__(self, name: str = "default", *args):
         super(ROIWidget, self).__init__(*args)
@@ -674,90 +704,52 @@ class ROIWidget(SettingsWidget):
         self[self.ENABLED].onchange.do(self.on_roi_changed)
         self[self.NAME].onchange.do(self.on_roi_changed)
         self[self.LABELS_FILTER].onchange.do(self.on_roi_changed)
+        # compiled once per change, the fields are not read by the helpers
+        self.roi_settings = self.compile_settings()
 
     def is_enabled(self) -> bool:
-        return self[self.ENABLED].get_value()
+        return self.roi_settings.enabled
 
     @property
     def name(self) -> str:
-        return self[self.NAME].get_value()
+        return self.roi_settings.name
 
     @property
     def labels_filter(self) -> str:
-        return self[self.LABELS_FILTER].get_value()
+        return self.roi_settings.labels_filter
+
+    def compile_settings(self) -> cs.ROISettings:
+        return cs.ROISettings.from_dict(self.get_settings())
+
+    def set_settings(self, settings: Dict[str, Any]) -> None:
+        super().set_settings(settings)
+        self.roi_settings = self.compile_settings()
+
+    def to_roi_settings(self) -> cs.ROISettings:
+        return self.roi_settings
 
     def filter_labels(self, labels: List[str]) -> List[str]:
-        filtered_labels = labels
-        if self.labels_filter != "*":
-            search_labels = self.labels_filter.lower().strip().split(",")
-            filtered_labels = []
-            for label in labels:
-                if label.lower() in search_labels:
-                    filtered_labels.append(label)
-        return filtered_labels
+        return self.roi_settings.filter_labels(labels)
 
     @gui.decorate_set_on_listener("(self, emitter)")
     @gui.decorate_event
     def on_roi_changed(self, *args):
+        self.roi_settings = self.compile_settings()
         return ()
 
     def get_image_roi(self, image: PILImage) -> Tuple[int, int, int, int]:
-        x_min = int(self[self.ROI_X_MIN].get_value())
-        y_min = int(self[self.ROI_Y_MIN].get_value())
-        x_max = int(self[self.ROI_X_MAX].get_value())
-        y_max = int(self[self.ROI_Y_MAX].get_value())
-
-        x_min, y_min = max(0, x_min) / 100.0, max(0, y_min) / 100.0
-        x_max, y_max = min(100, x_max) / 100.0, min(100, y_max) / 100.0
-        width, height = image.size
-        box = (
-            int(min(x_min, x_max) * width),
-            int(min(y_min, y_max) * height),
-            int(max(x_min, x_max) * width),
-            int(max(y_min, y_max) * height),
-        )
-        return box
+        return self.roi_settings.get_image_roi(image)
 
     def draw_roi_on_image(self, image: PILImage) -> PILImage:
-        roi = self.get_image_roi(image)
-        font_size = 30
-        outline = (40, 167, 69, 250) if self.is_enabled() else "red"
-
-        fnt = ImageFont.truetype(str(Config.FONT_PATH), size=font_size)
-        draw = ImageDraw.Draw(image, "RGBA")
-        x1, y1, x2, y2 = roi
-        draw.rectangle((roi[:2], roi[2:]), outline=outline, width=3)
-        draw.rectangle((x1, y1 - font_size - 2, x2, y1), fill=outline, width=3)
-        draw.text((roi[0], roi[1] - font_size + 2), self.name, font=fnt)
-        return image
+        return self.roi_settings.draw_roi_on_image(image)
 
     def crop(self, image: PILImage) -> PILImage:
-        roi = self.get_image_roi(image)
-        return image.crop(box=roi)
+        return self.roi_settings.crop(image)
 
     def compute_roi_image_change(
         self, prev_image: PILImage, curr_image: PILImage
     ) -> float:
-        """
-        Estimate the fraction of image ROI changed  between
-        to frames
-        Args:
-            prev_image:
-            curr_image:
-
-        Returns:
-            a number between (0, 1) which defines the fraction of
-            pixels in the ROI which changed more then "per pixel"
-            threshold
-        """
-        crop_size = (200, 200)
-        cim = self.crop(curr_image).resize(crop_size, resample=2)
-        pim = self.crop(prev_image).resize(crop_size, resample=2)
-        cim_gray = np.array(cim).mean(-1) / 255.0
-        pim_gray = np.array(pim).mean(-1) / 255.0
-        image_diff = np.abs(cim_gray - pim_gray)
-        fraction_changed = (image_diff > self.PER_PIXEL_CHANGE_THRESHOLD).mean()
-        return fraction_changed
+        return self.roi_settings.compute_roi_image_change(prev_image, curr_image)
 
 
 class DroppableTabBox(gui.TabBox):
@@ -803,8 +795,8 @@ class EmailNotifierWidget(SettingsWidget):
         )
         self.add_int_field(
             "frequency",
-            "Trigger when last event was later than this number "
-            "of minutes (for example 1440min = 24h)",
+            "Send at most one message per this number of minutes on "
+            "average, other events are sent in the digest",
             default_value=60,
             max_value=1440,
             step=15,
@@ -868,13 +860,6 @@ class EmailNotifierWidget(SettingsWidget):
         if not self.is_enabled:
             print("Cannot send mail, tool not enabled.")
             return True
-
-        date = datetime.now()
-        if self.last_message_send is not None:
-            delta = date - self.last_message_send
-            delta_minutes = delta.total_seconds() // 60
-            if delta_minutes < self.notification_frequency:
-                return True
         return False
 
     def send_notification_message(
@@ -887,7 +872,6 @@ class EmailNotifierWidget(SettingsWidget):
 
         date = datetime.now()
         if do_checks and self.cannot_send_email():
-            print("Cannot send mail, frequency condition not satisfied")
             return False
 
         subject = f"[Clever-Camera] {date} {title} "
@@ -896,26 +880,174 @@ class EmailNotifierWidget(SettingsWidget):
             ntimes = len(attachments) // self.max_num_images
             attachments = attachments[::ntimes][: self.max_num_images]
 
-        try:
-            yag = yagmail.SMTP(user=self.sender_email, password=self.sender_password)
-            result = yag.send(
-                self.receiver_email, subject, contents, attachments=attachments
-            )
-            if result is not False:
-                self.last_message_send_lbl.set_text(f"Message sent at: {date}")
-            else:
-                self.last_message_send_lbl.set_text(f"Cannot send message: {result}")
-
-        except smtplib.SMTPAuthenticationError as e:
-            self.last_message_send_lbl.set_text(
-                f"Cannot send message: {e.smtp_error.decode()}"
+        # message is sent in the background and retried if sending fails
+        NOTIFICATIONS.set_settings(self.get_smtp_settings())
+        NOTIFICATIONS.submit(subject, contents or [], attachments or [])
+        UI_UPDATES.post(
+            self,
+            "last_message",
+            self.last_message_send_lbl.set_text,
+            f"Message queued at: {date}",
+        )
+        self.last_message_send = date
+        return True
+
+    def send_digest(self, channel: str, entries: List[DigestEntry]) -> None:
+        """Send sequences suppressed by the notifications rate limits"""
+        if self.cannot_send_email():
+            return
+        date = datetime.now()
+        labels = Counter(label for entry in entries for label in entry.labels)
+        contents = [
+            f"{len(entries)} events sequences were not notified due to the "
+            f"notifications limits. Detected labels: {dict(labels)}"
+        ]
+        for entry in entries:
+            contents.append(
+                f"{entry.start_date:%Y-%m-%d %H:%M:%S} - "
+                f"{entry.end_date:%H:%M:%S}: {entry.num_events} events, "
+                f"labels {entry.labels}"
             )
-        except Exception as e:
-            self.last_message_send_lbl.set_text(f"Cannot send message: {e}")
+        montages = [entry.montage for entry in entries if entry.montage is not None]
+        NOTIFICATIONS.set_settings(self.get_smtp_settings())
+        NOTIFICATIONS.submit_images(
+            f"[Clever-Camera] {date} Digest of {len(entries)} events sequences",
+            contents,
+            montages,
+        )
+        UI_UPDATES.post(
+            self,
+            "last_message",
+            self.last_message_send_lbl.set_text,
+            f"Digest queued at: {date}",
+        )
+        self.last_message_send = date
+
+    def get_smtp_settings(self) -> SmtpSettings:
+        return SmtpSettings(
+            user=self.sender_email,
+            password=self.sender_password,
+            receiver=self.receiver_email,
+        )
+
+    def get_settings(self) -> Dict[str, Any]:
+        settings = super().get_settings()
+        settings["is_enabled"] = self.is_enabled
+        return settings
+
+    def set_settings(self, settings: Dict[str, Any]) -> None:
+        super().set_settings(settings)
+        self.enable_notifications_btn.set_checked(settings["is_enabled"])
+        self.toggle_notifications(is_toggled=settings["is_enabled"])
+        # send messages left in the queue before restart
+        NOTIFICATIONS.set_settings(self.get_smtp_settings())
+
+
+class WebhookNotifierWidget(SettingsWidget):
+    def __init__(self, *args, **kwargs):
+        super().__init__("Webhook notification settings", *args, **kwargs)
+        self.last_message_send: Optional[datetime] = None
+        self.settings.css_labels_min_width = "60%"
+
+        self.enable_notifications_btn = ToggleButton(
+            "Disabled", style=css.DEFAULT_BUTTON_STYLE
+        )
+        self.send_event_btn = SButton("Send test event", "fa-paper-plane")
+        self.last_message_send_lbl = gui.Label()
+        self.last_message_send_lbl.style["padding"] = "5px"
+
+        self.add_text_field(
+            "url", "Webhook url (events are posted as JSON)", "http://localhost:8080/"
+        )
+        self.add_password_field("token", "Bearer token (optional)", "")
+        self.add_text_field(
+            "public_url",
+            "Application url used in the thumbnails links",
+            f"http://localhost:{Config.APP_PORT}",
+        )
+        self.add_checkbox_field("inline_images", "Send thumbnails in the payload")
+        self["inline_images"].set_value(False)
+        self.add_int_field(
+            "frequency",
+            "Send at most one event per this number of minutes on "
+            "average, other events are sent in the digest",
+            default_value=5,
+            max_value=1440,
+            step=5,
+        )
+        self.settings.append(HorizontalLine())
+        self.settings.append(self.last_message_send_lbl)
+        self.settings.append(HorizontalLine())
+
+        layout = CenteredHBox()
+        layout.append(self.enable_notifications_btn)
+        layout.append(self.send_event_btn)
+        self.settings.append(layout)
+
+        self.append(self.settings)
+
+        self.enable_notifications_btn.on_toggled.do(self.toggle_notifications)
+        self.send_event_btn.onclick.do(self.send_test_event)
+
+    def toggle_notifications(self, emitter=None, is_toggled: bool = False):
+        text = "Enabled" if is_toggled else "Disabled"
+        self.enable_notifications_btn.set_text(text)
+
+    @property
+    def notification_frequency(self) -> int:
+        return int(self["frequency"].get_value())
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.enable_notifications_btn.is_toggled
+
+    def cannot_send_event(self) -> bool:
+        return not self.is_enabled or not self["url"].get_text()
 
+    def get_webhook_settings(self) -> WebhookSettings:
+        return WebhookSettings(
+            url=self["url"].get_text(),
+            token=self["token"].get_value(),
+            public_url=self["public_url"].get_text(),
+            inline_images=bool(self["inline_images"].get_value()),
+        )
+
+    def submit(self, payload: Dict[str, Any]) -> None:
+        """Queue event, it is posted in the background and retried on failure"""
+        date = datetime.now()
+        WEBHOOKS.set_settings(self.get_webhook_settings())
+        WEBHOOKS.submit(payload)
+        UI_UPDATES.post(
+            self,
+            "last_message",
+            self.last_message_send_lbl.set_text,
+            f"Event queued at: {date}",
+        )
         self.last_message_send = date
+
+    def send_sequence(self, sequence: EventsSequence) -> bool:
+        if self.cannot_send_event():
+            return False
+        self.submit(build_sequence_payload(sequence, self.get_webhook_settings()))
         return True
 
+    def send_digest(self, channel: str, entries: List[DigestEntry]) -> None:
+        """Send sequences suppressed by the notifications rate limits"""
+        if self.cannot_send_event():
+            return
+        self.submit(build_digest_payload(entries, self.get_webhook_settings()))
+
+    def send_test_event(self, emitter=None):
+        if not self["url"].get_text():
+            UI_UPDATES.post(
+                self,
+                "last_message",
+                self.last_message_send_lbl.set_text,
+                "Webhook url is not set",
+            )
+            return
+        self.submit({"type": "test", "date": f"{datetime.now()}"})
+
     def get_settings(self) -> Dict[str, Any]:
         settings = super().get_settings()
         settings["is_enabled"] = self.is_enabled
@@ -925,3 +1057,5 @@ class EmailNotifierWidget(SettingsWidget):
         super().set_settings(settings)
         self.enable_notifications_btn.set_checked(settings["is_enabled"])
         self.toggle_notifications(is_toggled=settings["is_enabled"])
+        # post events left in the queue before restart
+        WEBHOOKS.set_settings(self.get_webhook_settings())
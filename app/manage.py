@@ -0,0 +1,186 @@
+"""
+Maintenance commands for the clever-camera data folder.
+
+Usage:
+    python app/manage.py rebuild-index
+    python app/manage.py cleanup --max-gb 8 --max-days 30
+    python app/manage.py notifications-benchmark --port 8025 --num-messages 50
+    python app/manage.py webhook-benchmark --num-events 200 --num-failures 2
+
+Notifications benchmark sends messages to a local SMTP server, for example
+started with: python -m aiosmtpd -n -l localhost:8025. Webhook benchmark
+starts its own local HTTP server, which rejects the first requests to
+exercise retries.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config.config import Config
+from core.history import rebuild_events_index
+from core.notifications import NotificationDispatcher, SmtpSettings
+from core.retention import RetentionManager
+from core.webhooks import WebhookNotifier, WebhookSettings
+
+
+def rebuild_index(args: argparse.Namespace) -> int:
+    start = time.time()
+    num_events = rebuild_events_index()
+    dt = time.time() - start
+    print(
+        f"Indexed {num_events} events from {Config.SNAPSHOTS_DIR} "
+        f"in {dt:.2f} seconds."
+    )
+    return 0
+
+
+def cleanup(args: argparse.Namespace) -> int:
+    manager = RetentionManager()
+    if args.max_gb is not None:
+        manager.max_bytes = int(args.max_gb * 2 ** 30)
+    if args.max_days is not None:
+        manager.max_days = args.max_days
+    if args.thumbnails_max_days is not None:
+        manager.thumbnails_max_days = args.thumbnails_max_days
+    report = manager.enforce()
+    print(report.format())
+    return 0
+
+
+def notifications_benchmark(args: argparse.Namespace) -> int:
+    with tempfile.TemporaryDirectory() as queue_dir:
+        dispatcher = NotificationDispatcher(queue_dir=queue_dir, max_attempts=1)
+        dispatcher.set_settings(
+            SmtpSettings(
+                user="clever-camera@localhost",
+                password="",
+                receiver="benchmark@localhost",
+                host=args.host,
+                port=args.port,
+                use_ssl=False,
+            )
+        )
+        attachments = [str(Config.CAMERA_DEFAULT_IMAGE)] * args.num_images
+        start = time.time()
+        for i in range(args.num_messages):
+            dispatcher.submit(f"Benchmark message {i}", ["Benchmark"], attachments)
+        if not dispatcher.flush(timeout=args.timeout):
+            print(f"Timeout, {dispatcher.format_stats()}")
+            return 1
+        dt = time.time() - start
+
+    print(
+        f"Sent {dispatcher.num_sent} messages in {dt:.2f} seconds "
+        f"({dispatcher.num_sent / dt:.1f} messages/s), {dispatcher.format_stats()}"
+    )
+    return 0 if dispatcher.num_dropped == 0 else 1
+
+
+class WebhookStandIn(BaseHTTPRequestHandler):
+    """Local webhook receiver, fails the first num_failures requests"""
+
+    num_failures = 0
+    num_requests = 0
+    num_events = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        cls = type(self)
+        cls.num_requests += 1
+        if cls.num_requests <= cls.num_failures:
+            self.send_response(503)
+        else:
+            cls.num_events += len(json.loads(body)["events"])
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def webhook_benchmark(args: argparse.Namespace) -> int:
+    WebhookStandIn.num_failures = args.num_failures
+    server = ThreadingHTTPServer(("localhost", 0), WebhookStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://localhost:{server.server_address[1]}/"
+
+    with tempfile.TemporaryDirectory() as queue_dir:
+        notifier = WebhookNotifier(queue_dir=queue_dir, retry_delay=0.1)
+        notifier.set_settings(WebhookSettings(url=url))
+        start = time.time()
+        for i in range(args.num_events):
+            notifier.submit({"type": "sequence", "sequence_id": i, "labels": ["cat"]})
+        if not notifier.flush(timeout=args.timeout):
+            print(f"Timeout, {notifier.format_stats()}")
+            return 1
+        dt = time.time() - start
+    server.shutdown()
+
+    print(
+        f"Delivered {WebhookStandIn.num_events} events in {dt:.2f} seconds "
+        f"({WebhookStandIn.num_events / dt:.1f} events/s), "
+        f"{notifier.format_stats()}"
+    )
+    return 0 if WebhookStandIn.num_events == args.num_events else 1
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Clever-camera maintenance.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser(
+        "rebuild-index", help="Re-scan snapshots folder and rebuild events index."
+    )
+    command.set_defaults(func=rebuild_index)
+
+    command = commands.add_parser(
+        "cleanup", help="Remove old snapshots exceeding the disk budget."
+    )
+    command.add_argument("--max-gb", type=float, help="Snapshots folder budget.")
+    command.add_argument(
+        "--max-days", type=int, help="Remove full resolution images older than this."
+    )
+    command.add_argument(
+        "--thumbnails-max-days",
+        type=int,
+        help="Remove thumbnails and history records older than this.",
+    )
+    command.set_defaults(func=cleanup)
+
+    command = commands.add_parser(
+        "notifications-benchmark",
+        help="Measure email notifications throughput with a local SMTP server.",
+    )
+    command.add_argument("--host", default="localhost", help="SMTP server host.")
+    command.add_argument("--port", type=int, default=8025, help="SMTP server port.")
+    command.add_argument("--num-messages", type=int, default=50)
+    command.add_argument("--num-images", type=int, default=3)
+    command.add_argument("--timeout", type=float, default=300.0)
+    command.set_defaults(func=notifications_benchmark)
+
+    command = commands.add_parser(
+        "webhook-benchmark",
+        help="Measure webhook notifications throughput with a local HTTP server.",
+    )
+    command.add_argument("--num-events", type=int, default=200)
+    command.add_argument(
+        "--num-failures", type=int, default=0, help="Number of rejected requests."
+    )
+    command.add_argument("--timeout", type=float, default=300.0)
+    command.set_defaults(func=webhook_benchmark)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Run camera monitoring without the web UI, using settings saved
+by the web application in the data/settings.yaml file.
+
+Usage:
+    python app/monitor.py --config data/settings.yaml
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from config.config import Config
+from core.history import ensure_events_index
+from core.monitoring import MonitoringEngine, LoggingObserver
+from core.retention import RETENTION_MANAGER
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Headless clever-camera monitoring daemon."
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Config.CONFIG_PATH,
+        help="Path to the settings file saved by the web UI.",
+    )
+    parser.add_argument(
+        "--log-level", default="INFO", help="Python logging level.",
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s::%(levelname)s::%(message)s",
+    )
+    engine = MonitoringEngine.from_config_file(args.config)
+    engine.add_observer(LoggingObserver())
+
+    image, msg = engine.reload_camera_client()
+    if image is None:
+        logging.error(msg)
+        return 1
+    logging.info(msg)
+
+    # rebuild new or outdated index before monitoring saves events
+    ensure_events_index()
+    RETENTION_MANAGER.start()
+    try:
+        if not engine.start(blocking=True):
+            return 1
+    except KeyboardInterrupt:
+        engine.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
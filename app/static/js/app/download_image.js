@@ -1,7 +1,6 @@
-function downloadImage(imageBytes, filename) {
-    let data = `data:image/jpeg;base64,${imageBytes}`;
+function downloadUrl(url, filename) {
     let link = document.createElement('a');
-    link.setAttribute('href', encodeURI(data));
+    link.setAttribute('href', url);
     link.setAttribute('download', filename);
     link.setAttribute('target', "_blank");
     document.body.appendChild(link);
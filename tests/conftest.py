@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# application modules are imported as in app/app.py, e.g. "core.history"
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / "app"))
+
+from config.config import Config  # noqa: E402
+from core.blob_store import BLOB_STORE  # noqa: E402
+from core.day_summary import DAY_SUMMARIES  # noqa: E402
+from core.event_index import EVENTS_INDEX  # noqa: E402
+from core.history import EVENTS_LOG, EVENTS_SEQUENCES  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path, monkeypatch) -> Path:
+    """Redirect snapshots, blobs and events index to the temporary folder"""
+    snapshots_dir = tmp_path / "snapshots"
+    monkeypatch.setattr(Config, "SNAPSHOTS_DIR", snapshots_dir)
+    monkeypatch.setattr(Config, "BLOBS_DIR", snapshots_dir / "blobs")
+    monkeypatch.setattr(BLOB_STORE, "root", snapshots_dir / "blobs")
+    EVENTS_INDEX.close()
+    monkeypatch.setattr(EVENTS_INDEX, "path", tmp_path / "events.db")
+    monkeypatch.setattr(EVENTS_SEQUENCES, "open_sequence", None)
+    monkeypatch.setattr(EVENTS_SEQUENCES, "sequences", {})
+    DAY_SUMMARIES.cache.clear()
+    yield tmp_path
+    EVENTS_LOG.close()
+    EVENTS_INDEX.close()
+    DAY_SUMMARIES.cache.clear()
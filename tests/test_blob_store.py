@@ -0,0 +1,68 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from core.blob_store import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> BlobStore:
+    return BlobStore(tmp_path / "blobs")
+
+
+def test_identical_content_is_written_once(store):
+    first = store.put(b"frame")
+    second = store.put(b"frame")
+    assert first == second
+    assert first.read_bytes() == b"frame"
+    assert store.num_written == 1 and store.num_duplicates == 1
+    assert store.put(b"other frame") != first
+    assert store.num_written == 2
+
+
+def test_blobs_are_sharded_by_digest(store):
+    path = store.put(b"frame", suffix=".png")
+    digest = path.stem
+    assert path.suffix == ".png"
+    assert path.relative_to(store.root).parts == (
+        digest[:2],
+        digest[2:4],
+        f"{digest}.png",
+    )
+    assert list(store.root.rglob("*.tmp")) == []
+
+
+def test_link_shares_blob_content(store, tmp_path):
+    blob_path = store.put(b"frame")
+    target = tmp_path / "frame-0.jpg"
+    store.link(blob_path, target)
+    assert target.read_bytes() == b"frame"
+    assert os.stat(target).st_ino == os.stat(blob_path).st_ino
+    # existing file is kept
+    store.link(store.put(b"other frame"), target)
+    assert target.read_bytes() == b"frame"
+
+
+def test_link_falls_back_to_copy(store, tmp_path, monkeypatch):
+    def fail_link(source: Path, target: Path) -> None:
+        raise OSError("hard links are not supported")
+
+    monkeypatch.setattr(os, "link", fail_link)
+    blob_path = store.put(b"frame")
+    target = tmp_path / "frame-0.jpg"
+    store.link(blob_path, target)
+    assert target.read_bytes() == b"frame"
+    assert os.stat(target).st_ino != os.stat(blob_path).st_ino
+
+
+def test_find_blob_of_linked_file(store, tmp_path):
+    blob_path = store.put(b"frame")
+    target = tmp_path / "frame-0.jpg"
+    store.link(blob_path, target)
+    assert store.find_blob(target) == blob_path
+    assert store.find_blob(blob_path) is None
+    other = tmp_path / "other.jpg"
+    other.write_bytes(b"not stored")
+    assert store.find_blob(other) is None
+    assert store.find_blob(tmp_path / "missing.jpg") is None
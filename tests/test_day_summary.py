@@ -0,0 +1,81 @@
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import PIL.Image
+
+from core.day_summary import DAY_SUMMARIES, SUMMARY_FILENAME, DaySummary
+from core.event_index import format_event_date
+from core.history import (
+    SnapshotEvent,
+    get_day_folder,
+    iter_day_events,
+    load_day_summary,
+    save_frame_events,
+    summarize_days,
+)
+
+DAY = datetime(2020, 5, 10)
+
+
+def make_record(hour: int, labels: List[str], roi_name: str) -> Dict[str, Any]:
+    return {
+        "datetime": format_event_date(DAY.replace(hour=hour)),
+        "labels": labels,
+        "roi_name": roi_name,
+    }
+
+
+def make_summary() -> DaySummary:
+    return DaySummary.from_records(
+        [
+            make_record(8, ["cat"], "door"),
+            make_record(8, ["cat", "Dog"], "garden"),
+            make_record(12, ["dog"], "door"),
+        ]
+    )
+
+
+def save_event(date: datetime, labels: List[str]) -> None:
+    event = SnapshotEvent(
+        labels=labels,
+        labels_filter="*",
+        roi_name="door",
+        camera_name="Home",
+        image_change=0.5,
+    )
+    save_frame_events(PIL.Image.new("RGB", (32, 24)), [event], event_date=date)
+
+
+def test_summary_counts():
+    summary = make_summary()
+    assert summary.num_events == 3
+    assert summary.count_hours() == {8: 2, 12: 1}
+    assert summary.count_rois() == [("door", 2), ("garden", 1)]
+    # labels are counted case-insensitively
+    assert dict(summary.count_labels()) == {"cat": 2, "dog": 2}
+
+
+def test_summary_survives_serialization():
+    summary = make_summary()
+    restored = DaySummary.from_dict(json.loads(json.dumps(summary.to_dict())))
+    assert restored == summary
+
+
+def test_saved_events_update_day_summary(data_dir):
+    for i, labels in enumerate([["cat"], ["Cat", "dog"], ["bird"]]):
+        save_event(DAY.replace(hour=10) + timedelta(minutes=i), labels)
+    DAY_SUMMARIES.cache.clear()
+    summary = load_day_summary(DAY)
+    assert summary == DaySummary.from_records(iter_day_events(DAY))
+    assert dict(summary.count_labels()) == {"cat": 2, "dog": 1, "bird": 1}
+    assert summarize_days(DAY, DAY + timedelta(days=1)) == summary
+
+
+def test_outdated_summary_is_rebuilt(data_dir):
+    save_event(DAY.replace(hour=10), ["cat"])
+    path = get_day_folder(DAY) / SUMMARY_FILENAME
+    path.write_text(json.dumps({"version": 0, "events": [], "labels": []}))
+    DAY_SUMMARIES.cache.clear()
+    assert load_day_summary(DAY).num_events == 1
+    assert json.loads(path.read_text())["version"] != 0
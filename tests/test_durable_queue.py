@@ -0,0 +1,120 @@
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from dataclasses import dataclass
+
+from config.config import Config
+from core.durable_queue import DurableQueue, get_message_id
+
+
+@dataclass(frozen=True)
+class Item:
+    message_id: str
+    created: float
+    num_attempts: int = 0
+    next_attempt: float = 0.0
+
+    @property
+    def item_id(self) -> str:
+        return self.message_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "message_id": self.message_id,
+            "created": self.created,
+            "num_attempts": self.num_attempts,
+            "next_attempt": self.next_attempt,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Item":
+        return cls(**data)
+
+
+class FakeQueue(DurableQueue):
+    channel = "test"
+    item_class = Item
+
+    def __init__(self, queue_dir: Path, **kwargs: Any):
+        super().__init__(queue_dir, max_attempts=3, retry_delay=10.0, **kwargs)
+        self.batches: List[List[str]] = []
+        self.error = None
+
+    def send(self, batch: List[Item], settings: Any) -> None:
+        if self.error is not None:
+            raise self.error
+        self.batches.append([item.item_id for item in batch])
+
+
+def make_item(created: float) -> Item:
+    return Item(message_id=get_message_id(created), created=created)
+
+
+@pytest.fixture
+def queue_dir(tmp_path: Path) -> Path:
+    return tmp_path / "queue"
+
+
+def test_failed_items_are_retried_with_backoff(queue_dir, monkeypatch):
+    monkeypatch.setattr(Config, "NOTIFICATIONS_MAX_RETRY_DELAY", 15.0)
+    queue = FakeQueue(queue_dir)
+    item = make_item(time.time())
+    queue.save(item)
+    queue.error = OSError("connection refused")
+    queue.process([item], settings=None)
+    retried = queue.list_pending()[0]
+    assert retried.num_attempts == 1
+    assert retried.next_attempt == pytest.approx(time.time() + 10.0, abs=1.0)
+    queue.process([retried], settings=None)
+    retried = queue.list_pending()[0]
+    # delay is doubled, but limited to the maximum
+    assert retried.next_attempt == pytest.approx(time.time() + 15.0, abs=1.0)
+    queue.process([retried], settings=None)
+    assert queue.num_pending == 0 and queue.num_dropped == 1
+    assert list(queue_dir.glob("*.json")) == []
+    assert queue.last_error == "connection refused"
+
+
+def test_pending_items_are_loaded_after_restart(queue_dir):
+    queue = FakeQueue(queue_dir)
+    items = [make_item(100.0 + i) for i in range(3)]
+    for item in items[::-1]:
+        queue.save(item)
+    (queue_dir / "invalid.json").write_text("{")
+
+    restarted = FakeQueue(queue_dir)
+    new_item = make_item(200.0)
+    restarted.put(new_item)
+    assert restarted.list_pending() == items + [new_item]
+    assert not (queue_dir / "invalid.json").exists()
+    # items are kept until the channel is configured
+    assert not restarted.flush(timeout=0.1)
+    restarted.set_settings({})
+    assert restarted.flush(timeout=5.0)
+    sent_ids = [item.item_id for item in items + [new_item]]
+    assert sum(restarted.batches, []) == sent_ids
+
+
+def test_queue_is_not_read_after_start(queue_dir, monkeypatch):
+    queue = FakeQueue(queue_dir)
+    queue.load_pending()
+    monkeypatch.setattr(Path, "glob", lambda *args: pytest.fail("queue was read"))
+    queue.save(make_item(100.0))
+    assert queue.num_pending == 1
+    queue.remove(queue.list_pending()[0])
+    assert queue.num_pending == 0
+
+
+def test_background_thread_delivers_batches(queue_dir):
+    queue = FakeQueue(queue_dir, batch_size=2)
+    items = [make_item(time.time() - i) for i in range(3, 0, -1)]
+    for item in items:
+        queue.save(item)
+    queue.set_settings({})
+    queue.start()
+    assert queue.flush(timeout=5.0)
+    assert sum(queue.batches, []) == [item.item_id for item in items]
+    assert queue.num_sent == 3
+    assert list(queue_dir.glob("*.json")) == []
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+import PIL.Image
+import pytest
+
+from core import history
+from core.event_index import EventIndex, EventsQuery, format_event_date
+
+START_DATE = datetime(2020, 5, 10, 12)
+
+
+def make_record(date: datetime, labels: List[str], **fields: Any) -> Dict[str, Any]:
+    record = {
+        "datetime": format_event_date(date),
+        "labels": labels,
+        "camera_name": "Home",
+        "roi_name": "door",
+    }
+    record.update(fields)
+    return record
+
+
+@pytest.fixture
+def index(tmp_path: Path) -> EventIndex:
+    index = EventIndex(tmp_path / "events.db")
+    yield index
+    index.close()
+
+
+def make_query(**kwargs: Any) -> EventsQuery:
+    return EventsQuery(
+        start_date=START_DATE, end_date=START_DATE + timedelta(days=1), **kwargs
+    )
+
+
+def search_all_pages(index: EventIndex, query: EventsQuery, limit: int):
+    pages = []
+    cursor = None
+    while True:
+        records, cursor = index.search(query, cursor=cursor, limit=limit)
+        pages.append([record["event_id"] for record in records])
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_all_events_from_the_most_recent(index):
+    dates = [START_DATE + timedelta(minutes=i) for i in range(7)]
+    event_ids = [index.add_event(make_record(date, ["cat"])) for date in dates]
+    pages = search_all_pages(index, make_query(), limit=3)
+    assert pages == [event_ids[6:3:-1], event_ids[3:0:-1], event_ids[:1]]
+
+
+def test_cursor_separates_events_with_the_same_timestamp(index):
+    # events of several ROIs detected in the same frame
+    event_ids = [
+        index.add_event(make_record(START_DATE, ["cat"], roi_name=f"roi-{i}"))
+        for i in range(5)
+    ]
+    pages = search_all_pages(index, make_query(), limit=2)
+    assert sum(pages, []) == event_ids[::-1]
+    assert [len(page) for page in pages] == [2, 2, 1]
+
+
+def test_last_full_page_has_no_cursor(index):
+    for i in range(4):
+        index.add_event(make_record(START_DATE + timedelta(seconds=i), ["cat"]))
+    records, cursor = index.search(make_query(), limit=4)
+    assert len(records) == 4
+    assert cursor is None
+
+
+def test_pagination_keeps_query_filters(index):
+    for i in range(6):
+        label = "cat" if i % 2 == 0 else "dog"
+        index.add_event(make_record(START_DATE + timedelta(seconds=i), [label]))
+    query = make_query(label="cat")
+    records, cursor = index.search(query)
+    assert len(records) == 3 and cursor is None
+    pages = search_all_pages(index, query, limit=2)
+    assert pages == [
+        [records[0]["event_id"], records[1]["event_id"]],
+        [records[2]["event_id"]],
+    ]
+
+
+def test_labels_are_indexed_in_lower_case(index):
+    index.add_event(make_record(START_DATE, ["Cat"]))
+    index.add_event(make_record(START_DATE + timedelta(seconds=1), ["cat", "DOG"]))
+    records, _ = index.search(make_query(label="CAT"))
+    assert len(records) == 2
+    _, labels_rows = index.get_facets_rows(make_query())
+    assert sorted(label for _, label in labels_rows) == ["cat", "cat", "dog"]
+
+
+def test_saving_events_does_not_rebuild_new_index(data_dir, monkeypatch):
+    def fail_rebuild() -> int:
+        pytest.fail("index was rebuilt by the writer")
+
+    event = history.SnapshotEvent(["cat"], "*", "door", "Home", 0.5)
+    with monkeypatch.context() as patch:
+        patch.setattr(history, "rebuild_events_index", fail_rebuild)
+        image = PIL.Image.new("RGB", (32, 24))
+        history.save_frame_events(image, [event], START_DATE)
+    # the first search rebuilds the index from the events log
+    records, _ = history.search_events(make_query())
+    assert [record["labels"] for record in records] == [["cat"]]
@@ -0,0 +1,97 @@
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+from core.event_index import format_event_date
+from core.history import (
+    EVENTS_LOG_FILENAME,
+    HISTORY_FILENAME,
+    EventLog,
+    get_day_folder,
+    iter_day_events,
+    iter_day_events_reversed,
+    load_day_history,
+    migrate_day_history,
+)
+
+DAY = datetime(2020, 5, 10)
+
+
+def make_records(num_records: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "datetime": format_event_date(DAY + timedelta(seconds=i)),
+            "labels": ["cat"],
+            "roi_name": f"roi-{i}",
+        }
+        for i in range(num_records)
+    ]
+
+
+@pytest.fixture
+def day_folder(data_dir) -> Path:
+    folder = get_day_folder(DAY)
+    folder.mkdir(parents=True)
+    return folder
+
+
+@pytest.fixture
+def events_log() -> EventLog:
+    events_log = EventLog(fsync_every=2, fsync_interval=3600.0)
+    yield events_log
+    events_log.close()
+
+
+def test_records_are_appended_as_json_lines(day_folder, events_log):
+    records = make_records(3)
+    for record in records:
+        events_log.append(day_folder, record)
+    lines = (day_folder / EVENTS_LOG_FILENAME).read_text().splitlines()
+    assert [json.loads(line) for line in lines] == records
+    assert list(iter_day_events(DAY)) == records
+    assert load_day_history(DAY) == records[::-1]
+
+
+def test_incomplete_last_line_is_skipped_and_terminated(day_folder, events_log):
+    records = make_records(2)
+    log_path = day_folder / EVENTS_LOG_FILENAME
+    # record cut by a crash in the middle of the write
+    log_path.write_text(json.dumps(records[0]) + '\n{"datetime": "20')
+    assert list(iter_day_events(DAY)) == records[:1]
+    events_log.append(day_folder, records[1])
+    assert list(iter_day_events(DAY)) == records
+
+
+def test_legacy_history_is_migrated_once(day_folder, events_log):
+    records = make_records(3)
+    (day_folder / HISTORY_FILENAME).write_text(json.dumps(records))
+    assert list(iter_day_events(DAY)) == records
+    assert not (day_folder / HISTORY_FILENAME).exists()
+    assert (day_folder / f"{HISTORY_FILENAME}.migrated").exists()
+    new_record = make_records(4)[-1]
+    events_log.append(day_folder, new_record)
+    migrate_day_history(day_folder)
+    assert list(iter_day_events(DAY)) == records + [new_record]
+
+
+@pytest.mark.parametrize("chunk_size", [16, 100, 1 << 16])
+def test_reverse_reader_crosses_chunks(day_folder, events_log, chunk_size):
+    records = make_records(20)
+    for record in records:
+        events_log.append(day_folder, record)
+    reversed_records = list(iter_day_events_reversed(DAY, chunk_size=chunk_size))
+    assert reversed_records == records[::-1]
+
+
+def test_reverse_reader_reads_legacy_history(day_folder):
+    records = make_records(3)
+    (day_folder / HISTORY_FILENAME).write_text(json.dumps(records))
+    assert list(iter_day_events_reversed(DAY)) == records[::-1]
+
+
+def test_missing_day_has_no_events(data_dir):
+    assert list(iter_day_events(DAY)) == []
+    assert list(iter_day_events_reversed(DAY)) == []
@@ -0,0 +1,74 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.facets import BITS_PER_WORD, EventsColumns
+
+
+def make_columns(
+    events_labels: List[List[str]], rois: Optional[List[str]] = None
+) -> EventsColumns:
+    """Events from the most recent, i-th event has id i and hour i % 24"""
+    rois = rois or ["door"] * len(events_labels)
+    events_rows = [(i, 1000.0 - i, i % 24, roi) for i, roi in enumerate(rois)]
+    labels_rows: List[Tuple[int, str]] = [
+        (i, label) for i, labels in enumerate(events_labels) for label in labels
+    ]
+    return EventsColumns.from_rows(events_rows, labels_rows)
+
+
+def test_label_bits():
+    columns = make_columns([["cat"], ["dog", "cat"], []])
+    assert columns.label_names == ("cat", "dog")
+    assert columns.label_bits.shape == (3, 1)
+    assert columns.label_bits[:, 0].tolist() == [0b01, 0b11, 0b00]
+
+
+def test_labels_span_several_words():
+    labels = [f"label-{i}" for i in range(BITS_PER_WORD + 2)]
+    columns = make_columns([labels[:1], labels[-1:], labels])
+    assert columns.label_bits.shape == (3, 2)
+    mask = columns.get_mask(labels=[labels[-1]])
+    assert mask.tolist() == [False, True, True]
+    counts = dict(columns.count_labels(np.ones(3, dtype=bool)))
+    assert counts[labels[0]] == 2
+    assert counts[labels[-1]] == 2
+    assert counts[labels[1]] == 1
+
+
+def test_mask_selects_any_of_the_labels():
+    columns = make_columns([["cat"], ["dog"], ["bird"], ["cat", "bird"]])
+    mask = columns.get_mask(labels=["cat", "dog"])
+    assert mask.tolist() == [True, True, False, True]
+
+
+def test_mask_ignores_unknown_label():
+    columns = make_columns([["cat"], ["dog"]])
+    assert not columns.get_mask(labels=["fox"]).any()
+    assert columns.get_mask().all()
+
+
+def test_mask_combines_labels_rois_and_hours():
+    columns = make_columns(
+        [["cat"], ["cat"], ["cat"], ["dog"]], rois=["door", "yard", "door", "door"]
+    )
+    mask = columns.get_mask(labels=["cat"], rois=["door"], hours=[2, 3])
+    assert mask.tolist() == [False, False, True, False]
+
+
+def test_counts_from_the_most_common():
+    columns = make_columns(
+        [["cat"], ["dog", "cat"], ["dog"], ["cat"]],
+        rois=["door", "yard", "yard", "yard"],
+    )
+    mask = np.ones(len(columns), dtype=bool)
+    assert columns.count_labels(mask) == [("cat", 3), ("dog", 2)]
+    assert columns.count_rois(mask) == [("yard", 3), ("door", 1)]
+    assert columns.count_hours(mask) == {0: 1, 1: 1, 2: 1, 3: 1}
+    mask[0] = False
+    assert columns.count_labels(mask) == [("cat", 2), ("dog", 2)]
+
+
+def test_mask_label_is_case_insensitive():
+    columns = make_columns([["cat"], ["dog"]])
+    assert columns.get_mask(labels=["Cat"]).tolist() == [True, False]
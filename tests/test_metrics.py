@@ -0,0 +1,81 @@
+import pytest
+
+import core.routes as routes
+from core.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+from test_routes import FakeRequest
+
+
+def test_counter_samples():
+    counter = Counter("frames_total", "Processed frames", ["camera"])
+    counter.inc(camera="Home")
+    counter.inc(2, camera='Garden "west"')
+    assert counter.get(camera="Home") == 1.0
+    assert counter.format_prometheus().split("\n") == [
+        "# HELP clever_camera_frames_total Processed frames",
+        "# TYPE clever_camera_frames_total counter",
+        'clever_camera_frames_total{camera="Garden \\"west\\""} 2.0',
+        'clever_camera_frames_total{camera="Home"} 1.0',
+    ]
+
+
+def test_labels_must_match_label_names():
+    counter = Counter("frames_total", "Processed frames", ["camera"])
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(camera="Home", roi="door")
+
+
+def test_gauge_reads_functions_when_rendered():
+    gauge = Gauge("queue", "Queued items", ["channel"])
+    queue = [1, 2]
+    gauge.set_function(lambda: len(queue), channel="email")
+    gauge.set_function(lambda: 1 / 0, channel="broken")
+    gauge.set(5, channel="webhook")
+    queue.append(3)
+    assert gauge.format_samples() == [
+        'clever_camera_queue{channel="email"} 3.0',
+        'clever_camera_queue{channel="webhook"} 5.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("predict_seconds", "Prediction time", buckets=[0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 3.0]:
+        histogram.observe(value)
+    assert histogram.format_samples() == [
+        'clever_camera_predict_seconds_bucket{le="0.1"} 2',
+        'clever_camera_predict_seconds_bucket{le="1.0"} 3',
+        'clever_camera_predict_seconds_bucket{le="+Inf"} 4',
+        "clever_camera_predict_seconds_sum 3.65",
+        "clever_camera_predict_seconds_count 4",
+    ]
+    assert "n=4" in histogram.format_summary()
+    assert "p95>1000ms" in histogram.format_summary()
+
+
+def test_registry_shares_metrics_by_name():
+    registry = MetricsRegistry()
+    counter = registry.counter("frames_total", "Processed frames")
+    assert registry.counter("frames_total", "Processed frames") is counter
+    with pytest.raises(ValueError):
+        registry.gauge("frames_total", "Processed frames")
+    registry.gauge("a_queue", "Queued items").set(1)
+    text = registry.format_prometheus()
+    assert text.endswith("\n")
+    assert text.index("clever_camera_a_queue") < text.index("frames_total")
+
+
+def test_metrics_route(monkeypatch):
+    registry = MetricsRegistry()
+    registry.counter("frames_total", "Processed frames").inc()
+    monkeypatch.setattr(routes, "METRICS", registry)
+    request = FakeRequest()
+    assert routes.dispatch(request, routes.METRICS_URL)
+    assert request.status == 200
+    assert request.body.getvalue() == registry.format_prometheus().encode()
+    assert (
+        "Content-Type",
+        "text/plain; version=0.0.4; charset=utf-8",
+    ) in request.headers
@@ -0,0 +1,96 @@
+from typing import List
+
+import pytest
+
+from core.history import EventsSequence
+from core.notification_policy import NotificationPolicy, TokenBucket
+
+
+def make_bucket(capacity: int, period: float, now: float = 0.0) -> TokenBucket:
+    bucket = TokenBucket(capacity, period)
+    bucket.last_update = now
+    return bucket
+
+
+def make_sequence(sequence_id: int, labels: List[str]) -> EventsSequence:
+    return EventsSequence(sequence_id=sequence_id, labels=labels)
+
+
+def test_bucket_allows_burst_of_capacity():
+    bucket = make_bucket(capacity=3, period=10.0)
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_one_token_per_period():
+    bucket = make_bucket(capacity=2, period=10.0)
+    assert bucket.take(0.0) and bucket.take(0.0)
+    assert not bucket.take(9.0)
+    assert bucket.tokens == pytest.approx(0.9)
+    assert bucket.take(10.0)
+    assert not bucket.take(10.0)
+
+
+def test_bucket_refill_is_limited_to_capacity():
+    bucket = make_bucket(capacity=2, period=1.0)
+    bucket.take(0.0)
+    bucket.refill(1000.0)
+    assert bucket.tokens == 2.0
+
+
+def test_bucket_ignores_clock_going_back():
+    bucket = make_bucket(capacity=1, period=1.0, now=10.0)
+    assert bucket.take(10.0)
+    assert not bucket.take(5.0)
+    assert bucket.tokens == 0.0
+
+
+def test_bucket_without_period_is_unlimited():
+    bucket = make_bucket(capacity=1, period=0.0)
+    assert all(bucket.take(0.0) for _ in range(10))
+
+
+@pytest.fixture
+def policy(monkeypatch) -> NotificationPolicy:
+    policy = NotificationPolicy(
+        burst=2, label_burst=1, label_period=3600.0, digest_period=3600.0
+    )
+    policy.add_channel("email", 3600.0, lambda channel, entries: None)
+    # sequences have no thumbnails, digest timer is not needed
+    monkeypatch.setattr(policy, "add_to_digest", lambda channel, sequence: None)
+    return policy
+
+
+def test_policy_limits_every_label(policy):
+    assert policy.allow("email", make_sequence(1, ["cat"]))
+    assert not policy.allow("email", make_sequence(2, ["cat"]))
+    assert policy.allow("email", make_sequence(3, ["cat", "dog"]))
+    assert policy.num_sent["email"] == 2
+    assert policy.num_suppressed["email"] == 1
+    assert policy.suppressed_labels["email"]["cat"] == 1
+
+
+def test_policy_takes_only_first_available_label_token(policy):
+    assert policy.allow("email", make_sequence(1, ["cat", "dog"]))
+    # dog token was not used by the first sequence
+    assert policy.allow("email", make_sequence(2, ["dog"]))
+    assert policy.label_buckets["email"]["cat"].tokens < 1.0
+    assert policy.label_buckets["email"]["dog"].tokens < 1.0
+
+
+def test_policy_keeps_channels_separate(policy):
+    policy.add_channel("webhook", 3600.0, lambda channel, entries: None)
+    assert policy.allow("email", make_sequence(1, ["cat"]))
+    assert not policy.allow("email", make_sequence(2, ["cat"]))
+    assert policy.allow("webhook", make_sequence(2, ["cat"]))
+    assert policy.suppressed_labels.get("webhook") is None
+    assert policy.num_suppressed == {"email": 1}
+    assert "email: " in policy.format_stats()
+    assert "most suppressed: cat=1" in policy.format_stats().split(";")[0]
+
+
+def test_policy_limits_channel(policy):
+    assert policy.allow("email", make_sequence(1, ["cat"]))
+    assert policy.allow("email", make_sequence(2, ["dog"]))
+    assert not policy.allow("email", make_sequence(3, ["bird"]))
+    # label token is not consumed when channel has no token
+    assert policy.label_buckets["email"].get("bird") is None
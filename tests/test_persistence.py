@@ -0,0 +1,122 @@
+import threading
+import time
+from datetime import datetime
+from typing import Any, List
+
+import PIL.Image
+import pytest
+
+from core import persistence
+from core.camera_client import CameraFrame
+from core.history import SnapshotEvent, iter_day_events
+from core.persistence import SnapshotWriter
+
+DATE = datetime(2020, 5, 10, 12)
+
+
+def make_frame(frame_id: int) -> CameraFrame:
+    return CameraFrame(
+        image=PIL.Image.new("RGB", (32, 24)),
+        frame_id=frame_id,
+        timestamp=time.monotonic(),
+        date=DATE.replace(second=frame_id),
+    )
+
+
+def make_event() -> SnapshotEvent:
+    return SnapshotEvent(
+        labels=["cat"],
+        labels_filter="*",
+        roi_name="door",
+        camera_name="Home",
+        image_change=0.5,
+    )
+
+
+@pytest.fixture
+def saved_frames(monkeypatch) -> List[int]:
+    """Frame ids saved by the fake save_frame_events, slower for lower ids"""
+    saved = []
+    lock = threading.Lock()
+
+    def save_frame_events(image: Any, events: Any, event_date: datetime, **kwargs):
+        time.sleep(0.01 * (5 - event_date.second % 5))
+        with lock:
+            saved.append(event_date.second)
+        return []
+
+    monkeypatch.setattr(persistence, "save_frame_events", save_frame_events)
+    return saved
+
+
+def test_callback_waits_for_all_previous_jobs(saved_frames):
+    writer = SnapshotWriter(num_workers=3, max_queue_size=10)
+    called = []
+    for frame_id in range(5):
+        writer.submit(make_frame(frame_id), [make_event()])
+    writer.call_when_written(lambda: called.append(sorted(saved_frames)))
+    writer.submit(make_frame(5), [make_event()])
+    writer.flush()
+    assert called == [[0, 1, 2, 3, 4]]
+    assert writer.num_written == 6
+
+
+def test_full_queue_blocks_submit(monkeypatch):
+    gate = threading.Event()
+    monkeypatch.setattr(
+        persistence, "save_frame_events", lambda *args, **kwargs: gate.wait(5.0)
+    )
+    writer = SnapshotWriter(num_workers=1, max_queue_size=1)
+    # first job is taken by the worker, second one fills the queue
+    writer.submit(make_frame(0), [make_event()])
+    writer.submit(make_frame(1), [make_event()])
+    submitted = threading.Thread(
+        target=writer.submit, args=(make_frame(2), [make_event()])
+    )
+    submitted.start()
+    submitted.join(0.1)
+    assert submitted.is_alive()
+    gate.set()
+    submitted.join(5.0)
+    writer.flush()
+    assert writer.num_blocked >= 1
+    assert writer.num_written == 3
+
+
+def test_failed_write_is_counted(monkeypatch):
+    def fail(*args: Any, **kwargs: Any) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(persistence, "save_frame_events", fail)
+    writer = SnapshotWriter(num_workers=1)
+    writer.submit(make_frame(0), [make_event()])
+    writer.flush()
+    assert writer.num_failed == 1 and writer.num_written == 0
+
+
+def test_frames_are_saved_to_events_log(data_dir):
+    writer = SnapshotWriter(num_workers=2)
+    for frame_id in range(3):
+        writer.submit(make_frame(frame_id), [make_event(), make_event()])
+    writer.flush()
+    records = list(iter_day_events(DATE))
+    assert len(records) == 6
+    # frame is saved once for all its events
+    frames_images = {}
+    for record in records:
+        frames_images.setdefault(record["datetime"], set()).add(record["image_path"])
+    assert len(frames_images) == 3
+    assert all(len(images) == 1 for images in frames_images.values())
+
+
+def test_sequence_frames_are_linked_into_sequence_folder(data_dir):
+    writer = SnapshotWriter(num_workers=1)
+    sequence_dir = data_dir / "sequence"
+    frames = [("frame-0.jpg", b"jpeg-0"), ("frame-1.jpg", b"jpeg-0")]
+    writer.submit_frames(frames, sequence_dir)
+    writer.flush()
+    assert sorted(path.name for path in sequence_dir.iterdir()) == [
+        "frame-0.jpg",
+        "frame-1.jpg",
+    ]
+    assert writer.num_frames_written == 2
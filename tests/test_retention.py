@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import PIL.Image
+import pytest
+
+from config.config import Config
+from core.frame_buffer import get_sequence_dir
+from core.history import SnapshotEvent, encode_jpeg, list_days, save_frame_events
+from core.persistence import SNAPSHOT_WRITER
+from core.retention import RetentionManager, measure_usage
+
+
+def make_jpeg(seed: int) -> bytes:
+    """Unique camera frame, noise does not compress to a few bytes"""
+    image = PIL.Image.effect_noise((320, 240), 50 + seed).convert("RGB")
+    return encode_jpeg(image)
+
+
+def make_event() -> SnapshotEvent:
+    return SnapshotEvent(
+        labels=["person"],
+        labels_filter="*",
+        roi_name="door",
+        camera_name="Home",
+        image_change=0.5,
+    )
+
+
+def save_day(date: datetime, num_pre_event_frames: int = 4) -> None:
+    """Day with one events sequence: pre-event frames and one event frame"""
+    sequence_dir = get_sequence_dir(date)
+    frames = [
+        (f"frame-{i}.jpg", make_jpeg(date.day * 10 + i))
+        for i in range(num_pre_event_frames)
+    ]
+    event_jpeg = make_jpeg(date.day * 10 + 9)
+    frames.append(("frame-event.jpg", event_jpeg))
+    SNAPSHOT_WRITER.submit_frames(frames, sequence_dir)
+    SNAPSHOT_WRITER.flush()
+    save_frame_events(
+        PIL.Image.new("RGB", (320, 240)),
+        [make_event()],
+        event_date=date,
+        jpeg_bytes=event_jpeg,
+        sequence_dir=sequence_dir,
+    )
+
+
+@pytest.fixture
+def manager(monkeypatch) -> RetentionManager:
+    monkeypatch.setattr(Config, "RETENTION_BATCH_PAUSE", 0.0)
+    return RetentionManager(max_bytes=None, max_days=None, thumbnails_max_days=None)
+
+
+def test_remove_day_reclaims_sequence_blobs(data_dir, manager):
+    day = datetime(2020, 5, 10)
+    save_day(day.replace(hour=12))
+    usage = measure_usage(Config.SNAPSHOTS_DIR)
+
+    manager.remove_day(day)
+
+    assert list_days() == []
+    assert measure_usage(Config.SNAPSHOTS_DIR) < 0.01 * usage
+    assert manager._reclaimed_bytes == pytest.approx(usage, rel=0.01)
+
+
+def test_evict_day_images_removes_pre_event_blobs(data_dir, manager):
+    day = datetime(2020, 5, 10)
+    save_day(day.replace(hour=12))
+    usage = measure_usage(Config.SNAPSHOTS_DIR)
+
+    assert manager.evict_day_images(day)
+    assert not manager.evict_day_images(day)
+
+    remaining = measure_usage(Config.SNAPSHOTS_DIR)
+    assert usage - remaining == manager._reclaimed_bytes
+    blobs = [p for p in Config.BLOBS_DIR.rglob("*.jpg")]
+    # only the thumbnail is left
+    assert len(blobs) == 1
+
+
+def test_sequence_crossing_midnight_keeps_next_day_image(data_dir, manager):
+    day = datetime(2020, 5, 10)
+    next_day = day + timedelta(days=1)
+    sequence_dir = get_sequence_dir(day.replace(hour=23, minute=59))
+    jpeg = make_jpeg(1)
+    SNAPSHOT_WRITER.submit_frames([("frame-0.jpg", jpeg)], sequence_dir)
+    SNAPSHOT_WRITER.flush()
+    records = save_frame_events(
+        PIL.Image.new("RGB", (320, 240)),
+        [make_event()],
+        event_date=next_day,
+        jpeg_bytes=jpeg,
+        sequence_dir=sequence_dir,
+    )
+
+    manager.evict_day_images(day)
+
+    assert not any(sequence_dir.iterdir())
+    assert Path(records[0]["image_path"]).exists()
+
+
+def test_enforce_evicts_images_of_oldest_days_first(data_dir, manager):
+    days = [datetime(2020, 5, d) for d in (10, 11, 12)]
+    for day in days:
+        save_day(day.replace(hour=12), num_pre_event_frames=2)
+    usage = measure_usage(Config.SNAPSHOTS_DIR)
+    # images of a single day are enough to meet the budget
+    manager.max_bytes = usage - 1
+
+    report = manager.enforce()
+
+    assert report.num_evicted_days == 1
+    assert report.num_removed_days == 0
+    assert report.usage_bytes - report.reclaimed_bytes <= manager.max_bytes
+    folders = [Config.SNAPSHOTS_DIR / f"{d:%Y-%m-%d}" for d in days]
+    assert list(folders[0].glob("sequence-*/*")) == []
+    assert len(list(folders[1].glob("sequence-*/*"))) == 3
+    assert list_days() == days
+
+
+def test_retention_without_limits_keeps_everything(data_dir, manager):
+    days = [datetime(2019, 5, d) for d in (10, 11)]
+    for day in days:
+        save_day(day.replace(hour=12), num_pre_event_frames=1)
+
+    assert not manager.is_enabled
+    report = manager.enforce()
+
+    assert report.num_removed_files == 0
+    assert list_days() == days
+    manager.start()
+    assert manager._thread is None
@@ -0,0 +1,163 @@
+import threading
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import PIL.Image
+import pytest
+
+import core.routes as routes
+from core.event_index import EventsQuery
+from core.history import SnapshotEvent, encode_jpeg, save_frame_events, search_events
+from core.preview import PreviewStream
+
+
+class FakeRequest:
+    """Request handler writing the response to memory"""
+
+    def __init__(self, fail_after_writes: Optional[int] = None):
+        self.status: Optional[int] = None
+        self.headers: List[Tuple[str, str]] = []
+        self.body = BytesIO()
+        self.num_writes = 0
+        self.fail_after_writes = fail_after_writes
+        self.close_connection = False
+        self.wfile = self
+
+    def send_response(self, code: int) -> None:
+        self.status = code
+
+    def send_header(self, name: str, value: str) -> None:
+        self.headers.append((name, value))
+
+    def end_headers(self) -> None:
+        pass
+
+    def write(self, data: bytes) -> int:
+        if self.fail_after_writes is not None:
+            if self.num_writes >= self.fail_after_writes:
+                raise BrokenPipeError()
+        self.num_writes += 1
+        return self.body.write(data)
+
+    def flush(self) -> None:
+        pass
+
+
+@pytest.fixture
+def preview_stream(monkeypatch) -> PreviewStream:
+    stream = PreviewStream()
+    monkeypatch.setattr(routes, "PREVIEW_STREAM", stream)
+    monkeypatch.setattr(routes, "PREVIEW_WAIT_TIMEOUT", 0.01)
+    return stream
+
+
+def serve_stream(request: FakeRequest, params: Dict[str, str]) -> threading.Thread:
+    thread = threading.Thread(
+        target=routes.serve_preview_stream,
+        args=(request, routes.PREVIEW_STREAM_URL, params),
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def test_disconnected_viewer_is_removed_without_new_previews(preview_stream):
+    preview_stream.publish(PIL.Image.new("RGB", (64, 48)))
+    # the first preview is sent, the heartbeat fails
+    request = FakeRequest(fail_after_writes=1)
+    thread = serve_stream(request, {"tier": "small"})
+    thread.join(timeout=2)
+
+    assert not thread.is_alive()
+    assert preview_stream.num_viewers == 0
+    assert b"Content-Type: image/jpeg" in request.body.getvalue()
+
+
+def test_viewer_waiting_for_the_first_preview_is_removed(preview_stream):
+    thread = serve_stream(FakeRequest(fail_after_writes=0), {"tier": "small"})
+    thread.join(timeout=2)
+
+    assert not thread.is_alive()
+    assert preview_stream.num_viewers == 0
+
+
+def test_closed_stream_finishes_viewers(preview_stream):
+    request = FakeRequest()
+    thread = serve_stream(request, {"tier": "small"})
+    preview_stream.publish(PIL.Image.new("RGB", (64, 48)))
+    preview_stream.close()
+    thread.join(timeout=2)
+
+    assert not thread.is_alive()
+    assert preview_stream.num_viewers == 0
+    assert request.status == 200
+
+
+def test_unknown_tier_is_rejected(preview_stream):
+    request = FakeRequest()
+    routes.serve_preview_stream(request, routes.PREVIEW_STREAM_URL, {"tier": "xl"})
+    assert request.status == 404
+
+
+def read_zip(request: FakeRequest) -> zipfile.ZipFile:
+    return zipfile.ZipFile(BytesIO(request.body.getvalue()))
+
+
+def test_zip_is_streamed_without_missing_files(tmp_path):
+    files = []
+    for i in range(3):
+        path = tmp_path / f"image-{i}.jpg"
+        path.write_bytes(bytes([i]) * (routes.CHUNK_SIZE + 10))
+        files.append((path, f"event-{i}.jpg"))
+    files.insert(1, (tmp_path / "removed.jpg", "removed.jpg"))
+    request = FakeRequest()
+    routes.stream_zip(request, files, "events.zip")
+
+    assert request.status == 200
+    assert ("Content-Type", "application/zip") in request.headers
+    assert request.close_connection
+    # response is written in chunks, not as a single buffer
+    assert request.num_writes > 3
+    with read_zip(request) as archive:
+        assert archive.namelist() == ["event-0.jpg", "event-1.jpg", "event-2.jpg"]
+        assert archive.read("event-2.jpg") == files[3][0].read_bytes()
+        assert all(
+            info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()
+        )
+
+
+def test_download_contains_frame_image_once(data_dir):
+    date = datetime(2020, 5, 10, 12)
+    image = PIL.Image.new("RGB", (32, 24))
+    events = [
+        SnapshotEvent(["cat"], "*", roi_name, "Home", 0.5)
+        for roi_name in ["door", "garden"]
+    ]
+    save_frame_events(image, events, event_date=date, jpeg_bytes=encode_jpeg(image))
+    query = EventsQuery(start_date=date, end_date=date.replace(hour=13))
+    records, _ = search_events(query)
+    url = routes.DOWNLOADS.register(
+        [record["event_id"] for record in records], "events.zip"
+    )
+
+    request = FakeRequest()
+    assert routes.dispatch(request, url)
+    with read_zip(request) as archive:
+        assert archive.namelist() == ["image-2020-05-10_12-00-00.000.jpg"]
+
+
+def test_unknown_download_is_rejected():
+    request = FakeRequest()
+    assert routes.dispatch(request, routes.DOWNLOADS_URL + "unknown")
+    assert request.status == 404
+
+
+def test_download_link_expires(monkeypatch):
+    registry = routes.DownloadsRegistry(max_age=60.0)
+    token = registry.register([1, 2], "events.zip").split("/")[-1]
+    assert registry.get(token) == ([1, 2], "events.zip")
+    now = routes.time.monotonic()
+    monkeypatch.setattr(routes.time, "monotonic", lambda: now + 61.0)
+    assert registry.get(token) is None
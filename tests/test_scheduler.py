@@ -0,0 +1,115 @@
+from typing import List
+
+import pytest
+
+from core.scheduler import MIN_PERIOD, DeadlineScheduler
+
+
+class FakeClock:
+    """Monotonic clock advanced by the scheduler sleeps and the test"""
+
+    def __init__(self, now: float = 100.0):
+        self.now = now
+        self.sleeps: List[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_scheduler(clock: FakeClock, period: float = 1.0, **kwargs):
+    return DeadlineScheduler(period, clock=clock, sleep_fn=clock.sleep, **kwargs)
+
+
+def test_wait_sleeps_until_absolute_deadlines():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.start()
+    for processing_time in [0.2, 0.7, 0.0]:
+        clock.now += processing_time
+        assert scheduler.wait() == 0.0
+    # processing time does not shift the deadlines t0 + k * period
+    assert clock.sleeps == pytest.approx([0.8, 0.3, 1.0])
+    assert clock.now == pytest.approx(103.0)
+    assert scheduler.num_skipped_ticks == 0
+
+
+def test_overrun_skips_missed_ticks():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.start()
+    clock.now += 3.5
+    lateness = scheduler.wait()
+    # deadlines 101 and 102 were missed, tick is realigned to 103
+    assert lateness == pytest.approx(0.5)
+    assert scheduler.num_skipped_ticks == 2
+    assert scheduler.next_deadline == pytest.approx(103.0)
+    assert clock.sleeps == []
+    # the next tick keeps the original phase
+    scheduler.wait()
+    assert clock.now == pytest.approx(104.0)
+    assert scheduler.max_lateness == pytest.approx(0.5)
+    assert scheduler.lateness == 0.0
+
+
+def test_tick_exactly_on_deadline_is_not_skipped():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.start()
+    clock.now += 1.0
+    assert scheduler.wait() == 0.0
+    assert scheduler.num_skipped_ticks == 0
+
+
+def test_period_is_limited_to_minimum():
+    scheduler = make_scheduler(FakeClock(), period=0.0)
+    assert scheduler.period == MIN_PERIOD
+    assert scheduler.max_frame_age == 2 * MIN_PERIOD
+
+
+def test_duplicate_frame_is_stale():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    assert not scheduler.is_frame_stale(1, clock.now)
+    assert scheduler.is_frame_stale(1, clock.now)
+    assert not scheduler.is_frame_stale(2, clock.now)
+    assert scheduler.num_stale_frames == 1
+
+
+def test_old_frame_is_stale():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, max_frame_age=1.5)
+    assert not scheduler.is_frame_stale(1, clock.now - 1.5)
+    assert scheduler.is_frame_stale(2, clock.now - 1.6)
+    assert scheduler.num_stale_frames == 1
+
+
+def test_achieved_fps():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, period=0.5)
+    scheduler.start()
+    for _ in range(4):
+        scheduler.wait()
+    assert scheduler.achieved_fps == pytest.approx(2.0)
+    assert scheduler.configured_fps == pytest.approx(2.0)
+
+
+def test_changed_period_applies_to_next_deadline():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    scheduler.start()
+    scheduler.wait()
+    scheduler.set_period(0.5)
+    scheduler.wait()
+    assert clock.sleeps == pytest.approx([1.0, 0.5])
+    assert scheduler.max_frame_age == pytest.approx(1.0)
+    assert scheduler.configured_fps == pytest.approx(2.0)
+
+
+def test_changed_period_keeps_explicit_frame_age():
+    scheduler = make_scheduler(FakeClock(), max_frame_age=1.5)
+    scheduler.set_period(2.0)
+    assert scheduler.max_frame_age == 1.5
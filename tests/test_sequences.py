@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from typing import List
+
+import PIL.Image
+
+from core.history import (
+    EVENTS_SEQUENCES,
+    EventsSequenceTracker,
+    SnapshotEvent,
+    get_sequence_id,
+    save_frame_events,
+)
+
+START_DATE = datetime(2020, 5, 10, 12)
+
+
+def make_event(roi_name: str = "door") -> SnapshotEvent:
+    return SnapshotEvent(
+        labels=["cat"],
+        labels_filter="*",
+        roi_name=roi_name,
+        camera_name="Home",
+        image_change=0.5,
+    )
+
+
+def save_frame(date: datetime, events: List[SnapshotEvent], **kwargs):
+    return save_frame_events(
+        PIL.Image.new("RGB", (32, 24)), events, event_date=date, **kwargs
+    )
+
+
+def test_frames_are_grouped_by_events_separation():
+    tracker = EventsSequenceTracker()
+    first_id, is_start = tracker.add_frame(START_DATE)
+    assert first_id == get_sequence_id(START_DATE) and is_start
+    assert tracker.add_frame(START_DATE + timedelta(seconds=3)) == (first_id, False)
+    assert tracker.close_if_finished(START_DATE + timedelta(seconds=5)) is None
+    closed = tracker.close_if_finished(START_DATE + timedelta(seconds=9))
+    assert closed.sequence_id == first_id and closed.num_frames == 2
+    next_id, is_start = tracker.add_frame(START_DATE + timedelta(seconds=9))
+    assert next_id != first_id and is_start
+
+
+def test_sequence_is_split_by_maximum_length():
+    tracker = EventsSequenceTracker()
+    first_id, _ = tracker.add_frame(START_DATE, max_sequence_length=4.0)
+    tracker.add_frame(START_DATE + timedelta(seconds=3), max_sequence_length=4.0)
+    next_id, is_start = tracker.add_frame(
+        START_DATE + timedelta(seconds=6), max_sequence_length=4.0
+    )
+    assert next_id != first_id and is_start
+
+
+def test_records_are_stamped_with_assigned_sequence():
+    tracker = EventsSequenceTracker()
+    records = [{"labels": ["cat"]}, {"labels": ["dog"]}]
+    tracker.add_records(records, 1000, sequence_start=True)
+    tracker.add_records([{"labels": ["cat"]}], 1000, sequence_start=False)
+    assert [record["sequence_start"] for record in records] == [True, False]
+    assert all(record["sequence_id"] == 1000 for record in records)
+    sequence = tracker.finish(1000)
+    assert sequence.sequence_id == 1000
+    assert len(sequence.records) == 3
+    assert sequence.labels == ["cat", "dog"]
+    assert 1000 not in tracker.sequences
+
+
+def test_oldest_unfinished_sequences_are_dropped():
+    tracker = EventsSequenceTracker(max_sequences=2)
+    for sequence_id in [1, 2, 3]:
+        tracker.add_records([{"labels": []}], sequence_id, sequence_start=True)
+    assert sorted(tracker.sequences) == [2, 3]
+
+
+def test_saved_records_get_monitor_sequence(data_dir):
+    sequence_id, _ = EVENTS_SEQUENCES.add_frame(START_DATE)
+    first = save_frame(
+        START_DATE,
+        [make_event("door"), make_event("window")],
+        sequence_id=sequence_id,
+        sequence_start=True,
+    )
+    date = START_DATE + timedelta(seconds=2)
+    assert EVENTS_SEQUENCES.add_frame(date) == (sequence_id, False)
+    second = save_frame(date, [make_event()], sequence_id=sequence_id)
+    closed = EVENTS_SEQUENCES.close()
+    assert closed.sequence_id == sequence_id and closed.num_frames == 2
+    sequence = EVENTS_SEQUENCES.finish(sequence_id)
+    assert sequence.records == first + second
+    assert [record["sequence_start"] for record in sequence.records] == [
+        True,
+        False,
+        False,
+    ]
+
+
+def test_untracked_sequence_is_read_from_events_log(data_dir):
+    # sequence saved before restart
+    sequence_id, _ = EVENTS_SEQUENCES.add_frame(START_DATE)
+    records = save_frame(START_DATE, [make_event()], sequence_id=sequence_id)
+    EVENTS_SEQUENCES.sequences.clear()
+    sequence = EVENTS_SEQUENCES.finish(sequence_id)
+    assert sequence is not None
+    assert [record["datetime"] for record in sequence.records] == [
+        record["datetime"] for record in records
+    ]
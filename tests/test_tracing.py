@@ -0,0 +1,82 @@
+import json
+import threading
+
+import core.routes as routes
+from core.tracing import NULL_SPAN, Tracer
+
+from test_routes import FakeRequest
+
+
+def get_spans(tracer: Tracer):
+    events = tracer.to_chrome_trace()["traceEvents"]
+    return [event for event in events if event["ph"] == "X"]
+
+
+def test_disabled_tracer_returns_null_span():
+    tracer = Tracer(max_spans=10, enabled=False)
+    with tracer.span("predict", frame_id=1) as span:
+        pass
+    assert span is NULL_SPAN
+    assert tracer.num_spans == 0
+
+
+def test_spans_are_exported_as_complete_events():
+    tracer = Tracer(max_spans=10, enabled=True)
+    with tracer.span("predict", frame_id=1, camera="Home"):
+        with tracer.span("preprocess", frame_id=1):
+            pass
+    spans = get_spans(tracer)
+    # inner span ends first
+    assert [span["name"] for span in spans] == ["preprocess", "predict"]
+    inner, outer = spans
+    assert outer["args"] == {"frame_id": 1, "camera": "Home"}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"] + 0.1
+    assert all(span["dur"] >= 0 for span in spans)
+    assert inner["tid"] == threading.get_ident()
+
+
+def test_thread_names_are_exported_as_metadata():
+    tracer = Tracer(max_spans=10, enabled=True)
+
+    def run() -> None:
+        with tracer.span("save_frame_events"):
+            pass
+
+    thread = threading.Thread(target=run, name="snapshot-writer")
+    thread.start()
+    thread.join()
+    metadata = [
+        event
+        for event in tracer.to_chrome_trace()["traceEvents"]
+        if event["ph"] == "M"
+    ]
+    assert metadata[0]["name"] == "thread_name"
+    assert metadata[0]["args"] == {"name": "snapshot-writer"}
+    assert metadata[0]["tid"] == get_spans(tracer)[0]["tid"]
+
+
+def test_only_most_recent_spans_are_kept():
+    tracer = Tracer(max_spans=3, enabled=True)
+    for i in range(5):
+        with tracer.span("tick", index=i):
+            pass
+    assert [span["args"]["index"] for span in get_spans(tracer)] == [2, 3, 4]
+    assert tracer.num_spans == 5
+    assert tracer.format_stats() == "enabled, buffered=3/3, total=5"
+    tracer.clear()
+    assert get_spans(tracer) == []
+
+
+def test_trace_route_downloads_json(monkeypatch):
+    tracer = Tracer(max_spans=10, enabled=True)
+    with tracer.span("predict", roi=object()):
+        pass
+    monkeypatch.setattr(routes, "TRACER", tracer)
+    request = FakeRequest()
+    assert routes.dispatch(request, routes.TRACE_URL)
+    assert request.status == 200
+    trace = json.loads(request.body.getvalue())
+    assert trace["displayTimeUnit"] == "ms"
+    # values which are not JSON serializable are exported as strings
+    assert isinstance(trace["traceEvents"][-1]["args"]["roi"], str)
@@ -0,0 +1,93 @@
+import threading
+from typing import Any, List, Tuple
+
+from core.ui_updates import UIUpdateBus
+
+
+class Widget:
+    def __init__(self, name: str, applied: List[Tuple[str, Any]]):
+        self.name = name
+        self.applied = applied
+
+    def set_text(self, text: str) -> None:
+        self.applied.append((self.name, text))
+
+
+def test_only_latest_update_is_applied():
+    bus = UIUpdateBus(period=0.0, max_updates=10)
+    applied = []
+    widget = Widget("status", applied)
+    for i in range(5):
+        bus.post(widget, "text", widget.set_text, f"frame {i}")
+    assert bus.num_pending == 1
+    assert bus.flush() == 1
+    assert applied == [("status", "frame 4")]
+    assert bus.num_posted == 5 and bus.num_dropped == 4 and bus.num_applied == 1
+
+
+def test_updates_keep_the_order_of_the_first_post():
+    bus = UIUpdateBus(period=0.0, max_updates=10)
+    applied = []
+    first, second = Widget("first", applied), Widget("second", applied)
+    bus.post(first, "text", first.set_text, "a")
+    bus.post(second, "text", second.set_text, "b")
+    bus.post(first, "text", first.set_text, "c")
+    bus.flush()
+    assert applied == [("first", "c"), ("second", "b")]
+
+
+def test_different_names_are_not_coalesced():
+    bus = UIUpdateBus(period=0.0, max_updates=10)
+    applied = []
+    widget = Widget("status", applied)
+    bus.post(widget, "text", widget.set_text, "a")
+    bus.post(widget, "icon", widget.set_text, "b")
+    assert bus.flush() == 2
+
+
+def test_flush_is_rate_limited():
+    bus = UIUpdateBus(period=3600.0, max_updates=2)
+    applied = []
+    widgets = [Widget(str(i), applied) for i in range(3)]
+    for widget in widgets:
+        bus.post(widget, "text", widget.set_text, "x")
+    assert bus.flush() == 2
+    # the next flush waits for the period
+    assert bus.flush() == 0
+    assert bus.num_pending == 1
+    assert bus.flush(force=True) == 1
+    assert [name for name, _ in applied] == ["0", "1", "2"]
+
+
+def test_failed_update_does_not_stop_flush():
+    bus = UIUpdateBus(period=0.0, max_updates=10)
+    applied = []
+    widget = Widget("status", applied)
+
+    def fail() -> None:
+        raise ValueError("widget removed")
+
+    bus.post(object(), "text", fail)
+    bus.post(widget, "text", widget.set_text, "ok")
+    assert bus.flush() == 2
+    assert applied == [("status", "ok")]
+
+
+def test_posts_from_background_threads():
+    bus = UIUpdateBus(period=0.0, max_updates=100)
+    applied = []
+    widgets = [Widget(str(i), applied) for i in range(4)]
+
+    def post_updates(widget: Widget) -> None:
+        for i in range(100):
+            bus.post(widget, "text", widget.set_text, i)
+
+    threads = [threading.Thread(target=post_updates, args=(w,)) for w in widgets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    bus.flush(force=True)
+    assert sorted(applied) == [(widget.name, 99) for widget in widgets]
+    assert bus.num_posted == 400
+    assert bus.num_dropped == 396
@@ -0,0 +1,115 @@
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+import requests
+
+from config.config import Config
+from core.history import EventsSequence
+from core.webhooks import WebhookNotifier, WebhookSettings, build_sequence_payload
+
+SETTINGS = WebhookSettings(
+    url="http://hooks.local/events", token="secret", public_url="http://camera"
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class FakeSession:
+    def __init__(self, status_codes: List[int]):
+        self.status_codes = status_codes
+        self.requests: List[Dict[str, Any]] = []
+
+    def post(self, url: str, json: Any, headers: Dict[str, str], timeout: float):
+        self.requests.append({"url": url, "json": json, "headers": headers})
+        status_code = self.status_codes.pop(0) if self.status_codes else 200
+        return FakeResponse(status_code)
+
+
+@pytest.fixture(autouse=True)
+def short_retry_delay(monkeypatch):
+    monkeypatch.setattr(Config, "NOTIFICATIONS_MAX_RETRY_DELAY", 0.05)
+
+
+def make_notifier(queue_dir: Path, status_codes: List[int]) -> WebhookNotifier:
+    notifier = WebhookNotifier(
+        queue_dir, batch_size=2, batch_delay=0.0, max_attempts=3, retry_delay=0.01
+    )
+    notifier.session = FakeSession(status_codes)
+    return notifier
+
+
+def posted_ids(notifier: WebhookNotifier) -> List[List[int]]:
+    return [
+        [payload["id"] for payload in request["json"]["events"]]
+        for request in notifier.session.requests
+    ]
+
+
+def test_events_are_posted_in_batches(tmp_path):
+    notifier = make_notifier(tmp_path, [])
+    for i in range(3):
+        notifier.submit({"id": i})
+    notifier.set_settings(SETTINGS)
+    assert notifier.flush(timeout=5.0)
+    assert posted_ids(notifier) == [[0, 1], [2]]
+    request = notifier.session.requests[0]
+    assert request["url"] == SETTINGS.url
+    assert request["headers"] == {"Authorization": "Bearer secret"}
+    assert notifier.num_sent == 3 and notifier.num_requests == 2
+
+
+def test_events_wait_for_webhook_url(tmp_path):
+    notifier = make_notifier(tmp_path, [])
+    notifier.set_settings(WebhookSettings(url=""))
+    notifier.submit({"id": 0})
+    assert not notifier.flush(timeout=0.1)
+    assert notifier.session.requests == []
+
+
+def test_failed_batch_is_retried(tmp_path):
+    notifier = make_notifier(tmp_path, [503, 200])
+    notifier.set_settings(SETTINGS)
+    notifier.submit({"id": 0})
+    assert notifier.flush(timeout=5.0)
+    assert posted_ids(notifier) == [[0], [0]]
+    assert notifier.num_failed == 1 and notifier.num_sent == 1
+    assert notifier.last_error == "503 error"
+
+
+def test_batch_is_dropped_after_max_attempts(tmp_path):
+    notifier = make_notifier(tmp_path, [500, 500, 500])
+    notifier.set_settings(SETTINGS)
+    notifier.submit({"id": 0})
+    assert notifier.flush(timeout=5.0)
+    assert len(notifier.session.requests) == 3
+    assert notifier.num_dropped == 1 and notifier.num_sent == 0
+
+
+def test_sequence_payload_links_thumbnails(data_dir):
+    sequence = EventsSequence(sequence_id=1000)
+    for i, roi_name in enumerate(["door", "door", "garden"]):
+        sequence.add_record(
+            {
+                "datetime": f"2020-05-10 12:00:0{i}.000",
+                "labels": ["cat"],
+                "roi_name": roi_name,
+                "camera_name": "Home",
+                "thumbnail_path": str(Config.SNAPSHOTS_DIR / f"thumbnail-{i}.jpg"),
+            }
+        )
+    payload = build_sequence_payload(sequence, SETTINGS)
+    assert payload["type"] == "sequence"
+    assert payload["rois"] == ["door", "garden"]
+    assert payload["num_events"] == 3
+    assert len(payload["thumbnails"]) == 3
+    assert payload["thumbnails"][0].startswith("http://camera/")
+    assert payload["thumbnails"][0].endswith("/thumbnail-0.jpg")
+